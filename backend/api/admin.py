@@ -6,7 +6,9 @@ admin.site.register(Utilisateur)
 admin.site.register(Categorie)
 admin.site.register(Produit)
 admin.site.register(Cle)
+admin.site.register(StockCle)
 admin.site.register(MethodePaiement)
 admin.site.register(Action)
 admin.site.register(ElementAchatDevis)
 admin.site.register(EmailEchec)
+admin.site.register(Facture)
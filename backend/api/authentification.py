@@ -0,0 +1,110 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .cache import incrementer_version, version_initiale
+from .models import Utilisateur
+from .replique import lecture_principale
+
+# Champs de l'utilisateur gardés en cache : ceux que lisent l'authentification
+# et les permissions. Les autres (dont le mot de passe haché) ne quittent pas
+# la base ; ils sont différés et lus à la demande.
+CHAMPS_CACHES = ("id", "role", "is_active")
+
+
+def cle_version(utilisateur_id):
+    return f"auth:version:{utilisateur_id}"
+
+
+def cle_utilisateur(utilisateur_id):
+    return f"auth:utilisateur:{utilisateur_id}"
+
+
+def invalider_utilisateur(utilisateur_id):
+    """Rend obsolète l'utilisateur en cache, après commit."""
+    transaction.on_commit(lambda: incrementer_version(cle_version(utilisateur_id)))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    ``JWTAuthentication`` sans lecture de l'utilisateur en base à chaque
+    requête.
+
+    Les champs ``CHAMPS_CACHES`` de l'utilisateur sont gardés dans le cache
+    Redis ``AUTH_CACHE_TIMEOUT`` secondes, avec la version de son compte : toute modification de
+    l'utilisateur change la version (voir signals.py), et l'entrée cesse
+    aussitôt de servir. La version et l'entrée sont lues en un aller-retour.
+
+    Le rôle est signé dans le token à sa création (``role``) : un token émis
+    avant un changement de rôle est refusé.
+    """
+
+    def get_user(self, validated_token):
+        utilisateur_id = self._identifiant(validated_token)
+        cles = [cle_version(utilisateur_id), cle_utilisateur(utilisateur_id)]
+        valeurs = cache.get_many(cles)
+        version, entree = valeurs.get(cles[0]), valeurs.get(cles[1])
+        if version is None:
+            version = version_initiale(cles[0])
+
+        if entree is not None and entree[0] == version:
+            champs = entree[1]
+        else:
+            with lecture_principale():
+                champs = (
+                    Utilisateur.objects.filter(
+                        **{api_settings.USER_ID_FIELD: utilisateur_id}
+                    )
+                    .values(*CHAMPS_CACHES)
+                    .first()
+                )
+            cache.set(cles[1], (version, champs), settings.AUTH_CACHE_TIMEOUT)
+        return self._verifier(self._utilisateur(champs), validated_token)
+
+    async def aget_user(self, validated_token):
+        """
+        ``get_user`` pour les vues asynchrones, dans un thread : le cache et
+        l'ORM y utilisent les connexions du processus.
+        """
+        return await sync_to_async(self.get_user)(validated_token)
+
+    @staticmethod
+    def _utilisateur(champs):
+        """``Utilisateur`` construit depuis ``champs``, les autres différés."""
+        if champs is None:
+            return None
+        noms = [
+            champ.attname
+            for champ in Utilisateur._meta.concrete_fields
+            if champ.attname in champs
+        ]
+        return Utilisateur.from_db(
+            DEFAULT_DB_ALIAS, noms, [champs[nom] for nom in noms]
+        )
+
+    @staticmethod
+    def _identifiant(validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+    @staticmethod
+    def _verifier(utilisateur, validated_token):
+        # Un utilisateur supprimé est gardé en cache (None) comme les autres
+        if utilisateur is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not utilisateur.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        role = validated_token.get("role")
+        if role is not None and role != utilisateur.role:
+            raise AuthenticationFailed(
+                "Le rôle de l'utilisateur a changé, reconnectez-vous.",
+                code="role_changed",
+            )
+        return utilisateur
@@ -0,0 +1,136 @@
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from rest_framework.response import Response
+
+from .replique import lecture_principale
+
+
+def cle_version(modele):
+    return f"catalogue:version:{modele._meta.label_lower}"
+
+
+def version_initiale(cle):
+    # Une version initiale horodatée ne recroise jamais une ancienne entrée
+    cache.add(cle, time.time_ns(), None)
+    return cache.get(cle)
+
+
+def incrementer_version(cle):
+    try:
+        cache.incr(cle)
+    except ValueError:
+        cache.set(cle, time.time_ns(), None)
+
+
+def versions_catalogue(modeles):
+    """Retourne la version courante de chaque modèle, en un seul aller-retour."""
+    cles = [cle_version(modele) for modele in modeles]
+    versions = cache.get_many(cles)
+    for cle in cles:
+        if cle not in versions:
+            versions[cle] = version_initiale(cle)
+    return [versions[cle] for cle in cles]
+
+
+def cle_reponse(versions, url):
+    return hashlib.sha1(f"{versions}:{url}".encode()).hexdigest()
+
+
+def invalider_catalogue(modele):
+    """Invalide les réponses en cache qui dépendent de ``modele``, après commit."""
+
+    transaction.on_commit(lambda: incrementer_version(cle_version(modele)))
+
+
+def _consulter_catalogue(request, modeles):
+    """
+    Clé de cache, ETag et données en cache de la réponse GET ``request``.
+
+    Retourne ``(cle, etag, a_jour, donnees)`` ; si le client possède déjà
+    cette version (``If-None-Match``), ``a_jour`` est vrai et le cache n'est
+    pas lu.
+    """
+    cle = cle_reponse(versions_catalogue(modeles), request.build_absolute_uri())
+    etag = f'"{cle}"'
+    if etag in request.headers.get("If-None-Match", ""):
+        return cle, etag, True, None
+    return cle, etag, False, cache.get(f"catalogue:reponse:{cle}")
+
+
+def lire_catalogue(request, modeles, calculer):
+    """
+    Données de la réponse GET d'une vue du catalogue, et son ETag.
+
+    La clé dépend de l'URL complète et de la version des ``modeles`` ; toute
+    écriture sur l'un d'eux change la version, ce qui rend obsolètes les
+    entrées précédentes. En cas d'absence, ``calculer()`` lit les données
+    sur la base principale. Les données valent None si le client possède
+    déjà cette version : la réponse est alors un 304.
+    """
+    cle, etag, a_jour, donnees = _consulter_catalogue(request, modeles)
+    if a_jour:
+        return None, etag
+    if donnees is None:
+        with lecture_principale():
+            donnees = calculer()
+        cache.set(f"catalogue:reponse:{cle}", donnees, settings.CATALOGUE_CACHE_TIMEOUT)
+    return donnees, etag
+
+
+async def alire_catalogue(request, modeles, calculer):
+    """
+    ``lire_catalogue`` pour les vues asynchrones : ``calculer`` est une
+    coroutine (ORM asynchrone).
+
+    Le cache est lu par le client Redis du processus, dans un thread, comme
+    le font les méthodes ``a*()`` du cache de Django : aucun client n'est
+    créé par boucle d'événements.
+    """
+    cle, etag, a_jour, donnees = await sync_to_async(_consulter_catalogue)(
+        request, modeles
+    )
+    if a_jour:
+        return None, etag
+    if donnees is None:
+        with lecture_principale():
+            donnees = await calculer()
+        await cache.aset(
+            f"catalogue:reponse:{cle}", donnees, settings.CATALOGUE_CACHE_TIMEOUT
+        )
+    return donnees, etag
+
+
+def entetes_catalogue(response, etag):
+    """ETag et revalidation obligatoire d'une réponse du catalogue."""
+    response["ETag"] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+class CatalogueCacheMixin:
+    """
+    Met en cache les réponses GET d'une vue du catalogue (voir
+    ``lire_catalogue``). L'ETag est dérivé de la clé : un client qui le
+    renvoie dans ``If-None-Match`` reçoit un 304 sans que la réponse soit
+    relue.
+    """
+
+    cache_modeles = ()
+    throttle_scope = "catalogue"
+    lecture_replique = True
+
+    def get(self, request, *args, **kwargs):
+        lire = super().get
+        donnees, etag = lire_catalogue(
+            request,
+            self.cache_modeles,
+            lambda: lire(request, *args, **kwargs).data,
+        )
+        response = Response(status=304) if donnees is None else Response(donnees)
+        return entetes_catalogue(response, etag)
@@ -0,0 +1,155 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.fields.files import FieldFile
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .instrumentation import mesurer_serialisation
+
+PARAMETRE_CHAMPS = OpenApiParameter(
+    name="fields",
+    description="Champs à renvoyer, séparés par des virgules (tous par défaut).",
+    required=False,
+    type=str,
+)
+
+# Champs dont la représentation JSON est la valeur lue en base
+REPRESENTATION_DIRECTE = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.IntegerField,
+    serializers.PrimaryKeyRelatedField,
+    serializers.ReadOnlyField,
+)
+
+
+def champs_demandes(request):
+    """Noms passés dans ``?fields=`` pour une lecture, ou None."""
+    if request is None or request.method != "GET":
+        return None
+    valeur = request.query_params.get("fields")
+    if not valeur:
+        return None
+    return [nom.strip() for nom in valeur.split(",") if nom.strip()]
+
+
+class ChampsSelectionnablesMixin:
+    """
+    Restreint un serializer aux champs demandés par ``?fields=`` (ou par
+    l'argument ``champs``) ; un nom inconnu donne une erreur 400.
+    """
+
+    def __init__(self, *args, **kwargs):
+        champs = kwargs.pop("champs", None)
+        super().__init__(*args, **kwargs)
+        if champs is None:
+            champs = champs_demandes(self.context.get("request"))
+        if champs is None:
+            return
+
+        inconnus = set(champs) - set(self.fields)
+        if inconnus:
+            raise serializers.ValidationError(
+                {"fields": f"Champs inconnus: {', '.join(sorted(inconnus))}."}
+            )
+        for nom in set(self.fields) - set(champs):
+            self.fields.pop(nom)
+
+
+class LecteurValeurs:
+    """
+    Sérialisation en lecture seule à partir de ``QuerySet.values()``.
+
+    Reproduit la sortie d'un ``ModelSerializer`` dont tous les champs
+    correspondent à une colonne du modèle, sans instancier de modèle ni
+    appeler le serializer ligne par ligne ; ``disponible`` est faux dans les
+    autres cas (relation inverse, source calculée...).
+    """
+
+    def __init__(self, serializer):
+        modele = serializer.Meta.model
+        self.colonnes = {}
+        self.convertisseurs = {}
+        self.disponible = True
+        for nom, champ in serializer.fields.items():
+            if champ.write_only:
+                continue
+            try:
+                champ_modele = modele._meta.get_field(champ.source)
+            except FieldDoesNotExist:
+                self.disponible = False
+                return
+            if not champ_modele.concrete or champ_modele.many_to_many:
+                self.disponible = False
+                return
+            self.colonnes[nom] = champ.source
+            self.convertisseurs[nom] = self._convertisseur(champ, champ_modele)
+
+    @staticmethod
+    def _convertisseur(champ, champ_modele):
+        if isinstance(champ, serializers.FileField):
+            return lambda valeur: champ.to_representation(
+                FieldFile(None, champ_modele, valeur)
+            )
+        if isinstance(champ, REPRESENTATION_DIRECTE):
+            return None
+        return champ.to_representation
+
+    def convertir(self, lignes):
+        colonnes = list(self.colonnes.items())
+        convertisseurs = self.convertisseurs
+        resultat = []
+        for ligne in lignes:
+            donnees = {}
+            for nom, source in colonnes:
+                valeur = ligne[source]
+                convertir = convertisseurs[nom]
+                if valeur is not None and convertir is not None:
+                    valeur = convertir(valeur)
+                donnees[nom] = valeur
+            resultat.append(donnees)
+        return resultat
+
+
+class ListeRapideMixin:
+    """
+    Vue générique dont les listes GET sont lues par ``.values()``.
+
+    Le serializer (restreint par ``?fields=``) ne sert qu'à choisir les
+    colonnes et leur conversion ; les autres lectures chargent seulement les
+    colonnes demandées grâce à ``only()``.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        champs = champs_demandes(self.request)
+        if champs is not None:
+            lecteur = LecteurValeurs(self.get_serializer())
+            if lecteur.disponible:
+                queryset = queryset.only(*lecteur.colonnes.values())
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        lecteur = LecteurValeurs(self.get_serializer())
+        if not lecteur.disponible:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.valeurs(self.filter_queryset(self.get_queryset()), lecteur)
+        page = self.paginate_queryset(queryset)
+        with mesurer_serialisation(request):
+            donnees = lecteur.convertir(queryset if page is None else page)
+        if page is not None:
+            return self.get_paginated_response(donnees)
+        return Response(donnees)
+
+    def valeurs(self, queryset, lecteur):
+        # Les critères de tri sont lus aussi : la pagination par curseur
+        # en a besoin pour calculer la position de la page suivante
+        ordre = [
+            champ.lstrip("-")
+            for champ in getattr(self, "ordering", None) or ()
+            if champ.lstrip("-") not in ("pk", "id")
+        ]
+        colonnes = set(lecteur.colonnes.values()) | set(ordre) | {"id"}
+        return queryset.values(*colonnes)
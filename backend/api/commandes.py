@@ -0,0 +1,295 @@
+import json
+import logging
+import time
+from collections import defaultdict
+
+import redis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .metriques import ACTIONS_CREEES, RESERVATION_CLES
+from .models import Cle, CommandeEnAttente, Produit, StockInsuffisant
+from .serializers import ActionSerializer, ElementAchatDevisSerializer
+
+logger = logging.getLogger(__name__)
+
+TRAITEMENT_PLANIFIE = "commandes:traitement"
+
+
+class CommandeInvalide(Exception):
+    """Commande refusée ; ``erreurs`` est le corps de la réponse 400."""
+
+    def __init__(self, erreurs):
+        self.erreurs = erreurs
+        super().__init__(erreurs)
+
+
+class Commande:
+    """Commande validée, prête à être créée."""
+
+    def __init__(self, type_action, action, elements, produits):
+        self.type = type_action
+        self.action = action
+        self.elements = elements
+        self.produits = produits
+
+    @property
+    def est_achat(self):
+        return self.type == "ACHAT"
+
+    def demandes(self):
+        """Quantité de clés voulue par produit."""
+        demandes = defaultdict(int)
+        for element in self.elements.validated_data:
+            demandes[element["produit"].id] += element.get("quantite", 1)
+        return demandes
+
+
+def valider_commande(donnees):
+    """
+    Validation d'une commande sans transaction ni verrou : structure, type,
+    produits, action et lignes. Lève ``CommandeInvalide``.
+    """
+    action_data = donnees.get("action")
+    produits_data = donnees.get("produits")
+    if not action_data or not produits_data:
+        raise CommandeInvalide(
+            {"error": "Données incomplètes. Action et produits requis."}
+        )
+
+    type_action = str(action_data.get("type", "")).upper()
+    if type_action not in ["ACHAT", "DEVIS"]:
+        raise CommandeInvalide(
+            {"error": "Type d'action invalide. Doit être 'ACHAT' ou 'DEVIS'."}
+        )
+
+    # Préchargement des produits en une seule requête
+    produit_ids = {str(item.get("produit")) for item in produits_data}
+    produits = {
+        str(p.id): p
+        for p in Produit.objects.filter(id__in=[i for i in produit_ids if i.isdigit()])
+    }
+    if len(produits) != len(produit_ids):
+        raise CommandeInvalide({"error": "Certains produits n'existent pas."})
+
+    action = ActionSerializer(data=action_data)
+    if not action.is_valid():
+        raise CommandeInvalide(action.errors)
+
+    # Les lignes sont rattachées à l'action à l'enregistrement
+    elements = ElementAchatDevisSerializer(
+        data=[{**item, "action": None} for item in produits_data], many=True
+    )
+    if not elements.is_valid():
+        raise CommandeInvalide(elements.errors)
+
+    return Commande(type_action, action, elements, produits)
+
+
+def creer_action(commande, vendeur, cles_reservees=None):
+    """
+    Crée l'action d'une commande validée, dans la transaction de l'appelant.
+
+    Les clés d'un achat sont réservées ici, sauf si ``cles_reservees`` les
+    fournit déjà. Lève ``CommandeInvalide`` si le stock ne suffit pas :
+    l'appelant doit alors annuler sa transaction (ou son point de sauvegarde).
+    Retourne le corps de la réponse.
+    """
+    if commande.est_achat and cles_reservees is None:
+        cles_reservees = reserver_cles(commande.demandes(), commande.produits)
+
+    action = commande.action.save(vendeur=vendeur)
+    commande.elements.save(action=action)
+
+    # Préparer les données pour l'email
+    cles_selectionnees = {}
+    if commande.est_achat:
+        for produit_id, cles in cles_reservees.items():
+            produit = commande.produits[str(produit_id)]
+            cles_selectionnees.setdefault(produit.nom, []).extend(cles)
+    else:
+        for element in commande.elements.validated_data:
+            cles_selectionnees[element["produit"].nom] = [
+                {
+                    "id": None,
+                    "contenue": "À attribuer lors de l'achat",
+                    "code_cle": "N/A",
+                    "validite": "N/A",
+                }
+                for _ in range(element.get("quantite", 1))
+            ]
+
+    from .tasks import planifier_envoi_facture
+
+    # Envoyer l'email de manière asynchrone, une fois l'action validée
+    transaction.on_commit(
+        lambda: planifier_envoi_facture(
+            client_id=action.client_id,
+            action_id=action.id,
+            cles_data=cles_selectionnees,
+        )
+    )
+    transaction.on_commit(lambda: ACTIONS_CREEES.inc(type=action.type))
+
+    message = "Action créée avec succès. "
+    if commande.est_achat:
+        message += "Les clés ont été envoyées par email."
+    else:
+        message += "Le devis a été envoyé par email."
+    return {"detail": message, "action_id": action.id, "cles": cles_selectionnees}
+
+
+def reserver_cles(demandes, produits):
+    """``Cle.objects.reserver`` avec mesure de la latence et message d'erreur."""
+    debut = time.perf_counter()
+    try:
+        cles = Cle.objects.reserver(demandes)
+    except StockInsuffisant as e:
+        RESERVATION_CLES.observer(
+            time.perf_counter() - debut, resultat="stock_insuffisant"
+        )
+        produit = produits[str(e.produit_id)]
+        raise CommandeInvalide(
+            {
+                "error": f"Pas assez de clés disponibles pour {produit.nom}. "
+                f"Seulement {e.disponibles} disponible(s) pour {e.demandees} "
+                "demandée(s)."
+            }
+        )
+    RESERVATION_CLES.observer(time.perf_counter() - debut, resultat="ok")
+    return cles
+
+
+# Mode asynchrone : file de commandes en base, vidée par micro-lots
+
+
+def mettre_en_attente(donnees, vendeur):
+    """Enregistre une commande validée et planifie son traitement."""
+    commande = CommandeEnAttente.objects.create(
+        vendeur=vendeur, donnees=json.dumps(donnees, cls=DjangoJSONEncoder)
+    )
+    transaction.on_commit(planifier_traitement)
+    return commande
+
+
+def _redis():
+    return redis.Redis.from_url(settings.COMMANDES_FILE_URL)
+
+
+def planifier_traitement():
+    """
+    Planifie un traitement de la file, sauf s'il y en a déjà un de prévu :
+    les commandes reçues entre-temps sont traitées dans le même lot.
+    """
+    from .tasks import traiter_commandes
+
+    delai = settings.COMMANDES_DELAI_LOT
+    if _redis().set(TRAITEMENT_PLANIFIE, 1, nx=True, ex=max(int(delai * 10), 10)):
+        traiter_commandes.apply_async(countdown=delai)
+
+
+def liberer_traitement():
+    _redis().delete(TRAITEMENT_PLANIFIE)
+
+
+def traiter_lot(taille_lot):
+    """
+    Crée les actions d'un lot de commandes en attente, en une transaction.
+
+    Les commandes sont verrouillées avec SKIP LOCKED : plusieurs consommateurs
+    se partagent la file. Les clés de tous les achats du lot sont réservées en
+    une seule requête ; si le stock ne suffit pas pour tout le lot, chaque
+    achat réserve les siennes. Chaque commande est créée dans un point de
+    sauvegarde : un refus n'annule pas les autres. Retourne le nombre de
+    commandes traitées.
+    """
+    with transaction.atomic():
+        en_attente = list(
+            CommandeEnAttente.objects.filter(statut=CommandeEnAttente.EN_ATTENTE)
+            .select_related("vendeur")
+            .select_for_update(skip_locked=True, of=("self",))
+            .order_by("id")[:taille_lot]
+        )
+        if not en_attente:
+            return 0
+
+        valides = []
+        for commande_en_attente in en_attente:
+            try:
+                commande = valider_commande(json.loads(commande_en_attente.donnees))
+            except CommandeInvalide as e:
+                commande_en_attente.terminer(CommandeEnAttente.REFUSEE, e.erreurs)
+            else:
+                valides.append((commande_en_attente, commande))
+
+        achats = [commande for _, commande in valides if commande.est_achat]
+        reserve = _reserver_lot(achats)
+
+        for commande_en_attente, commande in valides:
+            cles = (
+                _prelever(reserve, commande) if reserve and commande.est_achat else None
+            )
+            try:
+                with transaction.atomic():
+                    resultat = creer_action(commande, commande_en_attente.vendeur, cles)
+            except CommandeInvalide as e:
+                commande_en_attente.terminer(CommandeEnAttente.REFUSEE, e.erreurs)
+                continue
+            except Exception as e:
+                logger.error(
+                    f"Erreur lors du traitement de la commande "
+                    f"{commande_en_attente.id}: {str(e)}"
+                )
+                if cles:
+                    _liberer(cles)
+                commande_en_attente.terminer(
+                    CommandeEnAttente.REFUSEE,
+                    {"error": "Erreur lors de la création de l'action."},
+                )
+                continue
+            commande_en_attente.terminer(
+                CommandeEnAttente.TRAITEE, resultat, resultat["action_id"]
+            )
+
+        CommandeEnAttente.objects.bulk_update(
+            en_attente, ["statut", "action", "resultat", "date_traitement"]
+        )
+    return len(en_attente)
+
+
+def _reserver_lot(achats):
+    """Clés de tous les achats en une requête, ou None si le stock manque."""
+    if not achats:
+        return None
+    demandes = defaultdict(int)
+    produits = {}
+    for commande in achats:
+        produits.update(commande.produits)
+        for produit_id, quantite in commande.demandes().items():
+            demandes[produit_id] += quantite
+    try:
+        with transaction.atomic():
+            return reserver_cles(demandes, produits)
+    except CommandeInvalide:
+        return None
+
+
+def _prelever(reserve, commande):
+    return {
+        produit_id: [reserve[produit_id].pop(0) for _ in range(quantite)]
+        for produit_id, quantite in commande.demandes().items()
+    }
+
+
+def _liberer(cles_par_produit):
+    """Rend disponibles des clés réservées pour une commande abandonnée."""
+    Cle.objects.filter(
+        id__in=[cle["id"] for cles in cles_par_produit.values() for cle in cles]
+    ).update(disponiblite=True)
+
+
+def commandes_en_attente():
+    return CommandeEnAttente.objects.filter(
+        statut=CommandeEnAttente.EN_ATTENTE
+    ).exists()
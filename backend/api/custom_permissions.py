@@ -1,3 +1,6 @@
+import hmac
+
+from django.conf import settings
 from rest_framework import permissions
 
 
@@ -35,3 +38,17 @@ class IsVendeur(permissions.BasePermission):
             and request.user.is_authenticated
             and request.user.role == "vendeur"
         )
+
+
+class IsAdminOrJetonMetriques(permissions.BasePermission):
+    """
+    Administrateur, ou collecteur de métriques présentant l'en-tête
+    ``Authorization: Jeton <METRIQUES_JETON>``.
+    """
+
+    def has_permission(self, request, view):
+        jeton = settings.METRIQUES_JETON
+        entete = request.META.get("HTTP_AUTHORIZATION", "")
+        if jeton and hmac.compare_digest(entete.encode(), f"Jeton {jeton}".encode()):
+            return True
+        return IsAdmin().has_permission(request, view)
@@ -0,0 +1,181 @@
+import logging
+import smtplib
+import threading
+from functools import lru_cache
+
+import redis
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+logger = logging.getLogger(__name__)
+
+FILE_FACTURES = "emails:factures"
+VIDAGE_PLANIFIE = "emails:factures:vidage"
+
+# Une connexion SMTP par thread (ou par greenlet sous gevent, qui remplace
+# threading.local) ; _connexions les garde toutes pour les fermer à l'arrêt
+_local = threading.local()
+_verrou = threading.Lock()
+_connexions = set()
+
+
+def construire_email(action, client, cles_data, pdf):
+    """Message (facture ou devis) d'une action, avec le PDF en pièce jointe."""
+    if action.type.upper() == "ACHAT":
+        sujet = f"Votre facture et clés d'activation - Commande #{action.code_action}"
+        corps_message = f"""
+            Bonjour {client.nom_complet},
+
+            Nous vous remercions pour votre achat (Commande #{action.code_action}).
+
+            Veuillez trouver ci-joint votre facture contenant les clés d'activation pour les produits achetés.
+
+            En cas de problème avec vos clés, n'hésitez pas à contacter notre service client.
+
+            Cordialement,
+            L'équipe EJ Logiciel
+            """
+        nom_fichier = f"facture_{action.code_action}.pdf"
+    else:
+        sujet = f"Votre devis - Référence #{action.code_action}"
+        corps_message = f"""
+            Bonjour {client.nom_complet},
+
+            Suite à votre demande, veuillez trouver ci-joint votre devis (Réf: #{action.code_action}).
+
+            Ce devis est valable pour une durée de 30 jours à compter de sa date d'émission.
+
+            Pour toute question ou pour valider ce devis, n'hésitez pas à nous contacter.
+
+            Cordialement,
+            L'équipe EJ Logiciel
+            """
+        nom_fichier = f"devis_{action.code_action}.pdf"
+
+    email = EmailMessage(subject=sujet, body=corps_message, to=[client.email])
+    email.attach(nom_fichier, pdf, "application/pdf")
+    return email
+
+
+def _est_vivante(connexion):
+    """Vérifie par un NOOP que le serveur SMTP répond encore."""
+    smtp = getattr(connexion, "connection", False)
+    if smtp is False:
+        # Backend sans connexion réseau (console, mémoire, fichier)
+        return True
+    if smtp is None:
+        return False
+    try:
+        return smtp.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
+
+def _fermer(connexion):
+    try:
+        connexion.close()
+    except Exception as e:
+        logger.warning(f"Fermeture de la connexion SMTP impossible: {str(e)}")
+
+
+def connexion_email(reouvrir=False):
+    """
+    Connexion SMTP du thread courant, gardée d'une tâche à l'autre.
+
+    Elle est vérifiée à chaque emprunt et rouverte si le serveur l'a fermée
+    (ou si ``reouvrir`` est vrai), ce qui évite une poignée de main TLS et une
+    authentification par message. Chaque thread a la sienne : sous un pool
+    de threads, une reconnexion ne ferme pas la connexion sur laquelle un
+    autre thread est en train d'envoyer.
+    """
+    connexion = getattr(_local, "connexion", None)
+    if connexion is not None and (reouvrir or not _est_vivante(connexion)):
+        with _verrou:
+            _connexions.discard(connexion)
+        _fermer(connexion)
+        connexion = _local.connexion = None
+    if connexion is None:
+        connexion = get_connection(fail_silently=False)
+        connexion.open()
+        with _verrou:
+            _connexions.add(connexion)
+        _local.connexion = connexion
+    return connexion
+
+
+@worker_process_shutdown.connect
+def fermer_connexion_email(**kwargs):
+    with _verrou:
+        connexions = list(_connexions)
+        _connexions.clear()
+    for connexion in connexions:
+        _fermer(connexion)
+    _local.connexion = None
+
+
+def _connexion_perdue(erreur):
+    # SMTPException hérite d'OSError : seules les erreurs réseau et la
+    # déconnexion du serveur justifient une reconnexion
+    if isinstance(erreur, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(erreur, OSError) and not isinstance(erreur, smtplib.SMTPException)
+
+
+def envoyer_messages(messages):
+    """
+    Envoie ``messages`` sur la connexion du thread courant.
+
+    Les messages partent un par un sur la même connexion pour savoir
+    exactement lesquels ont échoué. Si la connexion tombe, elle est rouverte
+    et le message en cours est retenté une fois. Retourne la liste des
+    couples ``(indice, erreur)`` des messages non envoyés.
+    """
+    echecs = []
+    try:
+        connexion = connexion_email()
+    except Exception as e:
+        logger.error(f"Connexion SMTP impossible: {str(e)}")
+        return [(indice, e) for indice in range(len(messages))]
+
+    for indice, message in enumerate(messages):
+        try:
+            connexion.send_messages([message])
+        except Exception as e:
+            if not _connexion_perdue(e):
+                echecs.append((indice, e))
+                continue
+            logger.warning(f"Connexion SMTP perdue, reconnexion: {str(e)}")
+            try:
+                connexion = connexion_email(reouvrir=True)
+                connexion.send_messages([message])
+            except Exception as e:
+                echecs.append((indice, e))
+    return echecs
+
+
+@lru_cache(maxsize=1)
+def _redis():
+    return redis.Redis.from_url(settings.EMAIL_FILE_ATTENTE_URL)
+
+
+def mettre_facture_en_attente(facture_id):
+    _redis().rpush(FILE_FACTURES, facture_id)
+
+
+def prendre_factures(nombre):
+    """Retire jusqu'à ``nombre`` factures de la file, dans l'ordre d'arrivée."""
+    return [int(valeur) for valeur in _redis().lpop(FILE_FACTURES, nombre) or []]
+
+
+def factures_en_attente():
+    return _redis().llen(FILE_FACTURES)
+
+
+def reserver_vidage(delai):
+    """Vrai si aucun vidage de la file n'est déjà planifié dans les ``delai`` s."""
+    return bool(_redis().set(VIDAGE_PLANIFIE, 1, nx=True, ex=delai))
+
+
+def liberer_vidage():
+    _redis().delete(VIDAGE_PLANIFIE)
@@ -0,0 +1,234 @@
+import io
+import os
+import uuid
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils.timezone import localtime
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from .models import Facture
+
+LARGEUR, HAUTEUR = A4
+MARGE_GAUCHE = 1 * cm
+MARGE_DROITE = LARGEUR - (1 * cm)
+
+COL1 = MARGE_GAUCHE
+COL2 = LARGEUR * 0.55  # 55% de la largeur
+COL3 = LARGEUR * 0.7  # 70% de la largeur
+COL4 = LARGEUR * 0.85  # 85% de la largeur
+
+
+@lru_cache(maxsize=4)
+def _logo(chemin):
+    """
+    Logo lu et décodé une seule fois par processus, ou None s'il est absent.
+
+    ``drawImage`` accepte directement l'``ImageReader`` : chaque facture
+    réutilise l'image déjà chargée en mémoire au lieu de relire le fichier.
+    """
+    if not os.path.exists(chemin):
+        return None
+    logo = ImageReader(chemin)
+    # Décodage immédiat : drawImage en calcule l'empreinte à chaque document
+    logo.getRGBData()
+    return logo
+
+
+def _definir_entete(p):
+    """Logo et coordonnées de l'entreprise, identiques sur toutes les factures."""
+    p.beginForm("entete")
+    logo = _logo(settings.FACTURE_LOGO)
+    if logo is not None:
+        p.drawImage(
+            logo,
+            MARGE_GAUCHE,
+            HAUTEUR - 3 * cm,
+            width=5 * cm,
+            height=2.5 * cm,
+        )
+    else:
+        p.setFont("Helvetica-Bold", 24)
+        p.drawString(MARGE_GAUCHE, HAUTEUR - 2.5 * cm, "EJ Logiciel")
+
+    position_y = HAUTEUR - 4 * cm
+    p.setFont("Helvetica", 10)
+    for ligne in (
+        "EJ Logiciel",
+        "Antananarivo, Madagascar",
+        "Tel: +261 34 12 345 67",
+        f"Email: {settings.EMAIL_HOST_USER}",
+        "Web: www.ejlogiciel.com",
+    ):
+        p.drawString(MARGE_GAUCHE, position_y, ligne)
+        position_y -= 0.5 * cm
+    p.endForm()
+
+
+def _definir_pied(p):
+    p.beginForm("pied")
+    p.setFont("Helvetica", 8)
+    p.drawCentredString(LARGEUR / 2, 1 * cm, "EJ Logiciel - Tous droits réservés")
+    p.endForm()
+
+
+def _entete_tableau(p, position_y):
+    p.setFont("Helvetica-Bold", 10)
+    p.drawString(COL1, position_y, "Produit")
+    p.drawString(COL2, position_y, "Quantité")
+    p.drawString(COL3, position_y, "Prix")
+    p.drawString(COL4, position_y, "Total")
+    position_y -= 0.5 * cm
+
+    p.setStrokeColor(colors.black)
+    p.line(MARGE_GAUCHE, position_y, MARGE_DROITE, position_y)
+    return position_y - 0.7 * cm
+
+
+def _dessiner(p, action, client, cles_data):
+    est_achat = action.type.upper() == "ACHAT"
+    email = settings.EMAIL_HOST_USER
+
+    p.doForm("entete")
+
+    position_y = HAUTEUR - 1 * cm
+    titre = "FACTURE" if est_achat else "DEVIS"
+    p.setFont("Helvetica-Bold", 18)
+    titre_texte = f"{titre} #{action.code_action}"
+    titre_width = p.stringWidth(titre_texte, "Helvetica-Bold", 18)
+    p.drawString((LARGEUR - titre_width) / 2, position_y, titre_texte)
+    position_y -= 6 * cm
+
+    p.setFont("Helvetica", 10)
+    date_text = f"Date: {localtime(action.date_action).strftime('%d-%m-%Y')}"
+    ref_text = f"Réf: {action.code_action}"
+    date_width = p.stringWidth(date_text, "Helvetica", 10)
+    ref_width = p.stringWidth(ref_text, "Helvetica", 10)
+
+    p.drawString(MARGE_DROITE - date_width, HAUTEUR - 3 * cm, date_text)
+    p.drawString(MARGE_DROITE - ref_width, HAUTEUR - 3.5 * cm, ref_text)
+
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(MARGE_GAUCHE, position_y, "INFORMATIONS CLIENT")
+    position_y -= 0.7 * cm
+
+    p.setFont("Helvetica", 10)
+    p.drawString(MARGE_GAUCHE, position_y, f"Nom: {client.nom_complet}")
+    position_y -= 0.5 * cm
+    p.drawString(MARGE_GAUCHE, position_y, f"Email: {client.email}")
+    position_y -= 0.5 * cm
+    p.drawString(MARGE_GAUCHE, position_y, f"Téléphone: {client.numero_telephone}")
+    position_y -= 0.5 * cm
+    p.drawString(MARGE_GAUCHE, position_y, f"Adresse: {client.adresse}")
+    position_y -= 1 * cm
+
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(MARGE_GAUCHE, position_y, "DÉTAILS DES PRODUITS")
+    position_y -= 1 * cm
+    position_y = _entete_tableau(p, position_y)
+
+    nombre_cles = sum(len(cles) for cles in cles_data.values())
+    prix_unitaire = action.prix / nombre_cles if nombre_cles else 0
+
+    for produit_nom, cles in cles_data.items():
+        quantite = len(cles)
+        prix_total = prix_unitaire * quantite
+
+        p.setFont("Helvetica", 10)
+        produit_nom_affiche = produit_nom
+        if len(produit_nom) > 40:
+            produit_nom_affiche = produit_nom[:37] + "..."
+
+        p.drawString(COL1, position_y, produit_nom_affiche)
+        p.drawRightString(COL2 + 1 * cm, position_y, str(quantite))
+        p.drawRightString(COL3 + 1 * cm, position_y, f"{prix_unitaire:.2f} MGA")
+        p.drawRightString(COL4 + 1 * cm, position_y, f"{prix_total:.2f} MGA")
+
+        if est_achat:
+            p.setFont("Helvetica", 8)
+            for i, cle in enumerate(cles):
+                position_y -= 0.4 * cm
+                cle_text = f"Clé {i+1}: {cle['contenue']} (Validité: {cle['validite']})"
+                if len(cle_text) > 80:
+                    cle_text = cle_text[:77] + "..."
+                p.drawString(COL1 + 0.5 * cm, position_y, cle_text)
+
+        position_y -= 0.8 * cm
+
+        if position_y < 5 * cm:
+            p.doForm("pied")
+            p.showPage()
+            position_y = HAUTEUR - 3 * cm
+            p.setFont("Helvetica-Bold", 12)
+            p.drawString(MARGE_GAUCHE, position_y, "DÉTAILS DES PRODUITS (suite)")
+            position_y -= 1 * cm
+            position_y = _entete_tableau(p, position_y)
+
+    p.line(MARGE_GAUCHE, position_y, MARGE_DROITE, position_y)
+    position_y -= 1 * cm
+
+    p.setFont("Helvetica-Bold", 12)
+    p.drawRightString(COL3 + 1 * cm, position_y, "Total:")
+    p.drawRightString(COL4 + 1 * cm, position_y, f"{action.prix:.2f} MGA")
+    position_y -= 2 * cm
+
+    # Conditions et notes
+    p.setFont("Helvetica-Bold", 10)
+    p.drawString(MARGE_GAUCHE, position_y, "CONDITIONS ET NOTES:")
+    position_y -= 0.5 * cm
+    p.setFont("Helvetica", 8)
+
+    if est_achat:
+        notes = (
+            "• Les clés d'activation sont à usage unique et ne peuvent pas être remboursées.",
+            f"• Support technique disponible à {email}",
+            "• Merci pour votre achat!",
+        )
+    else:
+        notes = (
+            "• Ce devis est valable pour une durée de 30 jours à compter de sa date d'émission.",
+            f"• Pour accepter ce devis, veuillez nous contacter à {email}",
+        )
+    for note in notes:
+        p.drawString(MARGE_GAUCHE, position_y, note)
+        position_y -= 0.5 * cm
+
+    p.doForm("pied")
+    p.showPage()
+
+
+def rendre_facture(action, client, cles_data):
+    """Retourne le PDF (bytes) de la facture ou du devis d'une action."""
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer, pagesize=A4)
+    # Les formes PDF sont propres à un document : définies une fois, elles
+    # sont ensuite seulement référencées sur chaque page.
+    _definir_entete(p)
+    _definir_pied(p)
+    _dessiner(p, action, client, cles_data)
+    p.save()
+    return buffer.getvalue()
+
+
+def enregistrer_facture(action, client, cles_data):
+    """Rend le PDF d'une action et l'enregistre ; retourne la ``Facture``."""
+    pdf = rendre_facture(action, client, cles_data)
+    facture, _ = Facture.objects.get_or_create(
+        action=action, defaults={"cles_data": cles_data}
+    )
+    if facture.fichier:
+        facture.fichier.delete(save=False)
+    facture.cles_data = cles_data
+    # Nom aléatoire : le PDF contient les clés d'activation du client
+    facture.fichier.save(f"{uuid.uuid4().hex}.pdf", ContentFile(pdf), save=True)
+    return facture
+
+
+def lire_facture(facture):
+    with facture.fichier.open("rb") as fichier:
+        return fichier.read()
@@ -0,0 +1,36 @@
+from datetime import datetime, time, timedelta
+
+import django_filters
+from django.utils import timezone
+
+from .models import Action
+
+
+def debut_du_jour(jour):
+    return timezone.make_aware(datetime.combine(jour, time.min))
+
+
+class ActionFilter(django_filters.FilterSet):
+    """
+    Filtres de l'historique des actions.
+
+    Les bornes de dates sont converties en instants pour que la requête
+    reste une comparaison directe sur ``date_action`` (indexée).
+    """
+
+    date_debut = django_filters.DateFilter(
+        method="filtrer_date_debut", label="Premier jour (AAAA-MM-JJ)"
+    )
+    date_fin = django_filters.DateFilter(
+        method="filtrer_date_fin", label="Dernier jour inclus (AAAA-MM-JJ)"
+    )
+
+    class Meta:
+        model = Action
+        fields = ["client", "vendeur", "type", "livree", "payee"]
+
+    def filtrer_date_debut(self, queryset, name, value):
+        return queryset.filter(date_action__gte=debut_du_jour(value))
+
+    def filtrer_date_fin(self, queryset, name, value):
+        return queryset.filter(date_action__lt=debut_du_jour(value + timedelta(days=1)))
@@ -0,0 +1,172 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework.response import Response
+
+from .models import CleIdempotence
+
+ENTETE = "Idempotency-Key"
+# En-têtes de la réponse enregistrés et renvoyés avec elle
+ENTETES_REJOUES = ("Location", "Content-Location")
+
+PARAMETRE_IDEMPOTENCE = OpenApiParameter(
+    name=ENTETE,
+    location=OpenApiParameter.HEADER,
+    description="Identifiant unique de la requête (255 caractères au plus). Une "
+    "requête renvoyée avec la même clé reçoit la réponse d'origine, sans être "
+    "exécutée une seconde fois.",
+    required=False,
+    type=str,
+)
+
+
+def _empreinte(request):
+    contenu = json.dumps(request.data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{request.path}\n{contenu}".encode()).hexdigest()
+
+
+def _cle_cache(utilisateur_id, cle):
+    return f"idempotence:{utilisateur_id}:{hashlib.sha256(cle.encode()).hexdigest()}"
+
+
+def _rejouer(enregistrement, empreinte):
+    if enregistrement["empreinte"] != empreinte:
+        return Response(
+            {
+                "error": "Cette clé d'idempotence a déjà servi pour une requête "
+                "différente."
+            },
+            status=422,
+        )
+    response = Response(enregistrement["reponse"], status=enregistrement["statut"])
+    # Enregistrements antérieurs à la conservation des en-têtes : sans
+    for nom, valeur in enregistrement.get("entetes", {}).items():
+        response[nom] = valeur
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _en_cours():
+    response = Response(
+        {"error": "Une requête avec cette clé d'idempotence est en cours."},
+        status=409,
+    )
+    response["Retry-After"] = "1"
+    return response
+
+
+def _reserver(utilisateur, cle, empreinte):
+    """
+    Enregistre la clé avant l'exécution de la requête.
+
+    Retourne ``(demande, reservee)`` : ``reservee`` est faux si la clé est
+    déjà traitée, sert à une autre requête, ou est réservée par une requête
+    qui n'a pas dépassé le délai de traitement.
+    """
+    maintenant = timezone.now()
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return (
+                    CleIdempotence.objects.create(
+                        utilisateur=utilisateur,
+                        cle=cle,
+                        empreinte=empreinte,
+                        date_expiration=maintenant
+                        + timedelta(seconds=settings.IDEMPOTENCE_DUREE),
+                    ),
+                    True,
+                )
+        except IntegrityError:
+            pass
+
+        demande = CleIdempotence.objects.filter(
+            utilisateur=utilisateur, cle=cle
+        ).first()
+        if demande is None:
+            continue
+        if demande.date_expiration <= maintenant:
+            CleIdempotence.objects.filter(pk=demande.pk).delete()
+            continue
+        if demande.statut is not None or demande.empreinte != empreinte:
+            return demande, False
+
+        # Requête interrompue sans réponse : reprise par une seule requête
+        reprise = CleIdempotence.objects.filter(
+            pk=demande.pk,
+            statut__isnull=True,
+            date_creation__lte=maintenant
+            - timedelta(seconds=settings.IDEMPOTENCE_DELAI_TRAITEMENT),
+        ).update(date_creation=maintenant)
+        return demande, bool(reprise)
+    return None, False
+
+
+def executer_une_fois(request, cle, vue):
+    """
+    Exécute ``vue(request)`` au plus une fois par utilisateur et ``cle``.
+
+    Une clé déjà traitée renvoie la réponse enregistrée, lue dans le cache
+    Redis ou à défaut en base, sans ouvrir de transaction. La réponse d'un
+    succès est enregistrée dans la même transaction que les écritures de la
+    vue : une requête validée a toujours sa réponse. Une erreur libère la clé
+    pour qu'elle puisse être renvoyée.
+    """
+    if not cle or len(cle) > 255:
+        return Response(
+            {"error": f"En-tête {ENTETE} invalide (1 à 255 caractères)."},
+            status=400,
+        )
+
+    empreinte = _empreinte(request)
+    cle_cache = _cle_cache(request.user.pk, cle)
+    enregistrement = cache.get(cle_cache)
+    if enregistrement is not None:
+        return _rejouer(enregistrement, empreinte)
+
+    demande, reservee = _reserver(request.user, cle, empreinte)
+    if not reservee:
+        if demande is None or (
+            demande.statut is None and demande.empreinte == empreinte
+        ):
+            return _en_cours()
+        if demande.statut is not None:
+            cache.set(cle_cache, demande.enregistrement(), demande.duree_restante())
+        return _rejouer(demande.enregistrement(), empreinte)
+
+    try:
+        with transaction.atomic():
+            response = vue(request)
+            if response.status_code < 400:
+                demande.statut = response.status_code
+                demande.reponse = json.dumps(response.data, cls=DjangoJSONEncoder)
+                demande.entetes = {
+                    nom: response[nom]
+                    for nom in ENTETES_REJOUES
+                    if response.has_header(nom)
+                }
+                demande.save(update_fields=["statut", "reponse", "entetes"])
+    except Exception:
+        CleIdempotence.objects.filter(pk=demande.pk).delete()
+        raise
+
+    if demande.statut is None:
+        CleIdempotence.objects.filter(pk=demande.pk).delete()
+    else:
+        cache.set(cle_cache, demande.enregistrement(), demande.duree_restante())
+    return response
+
+
+def purger_cles_expirees():
+    """Supprime les clés expirées et retourne leur nombre."""
+    supprimees, _ = CleIdempotence.objects.filter(
+        date_expiration__lte=timezone.now()
+    ).delete()
+    return supprimees
@@ -0,0 +1,67 @@
+import hashlib
+import io
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Variantes de Produit.image : (largeur, hauteur) pour une miniature recadrée
+# à taille fixe, (largeur, None) pour une largeur d'affichage (srcset)
+VARIANTES = {
+    "miniature": (200, 200),
+    "400w": (400, None),
+    "800w": (800, None),
+    "1200w": (1200, None),
+}
+QUALITE_WEBP = 80
+DOSSIER = "produits/variantes"
+
+
+def _redimensionner(image, largeur, hauteur):
+    if hauteur is not None:
+        return ImageOps.fit(image, (largeur, hauteur), Image.Resampling.LANCZOS)
+    copie = image.copy()
+    # Jamais agrandie : une image plus étroite garde sa taille
+    copie.thumbnail((largeur, image.height), Image.Resampling.LANCZOS)
+    return copie
+
+
+def _encoder(image):
+    tampon = io.BytesIO()
+    # Ni EXIF, ni XMP, ni profil ICC : seuls les pixels sont encodés
+    image.info = {}
+    image.save(tampon, "WEBP", quality=QUALITE_WEBP, method=6)
+    return tampon.getvalue()
+
+
+def generer_variantes(produit):
+    """
+    Crée les variantes WebP de l'image d'un produit et retourne leurs noms
+    de stockage, plus ``source``, le nom de l'image d'origine.
+
+    L'orientation EXIF est appliquée aux pixels avant que les métadonnées
+    soient retirées. Chaque fichier est nommé d'après l'empreinte de son
+    contenu : son URL ne change jamais et peut être mise en cache sans
+    limite de durée.
+    """
+    fichier = produit.image
+    with fichier.open("rb"), Image.open(fichier) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+
+    noms = {"source": fichier.name}
+    for nom, (largeur, hauteur) in VARIANTES.items():
+        contenu = _encoder(_redimensionner(image, largeur, hauteur))
+        empreinte = hashlib.sha1(contenu).hexdigest()[:16]
+        chemin = f"{DOSSIER}/{produit.pk}/{nom}-{empreinte}.webp"
+        if not default_storage.exists(chemin):
+            chemin = default_storage.save(chemin, ContentFile(contenu))
+        noms[nom] = chemin
+    return noms
+
+
+def supprimer_variantes(variantes, conservees=()):
+    """Supprime les fichiers de ``variantes`` qui ne sont pas ``conservees``."""
+    for nom, chemin in variantes.items():
+        if nom != "source" and chemin not in conservees:
+            default_storage.delete(chemin)
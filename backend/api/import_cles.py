@@ -0,0 +1,186 @@
+import codecs
+import csv
+import io
+import json
+from itertools import islice
+
+from django.db import connection, transaction
+
+from .models import Cle, Produit
+
+TAILLE_LOT = 5000
+MAX_ERREURS_RAPPORTEES = 1000
+
+VALIDITES = {choix for choix, _ in Cle.CHOIX_VALIDITE}
+LONGUEUR_MAX_CONTENUE = Cle._meta.get_field("contenue").max_length
+
+
+def lire_lignes(lignes, type_fichier):
+    """
+    Transforme les lignes d'un fichier CSV ou JSONL en dictionnaires.
+
+    Retourne des couples ``(numero_ligne, donnees)`` ; ``donnees`` est une
+    chaîne d'erreur quand la ligne ne peut pas être décodée.
+    """
+    if type_fichier == "jsonl":
+        for numero, ligne in enumerate(lignes, start=1):
+            if not ligne.strip():
+                continue
+            try:
+                donnees = json.loads(ligne)
+            except ValueError as e:
+                yield numero, f"JSON invalide: {e}"
+                continue
+            if not isinstance(donnees, dict):
+                yield numero, "Chaque ligne doit être un objet JSON."
+                continue
+            yield numero, donnees
+    else:
+        lecteur = csv.DictReader(lignes)
+        for donnees in lecteur:
+            # La ligne 1 est l'en-tête
+            yield lecteur.line_num, donnees
+
+
+def detecter_type_fichier(nom):
+    return "jsonl" if nom.lower().endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def importer_cles(
+    lignes, type_fichier="csv", produit=None, validite=None, taille_lot=TAILLE_LOT
+):
+    """
+    Importe des clés par lots à partir des lignes d'un fichier CSV ou JSONL.
+
+    Chaque ligne fournit ``contenue`` et, à défaut des valeurs par défaut
+    passées en argument, ``produit`` et ``validite``. Les clés déjà présentes
+    en base ou répétées dans le fichier sont ignorées et comptées comme
+    doublons. Chaque lot est validé puis écrit par COPY dans sa propre
+    transaction ; ``code_cle`` est calculé par la base à l'insertion.
+    """
+    produits_existants = set(Produit.objects.values_list("id", flat=True))
+    rapport = {"lignes": 0, "creees": 0, "doublons": 0, "nombre_erreurs": 0}
+    erreurs = []
+    vues = set()
+
+    def signaler(numero, message):
+        rapport["nombre_erreurs"] += 1
+        if len(erreurs) < MAX_ERREURS_RAPPORTEES:
+            erreurs.append({"ligne": numero, "erreur": message})
+
+    source = lire_lignes(lignes, type_fichier)
+    while lot := list(islice(source, taille_lot)):
+        rapport["lignes"] += len(lot)
+
+        valides = []
+        for numero, donnees in lot:
+            if isinstance(donnees, str):
+                signaler(numero, donnees)
+                continue
+
+            contenue = str(donnees.get("contenue") or "").strip()
+            validite_ligne = donnees.get("validite") or validite
+            try:
+                produit_id = int(donnees.get("produit") or produit)
+            except (TypeError, ValueError):
+                produit_id = None
+
+            if not contenue:
+                signaler(numero, "Le champ 'contenue' est requis.")
+            elif len(contenue) > LONGUEUR_MAX_CONTENUE:
+                signaler(
+                    numero,
+                    f"'contenue' dépasse {LONGUEUR_MAX_CONTENUE} caractères.",
+                )
+            elif produit_id not in produits_existants:
+                signaler(numero, "Produit inexistant ou manquant.")
+            elif validite_ligne not in VALIDITES:
+                signaler(numero, f"Validité invalide: {validite_ligne!r}.")
+            elif contenue in vues:
+                rapport["doublons"] += 1
+                signaler(numero, "Clé répétée dans le fichier.")
+            else:
+                vues.add(contenue)
+                valides.append((numero, contenue, produit_id, validite_ligne))
+
+        if not valides:
+            continue
+
+        with transaction.atomic():
+            ignorees = _inserer(valides)
+        rapport["creees"] += len(valides) - len(ignorees)
+        rapport["doublons"] += len(ignorees)
+        for numero in ignorees:
+            signaler(numero, "Clé déjà existante.")
+
+    rapport["erreurs"] = erreurs
+    return rapport
+
+
+def _inserer(lignes):
+    """
+    Insère les clés d'un lot par COPY et retourne les numéros des lignes
+    ignorées parce que la clé existe déjà.
+
+    ``ON CONFLICT`` s'appuie sur la contrainte d'unicité de ``contenue`` :
+    deux imports simultanés, ou un import et une création unitaire, ne
+    peuvent pas enregistrer deux fois la même licence.
+    """
+    tampon = io.StringIO()
+    csv.writer(tampon).writerows(lignes)
+    tampon.seek(0)
+
+    table = Cle._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            CREATE TEMPORARY TABLE import_cle (
+                ligne integer,
+                contenue varchar(100),
+                produit_id bigint,
+                validite varchar(10)
+            )
+            """)
+        cursor.copy_expert(
+            "COPY import_cle (ligne, contenue, produit_id, validite) "
+            "FROM STDIN WITH (FORMAT csv)",
+            tampon,
+        )
+        cursor.execute(f"""
+            WITH inserees AS (
+                INSERT INTO {table} (contenue, produit_id, validite, disponiblite)
+                SELECT contenue, produit_id, validite, true
+                FROM import_cle ORDER BY ligne
+                ON CONFLICT (contenue) DO NOTHING
+                RETURNING contenue
+            )
+            SELECT ligne FROM import_cle
+            WHERE contenue NOT IN (SELECT contenue FROM inserees)
+            ORDER BY ligne
+            """)
+        ignorees = [ligne for (ligne,) in cursor.fetchall()]
+        # Pas de ON COMMIT DROP : le lot peut s'exécuter dans une transaction
+        # englobante, où la table existerait encore au lot suivant
+        cursor.execute("DROP TABLE import_cle")
+        return ignorees
+
+
+def premiere_ligne_illisible(fichier, encodage="utf-8-sig"):
+    """
+    Numéro de la première ligne de ``fichier`` (binaire) qui n'est pas dans
+    ``encodage``, ou None. Le fichier est ensuite rembobiné.
+    """
+    decodeur = codecs.getincrementaldecoder(encodage)()
+    numero = 0
+    try:
+        for numero, ligne in enumerate(fichier, start=1):
+            try:
+                decodeur.decode(ligne)
+            except UnicodeDecodeError:
+                return numero
+        try:
+            decodeur.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return numero
+        return None
+    finally:
+        fichier.seek(0)
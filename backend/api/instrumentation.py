@@ -0,0 +1,205 @@
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class _Mesure:
+    """Requêtes SQL et temps passé en base pendant une requête HTTP."""
+
+    def __init__(self):
+        self.requetes = 0
+        self.db = 0.0
+        self.serialisation = 0.0
+        self.rendu = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        debut = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - debut
+            self.requetes += 1
+
+
+@contextmanager
+def mesurer_serialisation(request):
+    """
+    Ajoute la durée du bloc au temps de sérialisation de la requête, si elle
+    est échantillonnée ; les requêtes SQL du bloc restent comptées en base.
+    """
+    mesure = getattr(request, "_instrumentation", None)
+    if mesure is None:
+        yield
+        return
+    debut, db = time.perf_counter(), mesure.db
+    try:
+        yield
+    finally:
+        mesure.serialisation += time.perf_counter() - debut - (mesure.db - db)
+
+
+class _SerializerMesure:
+    """Serializer dont la lecture de ``data`` est chronométrée."""
+
+    def __init__(self, serializer, request):
+        self._serializer = serializer
+        self._request = request
+
+    def __getattr__(self, nom):
+        return getattr(self._serializer, nom)
+
+    @property
+    def data(self):
+        with mesurer_serialisation(self._request):
+            return self._serializer.data
+
+
+class SerialisationMesureeMixin:
+    """
+    Vue générique dont ``serializer.data`` est compté dans le temps de
+    sérialisation d'``InstrumentationMiddleware`` plutôt que dans ``app``.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if getattr(self.request, "_instrumentation", None) is None:
+            return serializer
+        return _SerializerMesure(serializer, self.request)
+
+
+def _nom_vue(request):
+    resolution = getattr(request, "resolver_match", None)
+    if resolution is None:
+        return None
+    return resolution.view_name or resolution._func_path
+
+
+def _ms(secondes):
+    return round(secondes * 1000, 2)
+
+
+class InstrumentationMiddleware:
+    """
+    Mesure, pour une fraction ``INSTRUMENTATION_ECHANTILLON`` des requêtes,
+    le nombre de requêtes SQL, le temps en base, le temps de sérialisation
+    (``serializer.data`` dans les vues avec ``SerialisationMesureeMixin``),
+    le temps de rendu de la réponse DRF (JSON) et le temps total.
+
+    Les mesures sont renvoyées dans l'en-tête ``Server-Timing`` et journalisées
+    en JSON par le logger ``api.instrumentation``. Les requêtes non
+    échantillonnées ne coûtent qu'un tirage aléatoire et deux lectures
+    d'horloge ; elles sont journalisées quand même au-delà de
+    ``INSTRUMENTATION_SEUIL_LENT`` millisecondes.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.echantillon = settings.INSTRUMENTATION_ECHANTILLON
+        self.seuil_lent = settings.INSTRUMENTATION_SEUIL_LENT / 1000
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        debut = time.perf_counter()
+        if random.random() >= self.echantillon:
+            return self._hors_echantillon(request, self.get_response(request), debut)
+
+        mesure = request._instrumentation = _Mesure()
+        with ExitStack() as pile:
+            self._brancher(pile, mesure)
+            response = self.get_response(request)
+        return self._terminer(request, response, mesure, debut)
+
+    async def __acall__(self, request):
+        debut = time.perf_counter()
+        if random.random() >= self.echantillon:
+            response = await self.get_response(request)
+            return self._hors_echantillon(request, response, debut)
+
+        # Sous ASGI, l'ORM asynchrone s'exécute dans le thread de la requête
+        # (sync_to_async), dont les connexions sont distinctes : la mesure y
+        # est branchée
+        mesure = request._instrumentation = _Mesure()
+        pile = ExitStack()
+        await sync_to_async(self._brancher)(pile, mesure)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(pile.close)()
+        return self._terminer(request, response, mesure, debut)
+
+    @staticmethod
+    def _brancher(pile, mesure):
+        for alias in connections:
+            pile.enter_context(connections[alias].execute_wrapper(mesure))
+
+    def _hors_echantillon(self, request, response, debut):
+        total = time.perf_counter() - debut
+        if total >= self.seuil_lent:
+            self._journaliser(request, response, {"total_ms": _ms(total)})
+        return response
+
+    def _terminer(self, request, response, mesure, debut):
+        total = time.perf_counter() - debut
+
+        # Temps applicatif restant (vue, permissions, middlewares)
+        app = max(total - mesure.db - mesure.serialisation - mesure.rendu, 0)
+        response["Server-Timing"] = ", ".join(
+            (
+                f'db;dur={_ms(mesure.db)};desc="{mesure.requetes} requetes"',
+                f"serialisation;dur={_ms(mesure.serialisation)}",
+                f"rendu;dur={_ms(mesure.rendu)}",
+                f"app;dur={_ms(app)}",
+                f"total;dur={_ms(total)}",
+            )
+        )
+        self._journaliser(
+            request,
+            response,
+            {
+                "requetes": mesure.requetes,
+                "db_ms": _ms(mesure.db),
+                "serialisation_ms": _ms(mesure.serialisation),
+                "rendu_ms": _ms(mesure.rendu),
+                "app_ms": _ms(app),
+                "total_ms": _ms(total),
+            },
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        # Appelé juste avant le rendu des réponses DRF : le rendu (JSON) est
+        # chronométré jusqu'à son callback de fin
+        mesure = getattr(request, "_instrumentation", None)
+        if mesure is not None:
+            debut = time.perf_counter()
+
+            def fin_rendu(response):
+                mesure.rendu += time.perf_counter() - debut
+
+            response.add_post_render_callback(fin_rendu)
+        return response
+
+    def _journaliser(self, request, response, mesures):
+        ligne = {
+            "vue": _nom_vue(request),
+            "methode": request.method,
+            "chemin": request.path,
+            "statut": response.status_code,
+            **mesures,
+        }
+        logger.info(json.dumps(ligne, ensure_ascii=False))
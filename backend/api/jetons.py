@@ -0,0 +1,122 @@
+import logging
+import time
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken
+
+logger = logging.getLogger(__name__)
+
+PREFIXE = "jwt:liste-noire:"
+TAILLE_LOT = 5000
+
+_client = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.JWT_LISTE_NOIRE_URL)
+    return _client
+
+
+def revoquer(jti, exp):
+    """
+    Met ``jti`` en liste noire jusqu'à ``exp`` (horodatage d'expiration du
+    token). Retourne False s'il y était déjà.
+    """
+    duree = int(exp - time.time()) + 1
+    if duree <= 0:
+        return True
+    return bool(_redis().set(f"{PREFIXE}{jti}", 1, nx=True, ex=duree))
+
+
+def est_revoque(jti):
+    return bool(_redis().exists(f"{PREFIXE}{jti}"))
+
+
+class RefreshTokenRedis(RefreshToken):
+    """
+    Refresh token dont la liste noire est dans Redis plutôt qu'en base.
+
+    Une entrée par token révoqué, qui expire avec lui : la vérification et la
+    rotation coûtent un aller-retour Redis, quel que soit le nombre de tokens
+    émis. Aucun ``OutstandingToken`` n'est plus écrit à la connexion.
+    """
+
+    def check_blacklist(self):
+        if est_revoque(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        # SET NX : de deux rafraîchissements simultanés avec le même token,
+        # un seul obtient un nouveau token
+        if not revoquer(self.payload[api_settings.JTI_CLAIM], self.payload["exp"]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def outstand(self):
+        return None
+
+    @classmethod
+    def for_user(cls, user):
+        # Token.for_user, sans l'OutstandingToken de BlacklistMixin
+        return super(BlacklistMixin, cls).for_user(user)
+
+
+class RefreshRedisSerializer(TokenRefreshSerializer):
+    token_class = RefreshTokenRedis
+
+
+def revoquer_refresh(brut):
+    """
+    Révoque le refresh token ``brut`` (déconnexion). Sans effet s'il est
+    absent, invalide, expiré ou déjà révoqué ; retourne True s'il a été révoqué.
+    """
+    if not brut:
+        return False
+    try:
+        RefreshTokenRedis(brut).blacklist()
+    except TokenError:
+        return False
+    return True
+
+
+def purger_jetons():
+    """
+    Vide les tables de token_blacklist, qui ne sont plus alimentées.
+
+    Les tokens encore valides de la liste noire en base sont d'abord recopiés
+    dans Redis ; ensuite, toutes les lignes peuvent être supprimées, les
+    vérifications ne lisant plus la base. Retourne ``(recopies, supprimes)``.
+    """
+    maintenant = timezone.now()
+    recopies = 0
+    revoques = BlacklistedToken.objects.filter(
+        token__expires_at__gt=maintenant
+    ).values_list("token__jti", "token__expires_at")
+    for jti, expiration in revoques.iterator(chunk_size=2000):
+        revoquer(jti, expiration.timestamp())
+        recopies += 1
+
+    supprimes = BlacklistedToken.objects.all().delete()[0]
+    while True:
+        # Par lots : la suppression en cascade charge les lignes en mémoire
+        lot = list(OutstandingToken.objects.values_list("pk", flat=True)[:TAILLE_LOT])
+        if not lot:
+            break
+        supprimes += OutstandingToken.objects.filter(pk__in=lot).delete()[0]
+    if recopies or supprimes:
+        logger.info(
+            f"Liste noire JWT : {recopies} token(s) recopié(s) dans Redis, "
+            f"{supprimes} ligne(s) supprimée(s)"
+        )
+    return recopies, supprimes
@@ -0,0 +1,126 @@
+import logging
+import math
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+# Seau de jetons, mis à jour atomiquement dans Redis : ARGV[1] est la
+# capacité, ARGV[2] le débit de remplissage (jetons par seconde). L'heure est
+# celle du serveur Redis, commune à tous les processus. Retourne 1 et 0 si la
+# requête passe, sinon 0 et l'attente en secondes avant le prochain jeton.
+SEAU_JETONS = """
+local capacite = tonumber(ARGV[1])
+local debit = tonumber(ARGV[2])
+local heure = redis.call("TIME")
+local maintenant = tonumber(heure[1]) + tonumber(heure[2]) / 1000000
+local etat = redis.call("HMGET", KEYS[1], "jetons", "instant")
+local jetons = tonumber(etat[1]) or capacite
+local instant = tonumber(etat[2]) or maintenant
+jetons = math.min(capacite, jetons + math.max(maintenant - instant, 0) * debit)
+local attente = 0
+if jetons >= 1 then
+    jetons = jetons - 1
+else
+    attente = (1 - jetons) / debit
+end
+redis.call("HSET", KEYS[1], "jetons", tostring(jetons), "instant", tostring(maintenant))
+redis.call("EXPIRE", KEYS[1], math.ceil(capacite / debit) + 1)
+return {attente == 0 and 1 or 0, tostring(attente)}
+"""
+
+PERIODES = {
+    "s": 1,
+    "sec": 1,
+    "min": 60,
+    "h": 3600,
+    "hour": 3600,
+    "d": 86400,
+    "day": 86400,
+}
+
+_client = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.LIMITATION_DEBIT_URL,
+            socket_timeout=0.5,
+            socket_connect_timeout=0.5,
+        )
+    return _client
+
+
+_script = None
+
+
+def _seau_jetons():
+    """``SEAU_JETONS`` enregistré une fois : son SHA1 n'est calculé qu'ici."""
+    global _script
+    if _script is None:
+        _script = _redis().register_script(SEAU_JETONS)
+    return _script
+
+
+def lire_debit(debit):
+    """``"10/min"`` -> ``(10, 60)`` : nombre de requêtes et période en secondes."""
+    nombre, periode = debit.split("/")
+    return int(nombre), PERIODES[periode]
+
+
+class SeauJetonsThrottle(BaseThrottle):
+    """
+    Limitation de débit par seau de jetons, partagée par tous les processus.
+
+    La portée est le ``throttle_scope`` de la vue (``api`` par défaut) ; le
+    débit dépend du rôle de l'utilisateur (``anonyme`` pour un visiteur ou un
+    rôle sans débit propre, voir ``LIMITES_DEBIT``). Un visiteur est identifié
+    par son adresse IP, lue dans X-Forwarded-For seulement derrière
+    ``NUM_PROXIES`` proxys de confiance. Un seau plein autorise une rafale
+    d'autant de requêtes que le débit en accorde par période. Si Redis ne
+    répond pas, les requêtes passent.
+    """
+
+    portee_defaut = "api"
+
+    def __init__(self):
+        self.attente = None
+
+    def parametres(self, request, view):
+        """``(clé, capacité, débit par seconde)``, ou None si non limité."""
+        portee = getattr(view, "throttle_scope", None) or self.portee_defaut
+        utilisateur = request.user
+        if utilisateur and utilisateur.is_authenticated:
+            role, identifiant = utilisateur.role, f"u{utilisateur.pk}"
+        else:
+            role, identifiant = "anonyme", self.get_ident(request)
+        debits = settings.LIMITES_DEBIT.get(portee, {})
+        debit = debits.get(role, debits.get("anonyme"))
+        if debit is None:
+            return None
+        nombre, periode = lire_debit(debit)
+        cle = cache.make_and_validate_key(f"limite:{portee}:{identifiant}")
+        return cle, nombre, nombre / periode
+
+    def allow_request(self, request, view):
+        parametres = self.parametres(request, view)
+        if parametres is None:
+            return True
+        cle, capacite, debit = parametres
+        try:
+            resultat = _seau_jetons()(keys=[cle], args=[capacite, debit])
+        except redis.RedisError as e:
+            logger.warning(f"Limitation de débit indisponible: {str(e)}")
+            return True
+        autorise, attente = resultat
+        self.attente = float(attente)
+        return bool(autorise)
+
+    def wait(self):
+        # Retry-After est un nombre entier de secondes
+        return math.ceil(self.attente) if self.attente else None
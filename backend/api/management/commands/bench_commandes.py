@@ -0,0 +1,328 @@
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from celery import current_app
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+
+from api.models import MethodePaiement, StockCle, Utilisateur
+
+PREFIXE = "bench-"
+
+ATTENTES_VERROUS = """
+    SELECT count(*) FROM pg_stat_activity
+    WHERE datname = current_database() AND wait_event_type = 'Lock'
+"""
+COMPTEURS_BASE = """
+    SELECT deadlocks, xact_commit, xact_rollback
+    FROM pg_stat_database WHERE datname = current_database()
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Envoie des commandes concurrentes sur POST /api/actions/ (un thread "
+        "par vendeur) contre la base configurée, remplie au préalable par "
+        "generer_donnees_bench, et enregistre latences, débit, attentes de "
+        "verrous et deadlocks dans un fichier JSON. Les emails partent vers le "
+        "backend locmem et les tâches Celery sont exécutées sur place."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--vendeurs", type=int, default=8)
+        parser.add_argument(
+            "--commandes",
+            type=int,
+            default=1000,
+            help="Nombre total de commandes, réparties entre les vendeurs.",
+        )
+        parser.add_argument(
+            "--produits-par-commande", type=int, default=2, dest="produits"
+        )
+        parser.add_argument("--quantite", type=int, default=1)
+        parser.add_argument(
+            "--produits-chauds",
+            type=int,
+            default=20,
+            help="Les commandes portent sur les N produits les mieux fournis "
+            "(0 : tous les produits en stock).",
+        )
+        parser.add_argument(
+            "--devis",
+            type=float,
+            default=0.0,
+            help="Part des commandes envoyées comme devis (sans réservation).",
+        )
+        parser.add_argument("--graine", type=int, default=42)
+        parser.add_argument(
+            "--intervalle-verrous",
+            type=float,
+            default=0.02,
+            help="Période d'échantillonnage des attentes de verrous, en secondes.",
+        )
+        parser.add_argument(
+            "--sortie",
+            help="Fichier JSON des résultats (bench_commandes_<date>.json par défaut).",
+        )
+        parser.add_argument(
+            "--comparer", help="Résultats JSON d'un run précédent à comparer."
+        )
+
+    def handle(self, *args, **options):
+        vendeurs = list(
+            Utilisateur.objects.filter(
+                username__startswith=PREFIXE, role="vendeur"
+            ).order_by("id")[: options["vendeurs"]]
+        )
+        clients = list(
+            Utilisateur.objects.filter(
+                username__startswith=PREFIXE, role="client"
+            ).values_list("id", flat=True)
+        )
+        methode = (
+            MethodePaiement.objects.filter(nom__startswith=PREFIXE)
+            .values_list("id", flat=True)
+            .first()
+        )
+        stock = StockCle.objects.filter(
+            produit__nom__startswith=PREFIXE, disponibles__gt=0
+        ).order_by("-disponibles", "produit_id")
+        if options["produits_chauds"]:
+            stock = stock[: options["produits_chauds"]]
+        produits = list(stock.values_list("produit_id", "produit__prix"))
+        if len(vendeurs) < options["vendeurs"] or not clients or not produits:
+            raise CommandError(
+                "Données de bench insuffisantes : lancez d'abord generer_donnees_bench."
+            )
+
+        commandes = self._commandes(options, clients, methode, produits)
+        parametres = {
+            nom: options[nom]
+            for nom in (
+                "vendeurs",
+                "commandes",
+                "produits",
+                "quantite",
+                "produits_chauds",
+                "devis",
+                "graine",
+            )
+        }
+
+        # Réponses de test (hôte « testserver », emails locmem, DEBUG désactivé),
+        # tâches exécutées dans le thread de la requête, PDF dans un dossier jetable
+        setup_test_environment()
+        eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = True
+        # Ni log par commande ni avertissement par rupture de stock (400)
+        loggers = [logging.getLogger(nom) for nom in ("api", "django.request")]
+        niveaux = [logger.level for logger in loggers]
+        for logger in loggers:
+            logger.setLevel(logging.ERROR)
+        try:
+            with (
+                tempfile.TemporaryDirectory() as media,
+                override_settings(MEDIA_ROOT=media),
+            ):
+                resultats = self._executer(vendeurs, commandes, options)
+        finally:
+            for logger, niveau in zip(loggers, niveaux):
+                logger.setLevel(niveau)
+            current_app.conf.task_always_eager = eager
+            teardown_test_environment()
+
+        resultats = {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "commit": self._commit(),
+            "machine": {
+                "python": platform.python_version(),
+                "processeurs": os.cpu_count(),
+                "postgresql": connection.pg_version,
+            },
+            "parametres": parametres,
+            **resultats,
+        }
+        sortie = options["sortie"] or (
+            f"bench_commandes_{datetime.now():%Y%m%d_%H%M%S}.json"
+        )
+        with open(sortie, "w") as fichier:
+            json.dump(resultats, fichier, indent=2)
+
+        self._afficher(resultats)
+        if options["comparer"]:
+            with open(options["comparer"]) as fichier:
+                self._comparer(json.load(fichier), resultats)
+        self.stdout.write(self.style.SUCCESS(f"Résultats enregistrés dans {sortie}"))
+
+    def _commandes(self, options, clients, methode, produits):
+        rng = random.Random(options["graine"])
+        nombre = min(options["produits"], len(produits))
+        commandes = []
+        for _ in range(options["commandes"]):
+            choisis = rng.sample(produits, nombre)
+            lignes = [
+                {
+                    "produit": produit_id,
+                    "quantite": options["quantite"],
+                    "prix_total": str(prix * options["quantite"]),
+                }
+                for produit_id, prix in choisis
+            ]
+            commandes.append(
+                {
+                    "action": {
+                        "type": "devis" if rng.random() < options["devis"] else "achat",
+                        "prix": str(
+                            sum(prix for _, prix in choisis) * options["quantite"]
+                        ),
+                        "client": rng.choice(clients),
+                        "methode_paiement": methode,
+                    },
+                    "produits": lignes,
+                }
+            )
+        return commandes
+
+    def _executer(self, vendeurs, commandes, options):
+        arret = threading.Event()
+        attentes = []
+
+        def surveiller():
+            try:
+                with connections["default"].cursor() as curseur:
+                    while not arret.is_set():
+                        curseur.execute(ATTENTES_VERROUS)
+                        attentes.append(curseur.fetchone()[0])
+                        time.sleep(options["intervalle_verrous"])
+            finally:
+                connections.close_all()
+
+        def vendeur(indice):
+            api = APIClient()
+            api.force_authenticate(vendeurs[indice])
+            mesures = []
+            try:
+                for commande in commandes[indice :: len(vendeurs)]:
+                    debut = time.perf_counter()
+                    reponse = api.post("/api/actions/", commande, format="json")
+                    mesures.append((time.perf_counter() - debut, reponse.status_code))
+            finally:
+                connections.close_all()
+            return mesures
+
+        avant = self._compteurs()
+        surveillance = threading.Thread(target=surveiller)
+        surveillance.start()
+        debut = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(vendeurs)) as executeur:
+            mesures = [
+                mesure
+                for resultats in executeur.map(vendeur, range(len(vendeurs)))
+                for mesure in resultats
+            ]
+        duree = time.perf_counter() - debut
+        arret.set()
+        surveillance.join()
+
+        # Les statistiques cumulées de PostgreSQL sont publiées en différé
+        time.sleep(1)
+        apres = self._compteurs()
+
+        latences = sorted(latence * 1000 for latence, _ in mesures)
+        centiles = statistics.quantiles(latences, n=100, method="inclusive")
+        statuts = Counter(str(statut) for _, statut in mesures)
+        return {
+            "duree_s": round(duree, 3),
+            "debit_par_s": round(len(mesures) / duree, 1),
+            "succes": statuts.get("200", 0),
+            "statuts": dict(sorted(statuts.items())),
+            "latence_ms": {
+                "moyenne": round(statistics.fmean(latences), 2),
+                "p50": round(centiles[49], 2),
+                "p95": round(centiles[94], 2),
+                "p99": round(centiles[98], 2),
+                "max": round(latences[-1], 2),
+            },
+            "verrous": {
+                "echantillons": len(attentes),
+                "echantillons_avec_attente": sum(1 for n in attentes if n),
+                "attentes_simultanees_max": max(attentes, default=0),
+                # Somme des sessions en attente à chaque échantillon
+                "attente_estimee_s": round(
+                    sum(attentes) * options["intervalle_verrous"], 3
+                ),
+            },
+            "deadlocks": apres["deadlocks"] - avant["deadlocks"],
+            "transactions_annulees": apres["xact_rollback"] - avant["xact_rollback"],
+        }
+
+    @staticmethod
+    def _compteurs():
+        with connection.cursor() as curseur:
+            curseur.execute("SELECT pg_stat_clear_snapshot()")
+            curseur.execute(COMPTEURS_BASE)
+            colonnes = [colonne[0] for colonne in curseur.description]
+            return dict(zip(colonnes, curseur.fetchone()))
+
+    @staticmethod
+    def _commit():
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def _afficher(self, resultats):
+        latence = resultats["latence_ms"]
+        verrous = resultats["verrous"]
+        self.stdout.write(
+            f"{resultats['succes']} / {resultats['parametres']['commandes']} "
+            f"commandes réussies en {resultats['duree_s']} s "
+            f"({resultats['debit_par_s']} commandes/s), statuts {resultats['statuts']}"
+        )
+        self.stdout.write(
+            f"Latence (ms) : p50 {latence['p50']}, p95 {latence['p95']}, "
+            f"p99 {latence['p99']}, max {latence['max']}"
+        )
+        self.stdout.write(
+            f"Verrous : attente dans {verrous['echantillons_avec_attente']} / "
+            f"{verrous['echantillons']} échantillons, "
+            f"{verrous['attentes_simultanees_max']} session(s) au plus, "
+            f"~{verrous['attente_estimee_s']} s cumulées ; "
+            f"deadlocks : {resultats['deadlocks']}"
+        )
+
+    def _comparer(self, reference, resultats):
+        self.stdout.write(
+            f"Comparaison avec {reference.get('commit') or 'la référence'} :"
+        )
+        for libelle, cle in (
+            ("débit", ("debit_par_s",)),
+            ("p50", ("latence_ms", "p50")),
+            ("p95", ("latence_ms", "p95")),
+            ("p99", ("latence_ms", "p99")),
+            ("deadlocks", ("deadlocks",)),
+        ):
+            avant, apres = reference, resultats
+            for partie in cle:
+                avant, apres = avant[partie], apres[partie]
+            ecart = f" ({(apres - avant) / avant:+.1%})" if avant else ""
+            self.stdout.write(f"  {libelle}: {avant} -> {apres}{ecart}")
@@ -0,0 +1,94 @@
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.utils import timezone
+
+from api import emails
+from api.factures import rendre_facture
+from api.smtp_local import ServeurSMTPLocal
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le nombre d'emails de factures envoyés par seconde vers un "
+        "serveur SMTP local, avec une connexion par message puis avec la "
+        "connexion partagée."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--nombre", type=int, default=200)
+        parser.add_argument(
+            "--latence",
+            type=float,
+            default=0.05,
+            help="Coût simulé d'ouverture d'une connexion SMTP, en secondes.",
+        )
+        parser.add_argument(
+            "--coupure-apres",
+            type=int,
+            help="Le serveur ferme chaque connexion après ce nombre de messages.",
+        )
+
+    def handle(self, *args, **options):
+        nombre = options["nombre"]
+        client = SimpleNamespace(
+            nom_complet="Client Test",
+            email="client@example.com",
+            numero_telephone="+261 34 00 000 00",
+            adresse="Antananarivo",
+        )
+        cles_data = {"Produit": [{"contenue": "XXXX-0000-YYYY", "validite": "1 ans"}]}
+        actions = [
+            SimpleNamespace(
+                type="achat",
+                code_action=f"EJ-achat-{n}",
+                date_action=timezone.now(),
+                prix=1000,
+            )
+            for n in range(nombre)
+        ]
+        pdf = rendre_facture(actions[0], client, cles_data)
+
+        def messages():
+            return [
+                emails.construire_email(action, client, cles_data, pdf)
+                for action in actions
+            ]
+
+        with ServeurSMTPLocal(
+            latence=options["latence"], coupure_apres=options["coupure_apres"]
+        ) as serveur:
+            reglages = {
+                "EMAIL_BACKEND": "django.core.mail.backends.smtp.EmailBackend",
+                "EMAIL_HOST": "127.0.0.1",
+                "EMAIL_PORT": serveur.port,
+                "EMAIL_USE_TLS": False,
+                "EMAIL_USE_SSL": False,
+                "EMAIL_HOST_USER": "",
+                "EMAIL_HOST_PASSWORD": "",
+                "DEFAULT_FROM_EMAIL": "factures@example.com",
+            }
+            with override_settings(**reglages):
+                a_envoyer = messages()
+                debut = time.perf_counter()
+                for message in a_envoyer:
+                    message.send(fail_silently=False)
+                self._resultat("Une connexion par message", serveur, debut)
+
+                emails.fermer_connexion_email()
+                serveur.connexions = serveur.messages = 0
+                a_envoyer = messages()
+                debut = time.perf_counter()
+                echecs = emails.envoyer_messages(a_envoyer)
+                self._resultat("Connexion partagée", serveur, debut, len(echecs))
+                emails.fermer_connexion_email()
+
+    def _resultat(self, libelle, serveur, debut, echecs=0):
+        duree = time.perf_counter() - debut
+        self.stdout.write(
+            f"{libelle}: {serveur.messages} message(s) en {duree:.2f} s "
+            f"({serveur.messages / duree:.1f} msg/s), "
+            f"{serveur.connexions} connexion(s), {echecs} échec(s)"
+        )
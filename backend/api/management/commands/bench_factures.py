@@ -0,0 +1,67 @@
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.utils import timezone
+
+from api import factures
+
+
+class Command(BaseCommand):
+    help = "Mesure le nombre de factures PDF rendues par seconde."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--nombre", type=int, default=500)
+        parser.add_argument("--produits", type=int, default=3)
+        parser.add_argument("--cles", type=int, default=2, help="Clés par produit.")
+        parser.add_argument("--logo", help="Image utilisée comme logo.")
+        parser.add_argument(
+            "--a-froid",
+            action="store_true",
+            help="Vide les caches du module avant chaque facture.",
+        )
+
+    def handle(self, *args, **options):
+        client = SimpleNamespace(
+            nom_complet="Client Test",
+            email="client@example.com",
+            numero_telephone="+261 34 00 000 00",
+            adresse="Antananarivo",
+        )
+        cles_data = {
+            f"Produit {i}": [
+                {"contenue": f"XXXX-{i:04d}-{j:04d}-YYYY", "validite": "1 ans"}
+                for j in range(options["cles"])
+            ]
+            for i in range(options["produits"])
+        }
+        lots = [
+            (
+                SimpleNamespace(
+                    type="achat",
+                    code_action=f"EJ-achat-{n}",
+                    date_action=timezone.now(),
+                    prix=1000,
+                ),
+                client,
+                cles_data,
+            )
+            for n in range(options["nombre"])
+        ]
+
+        reglages = {"FACTURE_LOGO": options["logo"]} if options["logo"] else {}
+        with override_settings(**reglages):
+            factures.rendre_facture(*lots[0])  # préchauffage
+
+            debut = time.perf_counter()
+            for lot in lots:
+                if options["a_froid"]:
+                    factures._logo.cache_clear()
+                factures.rendre_facture(*lot)
+            duree = time.perf_counter() - debut
+
+        self.stdout.write(
+            f"{options['nombre']} PDF en {duree:.2f} s : "
+            f"{options['nombre'] / duree:.1f} PDF/s"
+        )
@@ -0,0 +1,83 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.champs import LecteurValeurs
+from api.models import Categorie, Cle, Produit
+from api.serializers import CleSerializer
+
+# Mesure de référence (10 000 clés, PostgreSQL local, Python 3.11) :
+#   python manage.py bench_serialisation
+#     ModelSerializer: 10000 clés en 0.141 s (70,808 lignes/s)
+#     .values(): 10000 clés en 0.035 s (286,258 lignes/s)
+#   python manage.py bench_serialisation --champs=id,contenue
+#     ModelSerializer: 10000 clés en 0.033 s (304,272 lignes/s)
+#     .values(): 10000 clés en 0.015 s (646,337 lignes/s)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare le nombre de clés sérialisées par seconde avec CleSerializer "
+        "et avec la lecture par .values(). Les données de test sont annulées."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--nombre", type=int, default=10000)
+        parser.add_argument("--repetitions", type=int, default=3)
+        parser.add_argument(
+            "--champs",
+            help="Champs demandés, séparés par des virgules (tous par défaut).",
+        )
+
+    def handle(self, *args, **options):
+        nombre = options["nombre"]
+        champs = options["champs"].split(",") if options["champs"] else None
+
+        with transaction.atomic():
+            categorie = Categorie.objects.create(nom="Bench", description="")
+            produit = Produit.objects.create(
+                categorie=categorie,
+                nom="Bench",
+                description="",
+                image="produits/bench.png",
+                prix_min=1,
+                prix=1,
+                prix_max=1,
+            )
+            Cle.objects.bulk_create(
+                (
+                    Cle(contenue=f"BENCH-{n:08d}", produit=produit, validite="1 ans")
+                    for n in range(nombre)
+                ),
+                batch_size=5000,
+            )
+            cles = Cle.objects.filter(produit=produit).order_by("id")
+
+            def serializer():
+                return CleSerializer(cles, many=True, champs=champs).data
+
+            def valeurs():
+                lecteur = LecteurValeurs(CleSerializer(champs=champs))
+                return lecteur.convertir(cles.values(*lecteur.colonnes.values()))
+
+            assert serializer() == valeurs()
+            for libelle, fonction in (
+                ("ModelSerializer", serializer),
+                (".values()", valeurs),
+            ):
+                duree = min(
+                    self._mesurer(fonction) for _ in range(options["repetitions"])
+                )
+                self.stdout.write(
+                    f"{libelle}: {nombre} clés en {duree:.3f} s "
+                    f"({nombre / duree:,.0f} lignes/s)"
+                )
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _mesurer(fonction):
+        debut = time.perf_counter()
+        fonction()
+        return time.perf_counter() - debut
@@ -0,0 +1,235 @@
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DurationField, ExpressionWrapper, F
+from django.db.models.functions import Now
+
+from api.models import (
+    Action,
+    Categorie,
+    Cle,
+    ElementAchatDevis,
+    MethodePaiement,
+    MouvementStock,
+    Produit,
+    StockCle,
+    Utilisateur,
+)
+
+PREFIXE = "bench-"
+LOT = 10000
+
+
+class Command(BaseCommand):
+    help = (
+        "Génère un jeu de données de bench reproductible (utilisateurs, "
+        "produits, clés, actions historiques) préfixé par « bench- ». À lancer "
+        "sur une base dédiée : les volumes par défaut sont ceux de production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--produits", type=int, default=10000)
+        parser.add_argument("--cles", type=int, default=100000)
+        parser.add_argument("--actions", type=int, default=1000000)
+        parser.add_argument("--vendeurs", type=int, default=32)
+        parser.add_argument("--clients", type=int, default=5000)
+        parser.add_argument("--categories", type=int, default=20)
+        parser.add_argument(
+            "--jours",
+            type=int,
+            default=365,
+            help="Période couverte par l'historique des actions.",
+        )
+        parser.add_argument("--graine", type=int, default=42)
+        parser.add_argument(
+            "--purger",
+            action="store_true",
+            help="Supprime les données de bench (y compris les commandes du bench).",
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["graine"])
+        if options["purger"]:
+            self._etape("Purge", self._purger)
+            return
+
+        vendeurs, clients = self._etape(
+            "Utilisateurs", self._utilisateurs, options["vendeurs"], options["clients"]
+        )
+        methodes = self._etape("Méthodes de paiement", self._methodes)
+        produits = self._etape(
+            "Produits", self._produits, options["categories"], options["produits"]
+        )
+        self._etape("Clés", self._cles, produits, options["cles"])
+        self._etape(
+            "Actions",
+            self._actions,
+            options["actions"],
+            options["jours"],
+            vendeurs,
+            clients,
+            methodes,
+            produits,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Jeu de données prêt. Pour le tableau de bord : "
+                "python manage.py reconstruire_statistiques"
+            )
+        )
+
+    def _etape(self, libelle, fonction, *args):
+        debut = time.perf_counter()
+        resultat = fonction(*args)
+        self.stdout.write(f"{libelle}: {time.perf_counter() - debut:.1f} s")
+        return resultat
+
+    def _purger(self):
+        bench = {"client__username__startswith": PREFIXE}
+        ElementAchatDevis.objects.filter(
+            **{f"action__{cle}": valeur for cle, valeur in bench.items()}
+        ).delete()
+        Action.objects.filter(**bench).delete()
+        Categorie.objects.filter(nom__startswith=PREFIXE).delete()
+        MethodePaiement.objects.filter(nom__startswith=PREFIXE).delete()
+        Utilisateur.objects.filter(username__startswith=PREFIXE).delete()
+
+    def _utilisateurs(self, nombre_vendeurs, nombre_clients):
+        mot_de_passe = make_password("bench")
+
+        def creer(role, nombre):
+            return Utilisateur.objects.bulk_create(
+                (
+                    Utilisateur(
+                        username=f"{PREFIXE}{role}-{n}",
+                        email=f"{PREFIXE}{role}-{n}@example.com",
+                        password=mot_de_passe,
+                        nom_complet=f"Bench {role} {n}",
+                        role=role,
+                        numero_telephone="0340000000",
+                        adresse="Antananarivo",
+                    )
+                    for n in range(nombre)
+                ),
+                batch_size=LOT,
+            )
+
+        vendeurs = [u.pk for u in creer("vendeur", nombre_vendeurs)]
+        clients = [u.pk for u in creer("client", nombre_clients)]
+        return vendeurs, clients
+
+    def _methodes(self):
+        return [
+            m.pk
+            for m in MethodePaiement.objects.bulk_create(
+                MethodePaiement(nom=f"{PREFIXE}{nom}", description="")
+                for nom in ("especes", "mobile-money", "virement")
+            )
+        ]
+
+    def _produits(self, nombre_categories, nombre):
+        categories = Categorie.objects.bulk_create(
+            Categorie(nom=f"{PREFIXE}categorie-{n}", description="")
+            for n in range(nombre_categories)
+        )
+        produits = []
+        for n in range(nombre):
+            prix = Decimal(self.rng.randrange(10, 2000) * 1000)
+            produits.append(
+                Produit(
+                    categorie=self.rng.choice(categories),
+                    nom=f"{PREFIXE}produit-{n}",
+                    description="",
+                    image="produits/bench.png",
+                    prix_min=prix * Decimal("0.9"),
+                    prix=prix,
+                    prix_max=prix * Decimal("1.1"),
+                )
+            )
+        # bulk_create n'envoie pas post_save : les compteurs sont créés avec les clés
+        return {p.pk: p.prix for p in Produit.objects.bulk_create(produits, LOT)}
+
+    def _cles(self, produits, nombre):
+        # Répartition inégale, comme en production : quelques produits
+        # concentrent l'essentiel du stock
+        ids = list(produits)
+        poids = [1 / (rang + 1) for rang in range(len(ids))]
+        repartition = Counter(self.rng.choices(ids, weights=poids, k=nombre))
+        validites = [choix for choix, _ in Cle.CHOIX_VALIDITE]
+
+        with transaction.atomic():
+            cles = (
+                Cle(
+                    contenue=f"BENCH-{n:08d}-{self.rng.getrandbits(32):08X}",
+                    produit_id=produit_id,
+                    validite=self.rng.choice(validites),
+                )
+                for n, produit_id in enumerate(repartition.elements())
+            )
+            StockCle.objects.bulk_create(
+                (StockCle(produit_id=produit_id) for produit_id in ids), batch_size=LOT
+            )
+            Cle.objects.bulk_create(cles, batch_size=LOT)
+            # Les mouvements écrits par les triggers sont reportés aussitôt
+            MouvementStock.objects.appliquer()
+
+    def _actions(self, nombre, jours, vendeurs, clients, methodes, produits):
+        ids = list(produits)
+        premiere = None
+        for debut in range(0, nombre, LOT):
+            actions, lignes = [], []
+            for _ in range(min(LOT, nombre - debut)):
+                elements = [
+                    (produit_id, self.rng.randint(1, 2))
+                    for produit_id in self.rng.sample(ids, self.rng.randint(1, 3))
+                ]
+                actions.append(
+                    Action(
+                        type="achat" if self.rng.random() < 0.7 else "devis",
+                        prix=sum(produits[p] * q for p, q in elements),
+                        client_id=self.rng.choice(clients),
+                        vendeur_id=self.rng.choice(vendeurs),
+                        methode_paiement_id=self.rng.choice(methodes),
+                        livree=self.rng.random() < 0.8,
+                        payee=self.rng.random() < 0.9,
+                    )
+                )
+                lignes.append(elements)
+
+            with transaction.atomic():
+                Action.objects.bulk_create(actions)
+                ElementAchatDevis.objects.bulk_create(
+                    (
+                        ElementAchatDevis(
+                            action=action,
+                            produit_id=produit_id,
+                            quantite=quantite,
+                            prix_total=produits[produit_id] * quantite,
+                        )
+                        for action, elements in zip(actions, lignes)
+                        for produit_id, quantite in elements
+                    ),
+                    batch_size=LOT,
+                )
+            premiere = premiere or actions[0].pk
+            self.stdout.write(f"  {debut + len(actions)} / {nombre}", ending="\r")
+        self.stdout.write("")
+
+        if premiere is None:
+            return
+        # date_action (auto_now_add) est imposée à l'insertion : l'historique
+        # est étalé ensuite, de façon déterministe à partir de l'id
+        minutes = jours * 24 * 60
+        Action.objects.filter(pk__gte=premiere, client_id__in=clients).update(
+            date_action=Now()
+            - ExpressionWrapper(
+                (F("id") * 7919 % minutes) * timedelta(minutes=1),
+                output_field=DurationField(),
+            )
+        )
@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.import_cles import TAILLE_LOT, detecter_type_fichier, importer_cles
+
+
+class Command(BaseCommand):
+    help = "Importe des clés en masse depuis un fichier CSV ou JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument("fichier", help="Chemin du fichier CSV ou JSONL.")
+        parser.add_argument(
+            "--type",
+            choices=["csv", "jsonl"],
+            help="Type du fichier (déduit de l'extension par défaut).",
+        )
+        parser.add_argument(
+            "--produit", type=int, help="Produit des lignes qui n'en précisent pas."
+        )
+        parser.add_argument(
+            "--validite", help="Validité des lignes qui n'en précisent pas."
+        )
+        parser.add_argument("--taille-lot", type=int, default=TAILLE_LOT)
+
+    def handle(self, *args, **options):
+        type_fichier = options["type"] or detecter_type_fichier(options["fichier"])
+        try:
+            with open(options["fichier"], encoding="utf-8-sig", newline="") as f:
+                rapport = importer_cles(
+                    f,
+                    type_fichier=type_fichier,
+                    produit=options["produit"],
+                    validite=options["validite"],
+                    taille_lot=options["taille_lot"],
+                )
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for erreur in rapport["erreurs"]:
+            self.stderr.write(json.dumps(erreur, ensure_ascii=False))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{rapport['creees']} clé(s) créée(s) sur {rapport['lignes']} "
+                f"ligne(s), {rapport['doublons']} doublon(s), "
+                f"{rapport['nombre_erreurs']} erreur(s)."
+            )
+        )
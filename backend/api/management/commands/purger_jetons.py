@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.jetons import purger_jetons
+
+
+class Command(BaseCommand):
+    help = (
+        "Recopie dans Redis la liste noire JWT encore valide et vide les tables "
+        "de token_blacklist."
+    )
+
+    def handle(self, *args, **options):
+        recopies, supprimes = purger_jetons()
+        self.stdout.write(
+            f"{recopies} token(s) recopié(s) dans Redis, {supprimes} ligne(s) supprimée(s)."
+        )
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+
+from api.models import Cle, MouvementStock, Produit, StockCle
+
+
+class Command(BaseCommand):
+    help = "Recalcule les compteurs StockCle à partir des clés disponibles."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Affiche les écarts sans corriger les compteurs.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # Bloquer l'écriture des mouvements avant de compter : les ventes et
+            # imports en cours sont attendus, les suivants attendent la fin de
+            # la réconciliation. Les mouvements reportés ensuite sont ceux des
+            # clés comptées ci-dessous, ni plus ni moins.
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"LOCK TABLE {MouvementStock._meta.db_table} IN EXCLUSIVE MODE"
+                )
+            MouvementStock.objects.appliquer()
+            stocks = {s.produit_id: s for s in StockCle.objects.select_for_update()}
+            reels = dict(
+                Cle.objects.filter(disponiblite=True)
+                .values_list("produit")
+                .annotate(nombre=Count("id"))
+                .order_by()
+            )
+
+            manquants = []
+            corriges = []
+            for produit_id in Produit.objects.values_list("id", flat=True):
+                disponibles = reels.get(produit_id, 0)
+                stock = stocks.get(produit_id)
+                if stock is None:
+                    manquants.append(
+                        StockCle(produit_id=produit_id, disponibles=disponibles)
+                    )
+                elif stock.disponibles != disponibles:
+                    self.stdout.write(
+                        f"Produit {produit_id}: {stock.disponibles} -> {disponibles}"
+                    )
+                    stock.disponibles = disponibles
+                    corriges.append(stock)
+
+            if options["dry_run"]:
+                transaction.set_rollback(True)
+            else:
+                StockCle.objects.bulk_create(manquants, batch_size=1000)
+                StockCle.objects.bulk_update(corriges, ["disponibles"], batch_size=1000)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(corriges)} compteur(s) corrigé(s), "
+                f"{len(manquants)} compteur(s) créé(s)."
+            )
+        )
@@ -0,0 +1,54 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from api.models import Action
+from api.statistiques import reconstruire_statistiques
+
+
+class Command(BaseCommand):
+    help = "Recalcule les agrégats journaliers du tableau de bord sur une période."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--depuis",
+            type=date.fromisoformat,
+            help="Premier jour (AAAA-MM-JJ), par défaut celui de la première action.",
+        )
+        parser.add_argument(
+            "--jusqua",
+            type=date.fromisoformat,
+            help="Dernier jour (AAAA-MM-JJ), par défaut aujourd'hui.",
+        )
+        parser.add_argument(
+            "--jours-par-lot",
+            type=int,
+            default=31,
+            help="Nombre de jours recalculés par transaction.",
+        )
+
+    def handle(self, *args, **options):
+        depuis = options["depuis"]
+        if depuis is None:
+            premiere = Action.objects.aggregate(premiere=Min("date_action"))["premiere"]
+            if premiere is None:
+                self.stdout.write("Aucune action à agréger.")
+                return
+            depuis = timezone.localdate(premiere)
+        jusqua = options["jusqua"] or timezone.localdate()
+        if depuis > jusqua:
+            raise CommandError("--depuis doit précéder --jusqua.")
+
+        debut = depuis
+        while debut <= jusqua:
+            fin = min(debut + timedelta(days=options["jours_par_lot"] - 1), jusqua)
+            ventes, produits, clients = reconstruire_statistiques(debut, fin)
+            self.stdout.write(
+                f"{debut} -> {fin}: {ventes} ventes, {produits} produits, "
+                f"{clients} clients"
+            )
+            debut = fin + timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS("Statistiques reconstruites."))
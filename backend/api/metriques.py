@@ -0,0 +1,270 @@
+import logging
+import time
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PREFIXE = "metriques:"
+
+# Bornes (en secondes) des histogrammes de durée
+BORNES_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registre = {}
+_client = None
+
+
+def _redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.METRIQUES_URL, socket_timeout=0.5, socket_connect_timeout=0.5
+        )
+    return _client
+
+
+def _echapper(valeur):
+    return str(valeur).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquettes(valeurs):
+    """Étiquettes au format Prometheus (``type="achat",...``), triées."""
+    return ",".join(
+        f'{nom}="{_echapper(valeur)}"' for nom, valeur in sorted(valeurs.items())
+    )
+
+
+def _ecrire(operations):
+    """
+    Applique des incréments en un seul aller-retour Redis.
+
+    Une métrique perdue vaut mieux qu'une requête en erreur : les erreurs
+    Redis sont journalisées puis ignorées.
+    """
+    try:
+        pipeline = _redis().pipeline(transaction=False)
+        for cle, champ, increment in operations:
+            pipeline.hincrbyfloat(cle, champ, increment)
+        pipeline.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Métriques non enregistrées: {str(e)}")
+
+
+class Metrique:
+    """
+    Métrique partagée par tous les processus (gunicorn, workers Celery) :
+    chaque série est un champ d'un hash Redis, incrémenté atomiquement.
+    """
+
+    type = None
+
+    def __init__(self, nom, description, etiquettes=()):
+        self.nom = nom
+        self.description = description
+        self.etiquettes = tuple(etiquettes)
+        self.cle = PREFIXE + nom
+        _registre[nom] = self
+
+    def _serie(self, valeurs):
+        if set(valeurs) != set(self.etiquettes):
+            raise ValueError(
+                f"{self.nom}: étiquettes attendues {self.etiquettes}, "
+                f"reçues {tuple(valeurs)}"
+            )
+        return _etiquettes(valeurs)
+
+    def exporter(self, champs):
+        lignes = [
+            f"# HELP {self.nom} {self.description}",
+            f"# TYPE {self.nom} {self.type}",
+        ]
+        return lignes + self._lignes(champs)
+
+    def _lignes(self, champs):
+        return [
+            (
+                f"{self.nom}{{{serie}}} {_nombre(valeur)}"
+                if serie
+                else f"{self.nom} {_nombre(valeur)}"
+            )
+            for serie, valeur in sorted(champs.items())
+        ]
+
+
+class Compteur(Metrique):
+    type = "counter"
+
+    def inc(self, valeur=1, **etiquettes):
+        _ecrire([(self.cle, self._serie(etiquettes), valeur)])
+
+
+class Histogramme(Metrique):
+    """
+    Histogramme à bornes fixes. Chaque observation n'incrémente que son
+    intervalle, sa somme et son nombre ; les cumuls ``le`` sont calculés à
+    l'export.
+    """
+
+    type = "histogram"
+
+    def __init__(self, nom, description, etiquettes=(), bornes=BORNES_DUREE):
+        super().__init__(nom, description, etiquettes)
+        self.bornes = tuple(sorted(bornes))
+
+    def observer(self, valeur, **etiquettes):
+        serie = self._serie(etiquettes)
+        borne = next((b for b in self.bornes if valeur <= b), "+Inf")
+        _ecrire(
+            [
+                (self.cle, f"{serie}|{borne}", 1),
+                (self.cle, f"{serie}|sum", valeur),
+                (self.cle, f"{serie}|count", 1),
+            ]
+        )
+
+    @contextmanager
+    def chronometrer(self, **etiquettes):
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observer(time.perf_counter() - debut, **etiquettes)
+
+    def _lignes(self, champs):
+        series = {}
+        for champ, valeur in champs.items():
+            serie, suffixe = champ.rsplit("|", 1)
+            series.setdefault(serie, {})[suffixe] = valeur
+
+        lignes = []
+        for serie, valeurs in sorted(series.items()):
+            separateur = "," if serie else ""
+            cumul = 0
+            for borne in self.bornes + ("+Inf",):
+                cumul += valeurs.get(str(borne), 0)
+                lignes.append(
+                    f'{self.nom}_bucket{{{serie}{separateur}le="{borne}"}} '
+                    f"{_nombre(cumul)}"
+                )
+            for suffixe in ("sum", "count"):
+                etiquettes = f"{{{serie}}}" if serie else ""
+                lignes.append(
+                    f"{self.nom}_{suffixe}{etiquettes} "
+                    f"{_nombre(valeurs.get(suffixe, 0))}"
+                )
+        return lignes
+
+
+def _nombre(valeur):
+    valeur = float(valeur)
+    return str(int(valeur)) if valeur.is_integer() else repr(valeur)
+
+
+def _jauge(nom, description, valeurs):
+    lignes = [f"# HELP {nom} {description}", f"# TYPE {nom} gauge"]
+    for etiquettes, valeur in valeurs:
+        serie = f"{{{_etiquettes(etiquettes)}}}" if etiquettes else ""
+        lignes.append(f"{nom}{serie} {_nombre(valeur)}")
+    return lignes
+
+
+def _jauges():
+    """Métriques lues en base au moment de la collecte."""
+    from .models import StockCle
+    from .reprise_emails import statistiques_echecs
+
+    stock = StockCle.objects.a_jour().values_list(
+        "produit_id", "produit__nom", "disponibles_a_jour"
+    )
+    echecs = statistiques_echecs()
+    plus_ancien = echecs["plus_ancien"]
+    return (
+        _jauge(
+            "ejlogiciel_cles_disponibles",
+            "Clés disponibles par produit.",
+            (
+                ({"produit_id": produit_id, "produit": nom}, disponibles)
+                for produit_id, nom, disponibles in stock.order_by("produit_id")
+            ),
+        )
+        + _jauge(
+            "ejlogiciel_emails_echec_en_attente",
+            "Emails en échec non résolus.",
+            [({}, echecs["en_attente"])],
+        )
+        + _jauge(
+            "ejlogiciel_emails_echec_a_rejouer",
+            "Emails en échec éligibles à une reprise.",
+            [({}, echecs["a_rejouer"])],
+        )
+        + _jauge(
+            "ejlogiciel_emails_echec_plus_ancien_timestamp_secondes",
+            "Date du plus ancien email en échec non résolu.",
+            [({}, plus_ancien.timestamp())] if plus_ancien else [],
+        )
+    )
+
+
+def exporter():
+    """
+    Toutes les métriques au format texte d'exposition Prometheus.
+
+    Si Redis ne répond pas, seules les jauges lues en base sont exportées ;
+    ``ejlogiciel_metriques_redis_disponible`` vaut alors 0.
+    """
+    metriques = list(_registre.values())
+    try:
+        pipeline = _redis().pipeline(transaction=False)
+        for metrique in metriques:
+            pipeline.hgetall(metrique.cle)
+        resultats = pipeline.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Métriques Redis indisponibles: {str(e)}")
+        resultats = None
+
+    lignes = []
+    for metrique, champs in zip(metriques, resultats or ()):
+        champs = {champ.decode(): float(valeur) for champ, valeur in champs.items()}
+        lignes += metrique.exporter(champs)
+    lignes += _jauge(
+        "ejlogiciel_metriques_redis_disponible",
+        "1 si les métriques partagées ont pu être lues dans Redis.",
+        [({}, int(resultats is not None))],
+    )
+    lignes += _jauges()
+    return "\n".join(lignes) + "\n"
+
+
+def reinitialiser():
+    """Efface les valeurs enregistrées de toutes les métriques."""
+    _redis().delete(*(metrique.cle for metrique in _registre.values()))
+
+
+ACTIONS_CREEES = Compteur(
+    "ejlogiciel_actions_creees_total", "Actions créées, par type.", ["type"]
+)
+RESERVATION_CLES = Histogramme(
+    "ejlogiciel_reservation_cles_secondes",
+    "Durée de la réservation des clés d'un achat.",
+    ["resultat"],
+)
+ENVOI_EMAIL = Histogramme(
+    "ejlogiciel_envoi_email_secondes",
+    "Durée de la tâche envoyer_cles_email_async.",
+    ["resultat"],
+)
+REPRISES_EMAIL = Compteur(
+    "ejlogiciel_envoi_email_reprises_total",
+    "Nouvelles tentatives planifiées par envoyer_cles_email_async.",
+)
+ECHECS_EMAIL = Compteur(
+    "ejlogiciel_envoi_email_echecs_total",
+    "Emails abandonnés par envoyer_cles_email_async après la dernière tentative.",
+)
+EMAILS_LOTS = Compteur(
+    "ejlogiciel_emails_lots_total",
+    "Emails de factures envoyés par lots, par résultat.",
+    ["resultat"],
+)
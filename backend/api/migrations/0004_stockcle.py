@@ -0,0 +1,56 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def initialiser_stock(apps, schema_editor):
+    Produit = apps.get_model("api", "Produit")
+    StockCle = apps.get_model("api", "StockCle")
+
+    produits = Produit.objects.annotate(
+        disponibles=Count("produits", filter=Q(produits__disponiblite=True))
+    ).values_list("id", "disponibles")
+    StockCle.objects.bulk_create(
+        [
+            StockCle(produit_id=produit_id, disponibles=disponibles)
+            for produit_id, disponibles in produits
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_emailechec"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StockCle",
+            fields=[
+                (
+                    "produit",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stock",
+                        serialize=False,
+                        to="api.produit",
+                    ),
+                ),
+                ("disponibles", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="cle",
+            index=models.Index(
+                condition=models.Q(("disponiblite", True)),
+                fields=["produit", "id"],
+                name="cle_disponible_idx",
+            ),
+        ),
+        migrations.RunPython(initialiser_stock, migrations.RunPython.noop),
+    ]
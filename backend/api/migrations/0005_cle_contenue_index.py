@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_stockcle"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="cle",
+            name="contenue",
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,126 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_cle_contenue_index"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="action",
+            name="date_action",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name="VenteJournaliere",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("jour", models.DateField()),
+                (
+                    "type",
+                    models.CharField(
+                        choices=[("achat", "Achat"), ("devis", "Devis")], max_length=10
+                    ),
+                ),
+                ("nombre_actions", models.PositiveIntegerField(default=0)),
+                (
+                    "montant_total",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("jour", "type"), name="vente_journaliere_unique"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="VenteClientJournaliere",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("jour", models.DateField()),
+                ("nombre_actions", models.PositiveIntegerField(default=0)),
+                (
+                    "montant_total",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "client",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ventes_journalieres",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("jour", "client"),
+                        name="vente_client_journaliere_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="VenteProduitJournaliere",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("jour", models.DateField()),
+                ("nombre_lignes", models.PositiveIntegerField(default=0)),
+                ("quantite", models.PositiveIntegerField(default=0)),
+                (
+                    "montant_total",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "produit",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ventes_journalieres",
+                        to="api.produit",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("jour", "produit"),
+                        name="vente_produit_journaliere_unique",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_ventes_journalieres"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Facture",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fichier", models.FileField(upload_to="factures/%Y/%m/")),
+                ("cles_data", models.JSONField(default=dict)),
+                ("date_creation", models.DateTimeField(auto_now_add=True)),
+                ("date_envoi", models.DateTimeField(blank=True, null=True)),
+                (
+                    "action",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="facture",
+                        to="api.action",
+                    ),
+                ),
+            ],
+        ),
+    ]
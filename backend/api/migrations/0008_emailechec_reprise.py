@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_facture"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emailechec",
+            name="date_resolution",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="emailechec",
+            name="prochain_essai",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="emailechec",
+            name="tentatives",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="emailechec",
+            index=models.Index(
+                fields=["resolu", "date_echec"], name="emailechec_file_idx"
+            ),
+        ),
+    ]
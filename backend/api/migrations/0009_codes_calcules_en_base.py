@@ -0,0 +1,83 @@
+import api.models
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.db import migrations, models
+
+CODE_CLE_TRIGGER = """
+CREATE OR REPLACE FUNCTION api_cle_code_cle() RETURNS trigger AS $$
+BEGIN
+    SELECT p.nom || '-' || NEW.id INTO NEW.code_cle
+    FROM api_produit p
+    WHERE p.id = NEW.produit_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER api_cle_code_cle
+BEFORE INSERT OR UPDATE OF produit_id ON api_cle
+FOR EACH ROW EXECUTE FUNCTION api_cle_code_cle();
+"""
+
+SUPPRIMER_CODE_CLE_TRIGGER = """
+DROP TRIGGER IF EXISTS api_cle_code_cle ON api_cle;
+DROP FUNCTION IF EXISTS api_cle_code_cle();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_emailechec_reprise"),
+    ]
+
+    operations = [
+        # Une colonne existante ne peut pas devenir générée : elle est recréée,
+        # et PostgreSQL calcule la valeur de toutes les lignes existantes.
+        migrations.RemoveField(
+            model_name="utilisateur",
+            name="code_utilisateur",
+        ),
+        migrations.AddField(
+            model_name="utilisateur",
+            name="code_utilisateur",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.db.models.functions.text.Concat(
+                    "role",
+                    models.Value("-"),
+                    django.db.models.functions.comparison.Cast(
+                        "id", models.CharField()
+                    ),
+                ),
+                output_field=models.CharField(max_length=150),
+            ),
+        ),
+        migrations.RemoveField(
+            model_name="action",
+            name="code_action",
+        ),
+        migrations.AddField(
+            model_name="action",
+            name="code_action",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.db.models.functions.text.Concat(
+                    models.Value("EJ-"),
+                    "type",
+                    models.Value("-"),
+                    django.db.models.functions.comparison.Cast(
+                        "id", models.CharField()
+                    ),
+                ),
+                output_field=models.CharField(max_length=50),
+            ),
+        ),
+        migrations.AlterField(
+            model_name="cle",
+            name="code_cle",
+            field=api.models.CodeCleField(
+                blank=True, editable=False, max_length=50, null=True
+            ),
+        ),
+        migrations.RunSQL(CODE_CLE_TRIGGER, SUPPRIMER_CODE_CLE_TRIGGER),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_codes_calcules_en_base"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CleIdempotence",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("cle", models.CharField(max_length=255)),
+                ("empreinte", models.CharField(max_length=64)),
+                ("statut", models.PositiveSmallIntegerField(blank=True, null=True)),
+                ("reponse", models.TextField(blank=True, null=True)),
+                ("date_creation", models.DateTimeField(auto_now_add=True)),
+                ("date_expiration", models.DateTimeField(db_index=True)),
+                (
+                    "utilisateur",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("utilisateur", "cle"), name="cleidempotence_unique"
+                    )
+                ],
+            },
+        ),
+    ]
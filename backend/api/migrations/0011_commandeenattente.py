@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_cleidempotence"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CommandeEnAttente",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("donnees", models.TextField()),
+                (
+                    "statut",
+                    models.CharField(
+                        choices=[
+                            ("en_attente", "En attente"),
+                            ("traitee", "Traitée"),
+                            ("refusee", "Refusée"),
+                        ],
+                        default="en_attente",
+                        max_length=20,
+                    ),
+                ),
+                ("resultat", models.TextField(blank=True, null=True)),
+                ("date_creation", models.DateTimeField(auto_now_add=True)),
+                ("date_traitement", models.DateTimeField(blank=True, null=True)),
+                (
+                    "action",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="api.action",
+                    ),
+                ),
+                (
+                    "vendeur",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="commandes_en_attente",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("statut", "en_attente")),
+                        fields=["id"],
+                        name="commande_en_attente_idx",
+                    )
+                ],
+            },
+        ),
+    ]
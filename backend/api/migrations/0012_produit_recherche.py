@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:13
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+def creer_index_trigrammes(apps, schema_editor):
+    # pg_trgm (module contrib) n'est pas disponible sur toutes les
+    # installations : la recherche approchée s'en passe alors
+    with schema_editor.connection.cursor() as curseur:
+        curseur.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if curseur.fetchone() is None:
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS produit_nom_trgm_idx "
+        "ON api_produit USING gin (nom gin_trgm_ops)"
+    )
+
+
+def supprimer_index_trigrammes(apps, schema_editor):
+    schema_editor.execute("DROP INDEX IF EXISTS produit_nom_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_commandeenattente"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="produit",
+            name="recherche",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.postgres.search.CombinedSearchVector(
+                    django.contrib.postgres.search.SearchVector(
+                        "nom", config="french", weight="A"
+                    ),
+                    "||",
+                    django.contrib.postgres.search.SearchVector(
+                        "description", config="french", weight="B"
+                    ),
+                    django.contrib.postgres.search.SearchConfig("french"),
+                ),
+                output_field=django.contrib.postgres.search.SearchVectorField(),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="produit",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["recherche"], name="produit_recherche_idx"
+            ),
+        ),
+        migrations.RunPython(creer_index_trigrammes, supprimer_index_trigrammes),
+    ]
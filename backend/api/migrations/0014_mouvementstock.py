@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Un trigger par instruction (et non par ligne) : une vente ou un import de
+# milliers de clés écrit un mouvement par produit
+MOUVEMENT_STOCK_TRIGGERS = """
+CREATE OR REPLACE FUNCTION api_cle_mouvement_stock() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO api_mouvementstock (produit_id, delta)
+        SELECT produit_id, count(*) FROM nouvelles
+        WHERE disponiblite GROUP BY produit_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO api_mouvementstock (produit_id, delta)
+        SELECT produit_id, -count(*) FROM anciennes
+        WHERE disponiblite GROUP BY produit_id;
+    ELSE
+        INSERT INTO api_mouvementstock (produit_id, delta)
+        SELECT produit_id, sum(delta) FROM (
+            SELECT produit_id, -1 AS delta FROM anciennes WHERE disponiblite
+            UNION ALL
+            SELECT produit_id, 1 FROM nouvelles WHERE disponiblite
+        ) m
+        GROUP BY produit_id
+        HAVING sum(delta) <> 0;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER api_cle_stock_insert
+AFTER INSERT ON api_cle REFERENCING NEW TABLE AS nouvelles
+FOR EACH STATEMENT EXECUTE FUNCTION api_cle_mouvement_stock();
+
+CREATE TRIGGER api_cle_stock_update
+AFTER UPDATE ON api_cle REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+FOR EACH STATEMENT EXECUTE FUNCTION api_cle_mouvement_stock();
+
+CREATE TRIGGER api_cle_stock_delete
+AFTER DELETE ON api_cle REFERENCING OLD TABLE AS anciennes
+FOR EACH STATEMENT EXECUTE FUNCTION api_cle_mouvement_stock();
+"""
+
+SUPPRIMER_MOUVEMENT_STOCK_TRIGGERS = """
+DROP TRIGGER IF EXISTS api_cle_stock_insert ON api_cle;
+DROP TRIGGER IF EXISTS api_cle_stock_update ON api_cle;
+DROP TRIGGER IF EXISTS api_cle_stock_delete ON api_cle;
+DROP FUNCTION IF EXISTS api_cle_mouvement_stock();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_produit_variantes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MouvementStock",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("delta", models.IntegerField()),
+                (
+                    "produit",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="api.produit",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunSQL(MOUVEMENT_STOCK_TRIGGERS, SUPPRIMER_MOUVEMENT_STOCK_TRIGGERS),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:42
+
+from django.db import migrations, models
+
+# Une clé vendue en plusieurs exemplaires ne peut pas être réglée ici : les
+# clients concernés ont reçu la même clé
+CLES_VENDUES_EN_DOUBLE = """
+SELECT array_agg(id ORDER BY id)
+FROM api_cle
+WHERE NOT disponiblite
+GROUP BY contenue
+HAVING count(*) > 1
+"""
+
+# Garde, pour chaque contenu, la clé vendue s'il y en a une, sinon la plus
+# ancienne ; les autres exemplaires, disponibles, sont supprimés (le trigger
+# de la migration 0014 note la baisse du stock)
+SUPPRIMER_DOUBLONS = """
+DELETE FROM api_cle c
+USING (
+    SELECT id,
+           row_number() OVER (PARTITION BY contenue ORDER BY disponiblite, id)
+               AS rang
+    FROM api_cle
+) d
+WHERE c.id = d.id AND d.rang > 1
+"""
+
+
+def supprimer_doublons(apps, schema_editor):
+    with schema_editor.connection.cursor() as curseur:
+        curseur.execute(CLES_VENDUES_EN_DOUBLE)
+        vendues = [ids for (ids,) in curseur.fetchall()]
+    if vendues:
+        # Les ids seulement : le contenu des clés n'a pas à figurer dans les
+        # journaux de déploiement
+        raise RuntimeError(
+            "Clés vendues en plusieurs exemplaires (ids : "
+            f"{'; '.join(', '.join(map(str, ids)) for ids in vendues)}). "
+            "Remplacez-les chez les clients concernés et supprimez les "
+            "doublons avant de relancer la migration."
+        )
+    schema_editor.execute(SUPPRIMER_DOUBLONS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_mouvementstock"),
+    ]
+
+    operations = [
+        migrations.RunPython(supprimer_doublons, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="cle",
+            name="contenue",
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_cle_contenue_unique"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="facture",
+            index=models.Index(
+                condition=models.Q(("date_envoi__isnull", True)),
+                fields=["date_creation"],
+                name="facture_non_envoyee_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:12
+
+from django.db import migrations
+
+# Le trigger de la migration 0009 ne calcule code_cle qu'à l'insertion : les
+# clés antérieures gardent les codes de l'ancien calcul (« <nom>-None »)
+RECALCULER_CODE_CLE = """
+UPDATE api_cle c
+SET code_cle = p.nom || '-' || c.id
+FROM api_produit p
+WHERE p.id = c.produit_id
+  AND c.code_cle IS DISTINCT FROM p.nom || '-' || c.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0016_facture_non_envoyee_idx"),
+    ]
+
+    operations = [
+        migrations.RunSQL(RECALCULER_CODE_CLE, migrations.RunSQL.noop),
+    ]
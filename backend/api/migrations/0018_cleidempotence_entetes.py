@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0017_recalculer_code_cle"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cleidempotence",
+            name="entetes",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -1,5 +1,12 @@
+import json
+
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models
+from django.db.models.functions import Cast, Coalesce, Concat
+from django.utils import timezone
 
 
 class Utilisateur(AbstractUser):
@@ -14,7 +21,12 @@ class Utilisateur(AbstractUser):
     role = models.CharField(max_length=100, choices=CHOIX_ROLE, default="client")
     numero_telephone = models.CharField(max_length=15)
     adresse = models.CharField(max_length=100)
-    code_utilisateur = models.CharField(max_length=50, null=True, blank=True)
+    # Calculé par la base à l'insertion et relu par INSERT ... RETURNING
+    code_utilisateur = models.GeneratedField(
+        expression=Concat("role", models.Value("-"), Cast("id", models.CharField())),
+        output_field=models.CharField(max_length=150),
+        db_persist=True,
+    )
 
     nif = models.CharField(max_length=100, null=True, blank=True)
     stats = models.CharField(max_length=100, null=True, blank=True)
@@ -23,10 +35,6 @@ class Utilisateur(AbstractUser):
     def __str__(self):
         return self.nom_complet
 
-    def save(self, *args, **kwargs):
-        self.code_utilisateur = f"{self.role}-{self.id}"
-        super().save(*args, **kwargs)
-
     class Meta:
         verbose_name = "Utilisateur"
         verbose_name_plural = "Utilisateurs"
@@ -41,6 +49,10 @@ class Categorie(models.Model):
         return self.nom
 
 
+# Configuration PostgreSQL du plein texte (racinisation, mots vides)
+CONFIG_RECHERCHE = "french"
+
+
 class Produit(models.Model):
 
     categorie = models.ForeignKey(
@@ -49,15 +61,118 @@ class Produit(models.Model):
     nom = models.CharField(max_length=100)
     description = models.TextField()
     image = models.ImageField(upload_to="produits/")
+    # Noms des variantes WebP de l'image (api/images.py), vide jusqu'à leur
+    # création par la tâche generer_variantes_image
+    variantes = models.JSONField(default=dict, blank=True, editable=False)
 
     prix_min = models.DecimalField(max_digits=10, decimal_places=2)
     prix = models.DecimalField(max_digits=10, decimal_places=2)
     prix_max = models.DecimalField(max_digits=10, decimal_places=2)
 
+    # Document de recherche plein texte, tenu à jour par la base
+    recherche = models.GeneratedField(
+        expression=SearchVector("nom", weight="A", config=CONFIG_RECHERCHE)
+        + SearchVector("description", weight="B", config=CONFIG_RECHERCHE),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [GinIndex(fields=["recherche"], name="produit_recherche_idx")]
+
     def __str__(self):
         return f"{self.nom} - {self.prix}"
 
 
+class StockInsuffisant(Exception):
+    """Levée quand un produit n'a pas assez de clés disponibles."""
+
+    def __init__(self, produit_id, disponibles, demandees):
+        self.produit_id = produit_id
+        self.disponibles = disponibles
+        self.demandees = demandees
+        super().__init__(
+            f"Produit {produit_id}: {disponibles} clé(s) disponible(s) "
+            f"pour {demandees} demandée(s)"
+        )
+
+
+class CleQuerySet(models.QuerySet):
+
+    def reserver(self, demandes):
+        """
+        Réserve en une seule requête les clés de plusieurs produits.
+
+        ``demandes`` associe l'id d'un produit à la quantité voulue. Les clés
+        déjà verrouillées par une autre transaction sont sautées (SKIP LOCKED)
+        au lieu d'être attendues. Retourne les clés réservées groupées par
+        produit, ou lève ``StockInsuffisant`` : l'appelant doit alors annuler
+        la transaction en cours.
+
+        Le compteur ``StockCle`` n'est pas verrouillé : la vente est notée
+        dans ``MouvementStock`` par un trigger.
+        """
+        demandes = {int(p): int(q) for p, q in demandes.items() if int(q) > 0}
+        if not demandes:
+            return {}
+
+        table = self.model._meta.db_table
+        sql = f"""
+            WITH demandes AS (
+                SELECT * FROM unnest(%s::bigint[], %s::integer[])
+                    AS d(produit_id, quantite)
+            ),
+            choisies AS (
+                SELECT c.id
+                FROM demandes d
+                CROSS JOIN LATERAL (
+                    SELECT id FROM {table}
+                    WHERE produit_id = d.produit_id AND disponiblite
+                    ORDER BY id
+                    LIMIT d.quantite
+                    FOR UPDATE SKIP LOCKED
+                ) c
+            ),
+            vendues AS (
+                UPDATE {table} SET disponiblite = false
+                FROM choisies
+                WHERE {table}.id = choisies.id
+                RETURNING {table}.id, {table}.produit_id, {table}.contenue,
+                          {table}.code_cle, {table}.validite
+            )
+            SELECT id, produit_id, contenue, code_cle, validite FROM vendues
+        """
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, [list(demandes), list(demandes.values())])
+            lignes = cursor.fetchall()
+
+        reservees = {produit_id: [] for produit_id in demandes}
+        for cle_id, produit_id, contenue, code_cle, validite in sorted(lignes):
+            reservees[produit_id].append(
+                {
+                    "id": cle_id,
+                    "contenue": contenue,
+                    "code_cle": code_cle,
+                    "validite": validite,
+                }
+            )
+
+        for produit_id, quantite in demandes.items():
+            if len(reservees[produit_id]) < quantite:
+                raise StockInsuffisant(produit_id, len(reservees[produit_id]), quantite)
+        return reservees
+
+
+class CodeCleField(models.CharField):
+    """
+    ``code_cle`` est renseigné par un trigger PostgreSQL (migration 0009) à
+    partir du nom du produit et de l'id ; la valeur est relue par
+    INSERT ... RETURNING, y compris avec ``bulk_create``.
+    """
+
+    db_returning = True
+
+
 class Cle(models.Model):
     CHOIX_VALIDITE = [
         ("1 ans", "1 ans"),
@@ -66,20 +181,115 @@ class Cle(models.Model):
         ("a vie", "a vie"),
     ]
 
-    contenue = models.CharField(max_length=100)
+    contenue = models.CharField(max_length=100, unique=True)
     produit = models.ForeignKey(
         Produit, on_delete=models.CASCADE, related_name="produits"
     )
     validite = models.CharField(max_length=10, choices=CHOIX_VALIDITE)
     disponiblite = models.BooleanField(default=True)
-    code_cle = models.CharField(max_length=50, null=True, blank=True)
+    code_cle = CodeCleField(max_length=50, null=True, blank=True, editable=False)
+
+    objects = CleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Seules les clés disponibles sont cherchées lors d'un achat
+            models.Index(
+                fields=["produit", "id"],
+                condition=models.Q(disponiblite=True),
+                name="cle_disponible_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.produit.nom} - {self.contenue[:4]}-****-{self.produit.prix}"
 
-    def save(self, *args, **kwargs):
-        self.code_cle = f"{self.produit.nom}-{self._get_pk_val()}"
-        super().save(*args, **kwargs)
+
+class StockCleQuerySet(models.QuerySet):
+
+    def a_jour(self):
+        """
+        Ajoute ``disponibles_a_jour`` : le compteur plus les mouvements qui
+        n'y sont pas encore reportés.
+        """
+        en_attente = (
+            MouvementStock.objects.filter(produit=models.OuterRef("produit"))
+            .values("produit")
+            .annotate(total=models.Sum("delta"))
+            .values("total")
+        )
+        return self.annotate(
+            disponibles_a_jour=models.F("disponibles")
+            + Coalesce(models.Subquery(en_attente), 0)
+        )
+
+
+class StockCle(models.Model):
+    """
+    Nombre de clés disponibles par produit, pour l'affichage. Les achats ne
+    le lisent pas : la réservation des clés vérifie elle-même le stock.
+    """
+
+    produit = models.OneToOneField(
+        Produit, on_delete=models.CASCADE, primary_key=True, related_name="stock"
+    )
+    disponibles = models.IntegerField(default=0)
+
+    objects = StockCleQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.produit_id} - {self.disponibles}"
+
+
+class MouvementStockQuerySet(models.QuerySet):
+
+    def appliquer(self):
+        """
+        Reporte les mouvements sur ``StockCle`` et les supprime. Retourne le
+        nombre de produits mis à jour.
+
+        Les compteurs sont verrouillés dans l'ordre des produits : deux
+        reports simultanés ne peuvent pas s'interbloquer, et un mouvement
+        n'est reporté qu'une fois. Ceux d'un produit supprimé sont abandonnés.
+        """
+        mouvements = self.model._meta.db_table
+        stocks = StockCle._meta.db_table
+        sql = f"""
+            WITH reportes AS (
+                DELETE FROM {mouvements} RETURNING produit_id, delta
+            )
+            INSERT INTO {stocks} (produit_id, disponibles)
+            SELECT r.produit_id, sum(r.delta)
+            FROM reportes r
+            JOIN {Produit._meta.db_table} p ON p.id = r.produit_id
+            GROUP BY r.produit_id
+            ORDER BY r.produit_id
+            ON CONFLICT (produit_id) DO UPDATE
+            SET disponibles = {stocks}.disponibles + EXCLUDED.disponibles
+        """
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.rowcount
+
+
+class MouvementStock(models.Model):
+    """
+    Variation du nombre de clés disponibles d'un produit, écrite par les
+    triggers de ``api_cle`` (migration 0014) à chaque création, vente,
+    modification ou suppression de clés, y compris en masse.
+
+    La table ne reçoit que des ajouts : une vente n'y attend aucun verrou.
+    Les mouvements sont reportés sur ``StockCle`` par la tâche périodique
+    ``appliquer_mouvements_stock``.
+    """
+
+    # Sans contrainte : les clés d'un produit sont supprimées avant lui
+    produit = models.ForeignKey(
+        Produit, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    delta = models.IntegerField()
+
+    objects = MouvementStockQuerySet.as_manager()
 
 
 class MethodePaiement(models.Model):
@@ -98,7 +308,7 @@ class Action(models.Model):
 
     type = models.CharField(max_length=10, choices=CHOIX_TYPE)
     prix = models.DecimalField(max_digits=10, decimal_places=2)
-    date_action = models.DateTimeField(auto_now_add=True)
+    date_action = models.DateTimeField(auto_now_add=True, db_index=True)
     livree = models.BooleanField(default=False)
     payee = models.BooleanField(default=False)
 
@@ -116,14 +326,19 @@ class Action(models.Model):
         MethodePaiement, on_delete=models.CASCADE, related_name="actions"
     )
 
-    code_action = models.CharField(max_length=50, null=True, blank=True)
+    code_action = models.GeneratedField(
+        expression=Concat(
+            models.Value("EJ-"),
+            "type",
+            models.Value("-"),
+            Cast("id", models.CharField()),
+        ),
+        output_field=models.CharField(max_length=50),
+        db_persist=True,
+    )
 
     def __str__(self):
-        return f"{self.type} - {self.client.nom} - {self.code_action}"
-
-    def save(self, *args, **kwargs):
-        self.code_action = f"EJ-{self.type}-{self.id}"
-        super().save(*args, **kwargs)
+        return f"{self.type} - {self.client.nom_complet} - {self.code_action}"
 
 
 class ElementAchatDevis(models.Model):
@@ -143,6 +358,124 @@ class ElementAchatDevis(models.Model):
     prix_total = models.DecimalField(max_digits=10, decimal_places=2)
 
 
+class Facture(models.Model):
+    """PDF rendu d'une action, conservé pour être (ré)envoyé sans être redessiné."""
+
+    action = models.OneToOneField(
+        Action, on_delete=models.CASCADE, related_name="facture"
+    )
+    fichier = models.FileField(upload_to="factures/%Y/%m/")
+    cles_data = models.JSONField(default=dict)
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_envoi = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Balayage des factures non envoyées (reprendre_factures_non_envoyees)
+            models.Index(
+                fields=["date_creation"],
+                condition=models.Q(date_envoi__isnull=True),
+                name="facture_non_envoyee_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Facture {self.action_id} - {self.fichier.name}"
+
+
+class CommandeEnAttente(models.Model):
+    """
+    Commande reçue en mode asynchrone, créée ensuite par la tâche
+    ``traiter_commandes`` (voir api/commandes.py).
+    """
+
+    EN_ATTENTE = "en_attente"
+    TRAITEE = "traitee"
+    REFUSEE = "refusee"
+    CHOIX_STATUT = [
+        (EN_ATTENTE, "En attente"),
+        (TRAITEE, "Traitée"),
+        (REFUSEE, "Refusée"),
+    ]
+
+    vendeur = models.ForeignKey(
+        Utilisateur, on_delete=models.CASCADE, related_name="commandes_en_attente"
+    )
+    # Corps JSON de la requête POST /api/actions/
+    donnees = models.TextField()
+    statut = models.CharField(max_length=20, choices=CHOIX_STATUT, default=EN_ATTENTE)
+    action = models.ForeignKey(
+        Action, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    # Réponse JSON de la création, ou erreurs du refus
+    resultat = models.TextField(null=True, blank=True)
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_traitement = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # La file ne parcourt que les commandes en attente
+            models.Index(
+                fields=["id"],
+                condition=models.Q(statut="en_attente"),
+                name="commande_en_attente_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Commande {self.id} - {self.statut}"
+
+    def terminer(self, statut, resultat, action_id=None):
+        """Renseigne l'issue du traitement, sans enregistrer."""
+        self.statut = statut
+        self.resultat = json.dumps(resultat, cls=DjangoJSONEncoder)
+        self.action_id = action_id
+        self.date_traitement = timezone.now()
+
+
+class CleIdempotence(models.Model):
+    """
+    Requête reçue avec un en-tête ``Idempotency-Key`` et, une fois traitée
+    avec succès, sa réponse (voir api/idempotence.py).
+    """
+
+    utilisateur = models.ForeignKey(
+        Utilisateur, on_delete=models.CASCADE, related_name="+"
+    )
+    cle = models.CharField(max_length=255)
+    # SHA-256 du chemin et du corps de la requête
+    empreinte = models.CharField(max_length=64)
+    # Nuls tant que la requête est en cours ; réponse encodée en JSON
+    statut = models.PositiveSmallIntegerField(null=True, blank=True)
+    reponse = models.TextField(null=True, blank=True)
+    # En-têtes de la réponse rejoués avec elle (Location d'un 202...)
+    entetes = models.JSONField(default=dict, blank=True)
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_expiration = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["utilisateur", "cle"], name="cleidempotence_unique"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.utilisateur_id} - {self.cle}"
+
+    def enregistrement(self):
+        return {
+            "empreinte": self.empreinte,
+            "statut": self.statut,
+            "reponse": json.loads(self.reponse) if self.reponse else None,
+            "entetes": self.entetes,
+        }
+
+    def duree_restante(self):
+        """Secondes avant expiration, durée de vie de la copie en cache."""
+        return max(int((self.date_expiration - timezone.now()).total_seconds()), 1)
+
+
 class EmailEchec(models.Model):
 
     client = models.ForeignKey(Utilisateur, on_delete=models.CASCADE)
@@ -151,6 +484,68 @@ class EmailEchec(models.Model):
     erreur = models.TextField()
     donnees = models.TextField()
     resolu = models.BooleanField(default=False)
+    # Reprise automatique (voir api/reprise_emails.py)
+    tentatives = models.PositiveIntegerField(default=0)
+    prochain_essai = models.DateTimeField(null=True, blank=True)
+    date_resolution = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["resolu", "date_echec"], name="emailechec_file_idx"),
+        ]
 
     def __str__(self):
         return f"Échec email pour {self.client.email} - {self.date_echec}"
+
+
+class VenteJournaliere(models.Model):
+    """Nombre et montant des actions d'un jour, par type."""
+
+    jour = models.DateField()
+    type = models.CharField(max_length=10, choices=Action.CHOIX_TYPE)
+    nombre_actions = models.PositiveIntegerField(default=0)
+    montant_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["jour", "type"], name="vente_journaliere_unique"
+            ),
+        ]
+
+
+class VenteProduitJournaliere(models.Model):
+    """Lignes vendues ou devisées d'un produit sur un jour."""
+
+    jour = models.DateField()
+    produit = models.ForeignKey(
+        Produit, on_delete=models.CASCADE, related_name="ventes_journalieres"
+    )
+    nombre_lignes = models.PositiveIntegerField(default=0)
+    quantite = models.PositiveIntegerField(default=0)
+    montant_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["jour", "produit"], name="vente_produit_journaliere_unique"
+            ),
+        ]
+
+
+class VenteClientJournaliere(models.Model):
+    """Actions d'un client sur un jour."""
+
+    jour = models.DateField()
+    client = models.ForeignKey(
+        Utilisateur, on_delete=models.CASCADE, related_name="ventes_journalieres"
+    )
+    nombre_actions = models.PositiveIntegerField(default=0)
+    montant_total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["jour", "client"], name="vente_client_journaliere_unique"
+            ),
+        ]
@@ -0,0 +1,190 @@
+import json
+from datetime import date, time
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+from uuid import UUID
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    CursorPagination,
+    PageNumberPagination,
+    _reverse_ordering,
+)
+
+
+def _valeur_curseur(valeur):
+    """
+    Valeur d'un critère de tri dans le curseur (``default`` de json.dumps),
+    relue à l'identique par ``to_python`` du champ : microsecondes et fuseau
+    des dates, chiffres des décimaux.
+    """
+    if isinstance(valeur, (date, time)):
+        return valeur.isoformat()
+    if isinstance(valeur, (Decimal, UUID)):
+        return str(valeur)
+    raise TypeError(f"Valeur de curseur non prise en charge : {valeur!r}")
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Pagination par curseur sur l'ordre déclaré par la vue (``ordering``).
+
+    La clé primaire est ajoutée en dernier critère pour que chaque ligne ait
+    une position unique : le curseur encode les valeurs de tous les critères
+    de la dernière ligne vue, et la page suivante est lue par comparaison
+    lexicographique sur ces valeurs, sans OFFSET, quelle que soit la taille
+    de la table. Un critère nullable est refusé : NULL ne se compare pas.
+    """
+
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+    ordering = ("id",)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, "ordering", None) or self.ordering
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        ordering = tuple(ordering)
+        if not {"id", "-id", "pk", "-pk"} & set(ordering):
+            ordering += ("id",)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self._requete_page(queryset, request, view)
+        if page is None:
+            return None
+        return self._paginer(list(page))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` pour les vues asynchrones (ORM asynchrone)."""
+        page = self._requete_page(queryset, request, view)
+        if page is None:
+            return None
+        return self._paginer([ligne async for ligne in page])
+
+    def _requete_page(self, queryset, request, view):
+        """Requête (non évaluée) de la page demandée, avec une ligne de plus."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.champs = [
+            (
+                queryset.model._meta.pk
+                if champ.lstrip("-") == "pk"
+                else queryset.model._meta.get_field(champ.lstrip("-"))
+            )
+            for champ in self.ordering
+        ]
+        nullables = [champ.name for champ in self.champs if champ.null]
+        if nullables:
+            raise ImproperlyConfigured(
+                f"{type(view).__name__} : critère de tri nullable "
+                f"({', '.join(nullables)}), incompatible avec KeysetPagination."
+            )
+        self.attnames = [champ.attname for champ in self.champs]
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = (0, False, None)
+        else:
+            offset, reverse, current_position = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = queryset.filter(self._apres(current_position, reverse))
+
+        self._position = (offset, reverse, current_position)
+        return queryset[offset : offset + self.page_size + 1]
+
+    def _paginer(self, results):
+        offset, reverse, current_position = self._position
+        self.page = list(results[: self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def _apres(self, position, reverse):
+        """Condition « strictement après ``position`` » dans l'ordre de lecture."""
+        try:
+            valeurs = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(valeurs, list) or len(valeurs) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            valeurs = [
+                champ.to_python(valeur) for champ, valeur in zip(self.champs, valeurs)
+            ]
+        except ValidationError:
+            raise NotFound(self.invalid_cursor_message)
+
+        conditions = []
+        for i, champ in enumerate(self.ordering):
+            decroissant = champ.startswith("-") != reverse
+            egalites = {self.attnames[j]: valeurs[j] for j in range(i)}
+            comparaison = "__lt" if decroissant else "__gt"
+            conditions.append(
+                Q(**egalites, **{self.attnames[i] + comparaison: valeurs[i]})
+            )
+        return reduce(or_, conditions)
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, dict):
+            valeurs = [
+                instance.get(champ.lstrip("-"), instance.get(attname))
+                for champ, attname in zip(ordering, self.attnames)
+            ]
+        else:
+            valeurs = [getattr(instance, attname) for attname in self.attnames]
+        return json.dumps(valeurs, default=_valeur_curseur)
+
+
+class RecherchePagination(PageNumberPagination):
+    """
+    Pagination par numéro de page des résultats d'une recherche : l'ordre de
+    pertinence est calculé et ne peut pas servir de curseur.
+    """
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
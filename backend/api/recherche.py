@@ -0,0 +1,55 @@
+import re
+from functools import cache
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    TrigramWordSimilarity,
+)
+from django.db import connection
+from django.db.models import F
+
+from .models import CONFIG_RECHERCHE
+
+MOTS = re.compile(r"\w+")
+
+
+@cache
+def trigrammes_disponibles():
+    """Vrai si l'extension pg_trgm est installée (migration 0012)."""
+    with connection.cursor() as curseur:
+        curseur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return curseur.fetchone() is not None
+
+
+def rechercher_produits(queryset, texte):
+    """
+    Produits correspondant à ``texte``, les plus pertinents d'abord.
+
+    La recherche plein texte (syntaxe web : guillemets, ``-mot``, ``or``)
+    porte sur la colonne ``recherche`` et son index GIN ; le nom pèse plus que
+    la description. Sans résultat, par exemple pour une faute de frappe, la
+    recherche devient approchée : similarité de trigrammes sur le nom avec
+    pg_trgm, sinon préfixes des mots saisis (« logi » trouve « logiciel »).
+    """
+    requete = SearchQuery(texte, config=CONFIG_RECHERCHE, search_type="websearch")
+    resultats = queryset.filter(recherche=requete)
+    if resultats.exists():
+        return resultats.annotate(pertinence=SearchRank(F("recherche"), requete))
+
+    if trigrammes_disponibles():
+        return queryset.filter(nom__trigram_word_similar=texte).annotate(
+            pertinence=TrigramWordSimilarity(texte, "nom")
+        )
+
+    mots = MOTS.findall(texte)
+    if not mots:
+        return queryset.none()
+    prefixes = SearchQuery(
+        " & ".join(f"{mot}:*" for mot in mots),
+        config=CONFIG_RECHERCHE,
+        search_type="raw",
+    )
+    return queryset.filter(recherche=prefixes).annotate(
+        pertinence=SearchRank(F("recherche"), prefixes)
+    )
@@ -0,0 +1,102 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLIQUE = "replica"
+
+# Vrai pendant une requête GET/HEAD adressée à une vue qui accepte la réplique :
+# les lectures peuvent y aller. Les threads de sync_to_async reçoivent une
+# copie du contexte.
+_lecture_replique = ContextVar("lecture_replique", default=False)
+
+
+@contextmanager
+def lecture_principale():
+    """
+    Lit la base principale dans ce bloc, même pendant une requête GET.
+
+    À utiliser pour remplir un cache invalidé par version (catalogue,
+    utilisateur authentifié) : une réplique en retard y mettrait des données
+    antérieures à l'invalidation.
+    """
+    jeton = _lecture_replique.set(False)
+    try:
+        yield
+    finally:
+        _lecture_replique.reset(jeton)
+
+
+class RouteurReplique:
+    """
+    Envoie à la réplique les lectures des requêtes GET et HEAD des vues qui
+    l'acceptent (voir ``RepliqueMiddleware``), hors transaction. Les
+    écritures, les migrations et les autres lectures (tâches Celery,
+    commandes) restent sur la base principale.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (
+            _lecture_replique.get()
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return REPLIQUE
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Mêmes données de part et d'autre
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class RepliqueMiddleware:
+    """
+    Autorise la lecture sur la réplique pendant les requêtes GET et HEAD
+    adressées à une vue dont l'attribut ``lecture_replique`` est vrai
+    (catalogue, statistiques).
+
+    Les autres vues lisent la base principale : une commande ou une action
+    consultée juste après sa création serait introuvable, ou pas encore
+    traitée, sur une réplique en retard.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        jeton = _lecture_replique.set(False)
+        try:
+            return self.get_response(request)
+        finally:
+            _lecture_replique.reset(jeton)
+
+    async def __acall__(self, request):
+        jeton = _lecture_replique.set(False)
+        try:
+            return await self.get_response(request)
+        finally:
+            _lecture_replique.reset(jeton)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Sous ASGI, Django l'exécute via sync_to_async, qui reporte la
+        # valeur dans le contexte de la requête
+        vue = getattr(view_func, "view_class", view_func)
+        if request.method in ("GET", "HEAD") and getattr(
+            vue, "lecture_replique", False
+        ):
+            _lecture_replique.set(True)
+        return None
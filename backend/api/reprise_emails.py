@@ -0,0 +1,151 @@
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .emails import construire_email, envoyer_messages
+from .factures import enregistrer_facture, lire_facture
+from .models import EmailEchec, Facture
+
+logger = logging.getLogger(__name__)
+
+# Un échec réservé par une reprise interrompue redevient éligible après ce délai
+DUREE_RESERVATION = timedelta(minutes=10)
+
+
+def a_rejouer(maintenant=None):
+    """
+    Échecs non résolus éligibles à une reprise.
+
+    Les échecs récents sont laissés aux nouvelles tentatives de la tâche
+    d'envoi ; ``EMAIL_REPRISE_DELAI`` doit couvrir toute sa série de reprises.
+    """
+    maintenant = maintenant or timezone.now()
+    return (
+        EmailEchec.objects.filter(
+            resolu=False,
+            date_echec__lte=maintenant
+            - timedelta(seconds=settings.EMAIL_REPRISE_DELAI),
+        )
+        .filter(Q(prochain_essai__isnull=True) | Q(prochain_essai__lte=maintenant))
+        .order_by("date_echec")
+    )
+
+
+def delai_attente(tentatives):
+    """Attente exponentielle avant la prochaine reprise d'un client."""
+    secondes = settings.EMAIL_REPRISE_INTERVALLE * 2 ** max(tentatives - 1, 0)
+    return timedelta(seconds=min(secondes, settings.EMAIL_REPRISE_ATTENTE_MAX))
+
+
+def resoudre(action_ids):
+    """Marque résolus tous les échecs en attente des actions envoyées."""
+    return EmailEchec.objects.filter(action_id__in=action_ids, resolu=False).update(
+        resolu=True, date_resolution=timezone.now()
+    )
+
+
+def _reserver(taille_lot):
+    """
+    Réserve un lot d'échecs, un par action.
+
+    Les lignes sont verrouillées avec SKIP LOCKED le temps de la réservation
+    seulement : deux reprises simultanées se partagent la file sans s'attendre
+    ni envoyer deux fois le même email.
+    """
+    maintenant = timezone.now()
+    with transaction.atomic():
+        echecs = list(
+            a_rejouer(maintenant)
+            .select_related("action__client")
+            .select_for_update(skip_locked=True, of=("self",))[:taille_lot]
+        )
+        EmailEchec.objects.filter(pk__in=[echec.pk for echec in echecs]).update(
+            prochain_essai=maintenant + DUREE_RESERVATION
+        )
+
+    par_action = {}
+    for echec in echecs:
+        par_action.setdefault(echec.action_id, echec)
+    return list(par_action.values())
+
+
+def rejouer_echecs(taille_lot=None):
+    """
+    Renvoie un lot d'emails en échec et retourne ``(envoyes, echoues)``.
+
+    Le PDF enregistré de l'action est renvoyé, ou rendu à partir des données
+    de l'échec s'il n'existe pas. Un succès résout tous les échecs de
+    l'action ; un échec repousse toutes les reprises du client avec une
+    attente qui double à chaque tentative.
+    """
+    echecs = _reserver(taille_lot or settings.EMAIL_REPRISE_LOT)
+    if not echecs:
+        return 0, 0
+
+    factures = Facture.objects.in_bulk(
+        [echec.action_id for echec in echecs], field_name="action_id"
+    )
+    messages, a_envoyer = [], []
+    for echec in echecs:
+        action = echec.action
+        try:
+            facture = factures.get(action.id) or enregistrer_facture(
+                action, action.client, json.loads(echec.donnees)
+            )
+            messages.append(
+                construire_email(
+                    action, action.client, facture.cles_data, lire_facture(facture)
+                )
+            )
+            a_envoyer.append(echec)
+        except Exception as e:
+            logger.error(
+                f"Reprise impossible de l'email de l'action {action.code_action}: "
+                f"{str(e)}"
+            )
+            _reporter(echec, e)
+
+    erreurs = dict(envoyer_messages(messages))
+    envoyes = [echec for indice, echec in enumerate(a_envoyer) if indice not in erreurs]
+    for indice, erreur in erreurs.items():
+        _reporter(a_envoyer[indice], erreur)
+
+    maintenant = timezone.now()
+    Facture.objects.filter(action_id__in=[echec.action_id for echec in envoyes]).update(
+        date_envoi=maintenant
+    )
+    resoudre([echec.action_id for echec in envoyes])
+    return len(envoyes), len(echecs) - len(envoyes)
+
+
+def _reporter(echec, erreur):
+    tentatives = echec.tentatives + 1
+    prochain_essai = timezone.now() + delai_attente(tentatives)
+    EmailEchec.objects.filter(pk=echec.pk).update(
+        tentatives=tentatives, erreur=str(erreur)
+    )
+    # L'attente s'applique à tous les emails en échec du même client
+    EmailEchec.objects.filter(client_id=echec.client_id, resolu=False).update(
+        prochain_essai=prochain_essai
+    )
+
+
+def statistiques_echecs(minutes=60):
+    """Taille de la file d'échecs et débit de résolution sur ``minutes``."""
+    maintenant = timezone.now()
+    depuis = maintenant - timedelta(minutes=minutes)
+    resultat = EmailEchec.objects.aggregate(
+        en_attente=Count("id", filter=Q(resolu=False)),
+        plus_ancien=Min("date_echec", filter=Q(resolu=False)),
+        nouveaux=Count("id", filter=Q(date_echec__gte=depuis)),
+        resolus=Count("id", filter=Q(resolu=True, date_resolution__gte=depuis)),
+    )
+    resultat["a_rejouer"] = a_rejouer(maintenant).count()
+    resultat["periode_minutes"] = minutes
+    resultat["debit_par_minute"] = round(resultat["resolus"] / minutes, 2)
+    return resultat
@@ -1,4 +1,11 @@
+import json
+
+from django.core.files.storage import default_storage
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+from .champs import ChampsSelectionnablesMixin
+from .jetons import RefreshTokenRedis
 
 from .models import (
     Utilisateur,
@@ -8,6 +15,8 @@ from .models import (
     Action,
     MethodePaiement,
     ElementAchatDevis,
+    StockCle,
+    CommandeEnAttente,
 )
 
 
@@ -42,6 +51,18 @@ class UserSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
+class TokenRoleSerializer(TokenObtainPairSerializer):
+    """Tokens signés avec le rôle de l'utilisateur (voir authentification.py)."""
+
+    token_class = RefreshTokenRedis
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token["role"] = user.role
+        return token
+
+
 class CategorieSerializer(serializers.ModelSerializer):
     class Meta:
         model = Categorie
@@ -52,7 +73,26 @@ class CategorieSerializer(serializers.ModelSerializer):
         return categorie
 
 
-class ProduitSerializer(serializers.ModelSerializer):
+class VariantesImageField(serializers.Field):
+    """URLs des variantes WebP d'une image (``Produit.variantes``), par nom."""
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variantes):
+        request = self.context.get("request")
+        urls = {}
+        for nom, chemin in variantes.items():
+            if nom == "source":
+                continue
+            url = default_storage.url(chemin)
+            urls[nom] = request.build_absolute_uri(url) if request else url
+        return urls
+
+
+class ProduitSerializer(ChampsSelectionnablesMixin, serializers.ModelSerializer):
+    variantes = VariantesImageField()
 
     class Meta:
         model = Produit
@@ -61,6 +101,7 @@ class ProduitSerializer(serializers.ModelSerializer):
             "nom",
             "description",
             "image",
+            "variantes",
             "prix_min",
             "prix",
             "prix_max",
@@ -72,7 +113,7 @@ class ProduitSerializer(serializers.ModelSerializer):
         return produit
 
 
-class CleSerializer(serializers.ModelSerializer):
+class CleSerializer(ChampsSelectionnablesMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Cle
@@ -84,14 +125,22 @@ class CleSerializer(serializers.ModelSerializer):
             "disponiblite",
             "code_cle",
         ]
-
-    extra_kwargs = {"code_cle": {"write_only": True}}
+        read_only_fields = ["code_cle"]
 
     def create(self, validated_data):
         cle = Cle.objects.create(**validated_data)
         return cle
 
 
+class StockCleSerializer(serializers.ModelSerializer):
+    # Compteur plus mouvements non reportés (StockCle.objects.a_jour())
+    disponibles = serializers.IntegerField(source="disponibles_a_jour", read_only=True)
+
+    class Meta:
+        model = StockCle
+        fields = ["produit", "disponibles"]
+
+
 class MethodePaiementSerializer(serializers.ModelSerializer):
     class Meta:
         model = MethodePaiement
@@ -113,7 +162,7 @@ class ElementAchatDevisSerializer(serializers.ModelSerializer):
         return element_achat_devis
 
 
-class ActionSerializer(serializers.ModelSerializer):
+class ActionSerializer(ChampsSelectionnablesMixin, serializers.ModelSerializer):
     class Meta:
         model = Action
         fields = [
@@ -134,3 +183,64 @@ class ActionSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         action = Action.objects.create(**validated_data)
         return action
+
+
+class ElementActionSerializer(serializers.ModelSerializer):
+    produit_nom = serializers.CharField(source="produit.nom", read_only=True)
+
+    class Meta:
+        model = ElementAchatDevis
+        fields = ["id", "produit", "produit_nom", "quantite", "prix_total"]
+
+
+class ActionHistoriqueSerializer(
+    ChampsSelectionnablesMixin, serializers.ModelSerializer
+):
+    """Action en lecture, avec ses lignes et les noms des objets liés."""
+
+    client_nom = serializers.CharField(source="client.nom_complet", read_only=True)
+    vendeur_nom = serializers.CharField(
+        source="vendeur.nom_complet", read_only=True, allow_null=True
+    )
+    methode_paiement_nom = serializers.CharField(
+        source="methode_paiement.nom", read_only=True
+    )
+    elements = ElementActionSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Action
+        fields = [
+            "id",
+            "code_action",
+            "type",
+            "prix",
+            "date_action",
+            "livree",
+            "payee",
+            "client",
+            "client_nom",
+            "vendeur",
+            "vendeur_nom",
+            "methode_paiement",
+            "methode_paiement_nom",
+            "elements",
+        ]
+        read_only_fields = fields
+
+
+class CommandeEnAttenteSerializer(serializers.ModelSerializer):
+    resultat = serializers.SerializerMethodField()
+
+    class Meta:
+        model = CommandeEnAttente
+        fields = [
+            "id",
+            "statut",
+            "action",
+            "resultat",
+            "date_creation",
+            "date_traitement",
+        ]
+
+    def get_resultat(self, obj) -> dict | None:
+        return json.loads(obj.resultat) if obj.resultat else None
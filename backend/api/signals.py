@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentification import invalider_utilisateur
+from .cache import invalider_catalogue
+from .images import supprimer_variantes
+from .models import Categorie, MethodePaiement, Produit, StockCle, Utilisateur
+
+
+@receiver(post_save, sender=Produit)
+@receiver(post_delete, sender=Produit)
+@receiver(post_save, sender=Categorie)
+@receiver(post_delete, sender=Categorie)
+@receiver(post_save, sender=MethodePaiement)
+@receiver(post_delete, sender=MethodePaiement)
+def invalider_cache_catalogue(sender, **kwargs):
+    invalider_catalogue(sender)
+
+
+@receiver(post_save, sender=Utilisateur)
+@receiver(post_delete, sender=Utilisateur)
+def invalider_cache_utilisateur(sender, instance, **kwargs):
+    invalider_utilisateur(instance.pk)
+
+
+@receiver(post_save, sender=Produit)
+def creer_stock_produit(sender, instance, created, **kwargs):
+    if created:
+        StockCle.objects.get_or_create(produit=instance)
+
+
+@receiver(post_save, sender=Produit)
+def planifier_variantes_image(sender, instance, **kwargs):
+    if instance.image and instance.image.name != instance.variantes.get("source"):
+        from .tasks import generer_variantes_image
+
+        produit_id = instance.pk
+        transaction.on_commit(lambda: generer_variantes_image.delay(produit_id))
+
+
+@receiver(post_delete, sender=Produit)
+def supprimer_variantes_produit(sender, instance, **kwargs):
+    variantes = instance.variantes
+    transaction.on_commit(lambda: supprimer_variantes(variantes))
@@ -0,0 +1,79 @@
+import socketserver
+import threading
+import time
+
+
+class _Session(socketserver.StreamRequestHandler):
+    """Dialogue SMTP minimal : accepte tout message et le compte."""
+
+    def repondre(self, ligne):
+        self.wfile.write(f"{ligne}\r\n".encode())
+
+    def handle(self):
+        serveur = self.server
+        with serveur.verrou:
+            serveur.connexions += 1
+        if serveur.latence:
+            # Coût d'établissement d'une vraie session (TLS, authentification)
+            time.sleep(serveur.latence)
+        self.repondre("220 smtp-local prêt")
+
+        recus = 0
+        while ligne := self.rfile.readline():
+            commande = ligne.decode("latin-1").strip().upper()
+            if commande.startswith("EHLO"):
+                self.repondre("250-smtp-local")
+                self.repondre("250 8BITMIME")
+            elif commande.startswith("HELO"):
+                self.repondre("250 smtp-local")
+            elif commande.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                self.repondre("250 OK")
+            elif commande == "DATA":
+                self.repondre("354 Fin avec <CRLF>.<CRLF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                recus += 1
+                with serveur.verrou:
+                    serveur.messages += 1
+                self.repondre("250 OK reçu")
+                if serveur.coupure_apres and recus >= serveur.coupure_apres:
+                    # Simule un serveur qui ferme les connexions trop longues
+                    return
+            elif commande == "QUIT":
+                self.repondre("221 Au revoir")
+                return
+            else:
+                self.repondre("502 Commande non gérée")
+
+
+class ServeurSMTPLocal(socketserver.ThreadingTCPServer):
+    """
+    Serveur SMTP de substitution pour les mesures d'envoi d'emails.
+
+    ``latence`` (en secondes) est ajoutée à chaque nouvelle connexion ;
+    ``coupure_apres`` ferme une connexion après ce nombre de messages.
+    S'utilise comme gestionnaire de contexte ; ``port`` donne le port choisi.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latence=0, coupure_apres=None):
+        super().__init__(("127.0.0.1", 0), _Session)
+        self.latence = latence
+        self.coupure_apres = coupure_apres
+        self.verrou = threading.Lock()
+        self.connexions = 0
+        self.messages = 0
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
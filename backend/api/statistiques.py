@@ -0,0 +1,89 @@
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    Action,
+    ElementAchatDevis,
+    VenteClientJournaliere,
+    VenteJournaliere,
+    VenteProduitJournaliere,
+)
+
+
+def reconstruire_statistiques(debut, fin):
+    """
+    Recalcule les agrégats journaliers des jours ``debut`` à ``fin`` inclus.
+
+    Les lignes existantes de ces jours sont remplacées : l'opération peut être
+    relancée sans risque, et ne lit que les actions de la période.
+    """
+    tz = timezone.get_current_timezone()
+    depuis = timezone.make_aware(datetime.combine(debut, time.min), tz)
+    jusqua = timezone.make_aware(
+        datetime.combine(fin + timedelta(days=1), time.min), tz
+    )
+
+    actions = Action.objects.filter(
+        date_action__gte=depuis, date_action__lt=jusqua
+    ).annotate(jour=TruncDate("date_action"))
+    elements = ElementAchatDevis.objects.filter(
+        action__date_action__gte=depuis, action__date_action__lt=jusqua
+    ).annotate(jour=TruncDate("action__date_action"))
+
+    ventes = [
+        VenteJournaliere(
+            jour=ligne["jour"],
+            type=ligne["type"],
+            nombre_actions=ligne["nombre"],
+            montant_total=ligne["montant"] or 0,
+        )
+        for ligne in actions.values("jour", "type")
+        .annotate(nombre=Count("id"), montant=Sum("prix"))
+        .order_by()
+    ]
+    ventes_produits = [
+        VenteProduitJournaliere(
+            jour=ligne["jour"],
+            produit_id=ligne["produit"],
+            nombre_lignes=ligne["nombre"],
+            quantite=ligne["quantite"] or 0,
+            montant_total=ligne["montant"] or 0,
+        )
+        for ligne in elements.values("jour", "produit")
+        .annotate(
+            nombre=Count("id"), quantite=Sum("quantite"), montant=Sum("prix_total")
+        )
+        .order_by()
+    ]
+    ventes_clients = [
+        VenteClientJournaliere(
+            jour=ligne["jour"],
+            client_id=ligne["client"],
+            nombre_actions=ligne["nombre"],
+            montant_total=ligne["montant"] or 0,
+        )
+        for ligne in actions.values("jour", "client")
+        .annotate(nombre=Count("id"), montant=Sum("prix"))
+        .order_by()
+    ]
+
+    with transaction.atomic():
+        for modele, lignes in (
+            (VenteJournaliere, ventes),
+            (VenteProduitJournaliere, ventes_produits),
+            (VenteClientJournaliere, ventes_clients),
+        ):
+            modele.objects.filter(jour__range=(debut, fin)).delete()
+            modele.objects.bulk_create(lignes, batch_size=1000)
+
+    return len(ventes), len(ventes_produits), len(ventes_clients)
+
+
+def actualiser_statistiques(jours=2):
+    """Recalcule les agrégats des derniers jours, aujourd'hui compris."""
+    aujourdhui = timezone.localdate()
+    return reconstruire_statistiques(aujourdhui - timedelta(days=jours - 1), aujourdhui)
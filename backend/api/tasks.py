@@ -1,281 +1,351 @@
-import io
 import json
 import logging
-import os
+import time
+from datetime import timedelta
 
+import redis
 from celery import shared_task
 from django.conf import settings
-from django.core.mail import EmailMessage
-from django.utils.timezone import localtime
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import cm
-from reportlab.pdfgen import canvas
-
-from .models import Action, Utilisateur, EmailEchec
+from django.utils import timezone
+from PIL import UnidentifiedImageError
+
+from .cache import invalider_catalogue
+from .commandes import (
+    commandes_en_attente,
+    liberer_traitement,
+    planifier_traitement,
+    traiter_lot,
+)
+from .emails import (
+    construire_email,
+    envoyer_messages,
+    factures_en_attente,
+    liberer_vidage,
+    mettre_facture_en_attente,
+    prendre_factures,
+    reserver_vidage,
+)
+from .factures import enregistrer_facture, lire_facture
+from .idempotence import purger_cles_expirees
+from .images import generer_variantes, supprimer_variantes
+from .jetons import purger_jetons
+from .metriques import ECHECS_EMAIL, EMAILS_LOTS, ENVOI_EMAIL, REPRISES_EMAIL
+from .models import Action, Facture, MouvementStock, Produit, Utilisateur, EmailEchec
+from .reprise_emails import rejouer_echecs, resoudre
+from .statistiques import actualiser_statistiques
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task(bind=True, max_retries=3, rate_limit="10/m")
-def envoyer_cles_email_async(self, client_id, action_id, cles_data):
+@shared_task(bind=True, max_retries=3)
+def generer_facture(self, client_id, action_id, cles_data):
+    """
+    Étape de rendu (file « factures ») : le PDF est enregistré une fois pour
+    toutes puis confié à l'étape d'envoi.
+    """
     try:
         client = Utilisateur.objects.get(id=client_id)
         action = Action.objects.get(id=action_id)
+        facture = enregistrer_facture(action, client, cles_data)
 
-        # Déterminer le type d'action (achat ou devis)
-        est_achat = action.type.upper() == "ACHAT"
-
-        buffer = io.BytesIO()
-        p = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-
-        marge_gauche = 1 * cm
-        marge_droite = width - (1 * cm)
-        position_y = height - 1 * cm
-
-        image_path = os.path.join(settings.BASE_DIR, "static", "ej.jpg")
-        if os.path.exists(image_path):
-            p.drawImage(
-                image_path,
-                marge_gauche,
-                height - 3 * cm,
-                width=5 * cm,
-                height=2.5 * cm,
-            )
-        else:
-            p.setFont("Helvetica-Bold", 24)
-            p.drawString(marge_gauche, height - 2.5 * cm, "EJ Logiciel")
-
-        titre = "FACTURE" if est_achat else "DEVIS"
-        p.setFont("Helvetica-Bold", 18)
-        titre_texte = f"{titre} #{action.code_action}"
-        titre_width = p.stringWidth(titre_texte, "Helvetica-Bold", 18)
-        p.drawString((width - titre_width) / 2, position_y, titre_texte)
-        position_y -= 3 * cm
-
-        # Informations de l'entreprise (alignées à gauche)
-        p.setFont("Helvetica", 10)
-        p.drawString(marge_gauche, position_y, "EJ Logiciel")
-        position_y -= 0.5 * cm
-        p.drawString(marge_gauche, position_y, "Antananarivo, Madagascar")
-        position_y -= 0.5 * cm
-        p.drawString(marge_gauche, position_y, "Tel: +261 34 12 345 67")
-        position_y -= 0.5 * cm
-        p.drawString(
-            marge_gauche,
-            position_y,
-            f"Email: {os.getenv('EMAIL_HOST_USER')}",
-        )
-        position_y -= 0.5 * cm
-        p.drawString(marge_gauche, position_y, "Web: www.ejlogiciel.com")
-        position_y -= 1 * cm
-
-        date_text = f"Date: {localtime(action.date_action).strftime('%d-%m-%Y')}"
-        ref_text = f"Réf: {action.code_action}"
-        date_width = p.stringWidth(date_text, "Helvetica", 10)
-        ref_width = p.stringWidth(ref_text, "Helvetica", 10)
-
-        p.drawString(marge_droite - date_width, height - 3 * cm, date_text)
-        p.drawString(marge_droite - ref_width, height - 3.5 * cm, ref_text)
-
-        p.setFont("Helvetica-Bold", 12)
-        p.drawString(marge_gauche, position_y, "INFORMATIONS CLIENT")
-        position_y -= 0.7 * cm
-
-        p.setFont("Helvetica", 10)
-        p.drawString(marge_gauche, position_y, f"Nom: {client.nom_complet}")
-        position_y -= 0.5 * cm
-        p.drawString(marge_gauche, position_y, f"Email: {client.email}")
-        position_y -= 0.5 * cm
-        p.drawString(marge_gauche, position_y, f"Téléphone: {client.numero_telephone}")
-        position_y -= 0.5 * cm
-        p.drawString(marge_gauche, position_y, f"Adresse: {client.adresse}")
-        position_y -= 1 * cm
-
-        p.setFont("Helvetica-Bold", 12)
-        p.drawString(marge_gauche, position_y, "DÉTAILS DES PRODUITS")
-        position_y -= 1 * cm
-
-        col1 = marge_gauche
-        col2 = width * 0.55  # 55% de la largeur
-        col3 = width * 0.7  # 70% de la largeur
-        col4 = width * 0.85  # 85% de la largeur
-
-        p.setFont("Helvetica-Bold", 10)
-        p.drawString(col1, position_y, "Produit")
-        p.drawString(col2, position_y, "Quantité")
-        p.drawString(col3, position_y, "Prix")
-        p.drawString(col4, position_y, "Total")
-        position_y -= 0.5 * cm
-
-        p.setStrokeColor(colors.black)
-        p.line(marge_gauche, position_y, marge_droite, position_y)
-        position_y -= 0.7 * cm
-
-        total = 0
-
-        for produit_nom, cles in cles_data.items():
-            quantite = len(cles)
-            prix_unitaire = action.prix / sum(len(cles) for cles in cles_data.values())
-            prix_total = prix_unitaire * quantite
-            total += prix_total
-
-            p.setFont("Helvetica", 10)
-            produit_nom_affiche = produit_nom
-            if len(produit_nom) > 40:
-                produit_nom_affiche = produit_nom[:37] + "..."
-
-            p.drawString(col1, position_y, produit_nom_affiche)
-            p.drawRightString(col2 + 1 * cm, position_y, str(quantite))
-            p.drawRightString(col3 + 1 * cm, position_y, f"{prix_unitaire:.2f} MGA")
-            p.drawRightString(col4 + 1 * cm, position_y, f"{prix_total:.2f} MGA")
-
-            if est_achat:
-                p.setFont("Helvetica", 8)
-                for i, cle in enumerate(cles):
-                    position_y -= 0.4 * cm
-                    cle_text = (
-                        f"Clé {i+1}: {cle['contenue']} (Validité: {cle['validite']})"
-                    )
-                    if len(cle_text) > 80:
-                        cle_text = cle_text[:77] + "..."
-                    p.drawString(col1 + 0.5 * cm, position_y, cle_text)
-
-            position_y -= 0.8 * cm
-
-            if position_y < 5 * cm:
-                p.showPage()
-                position_y = height - 3 * cm
-                p.setFont("Helvetica-Bold", 12)
-                p.drawString(marge_gauche, position_y, "DÉTAILS DES PRODUITS (suite)")
-                position_y -= 1 * cm
-
-                p.setFont("Helvetica-Bold", 10)
-                p.drawString(col1, position_y, "Produit")
-                p.drawString(col2, position_y, "Quantité")
-                p.drawString(col3, position_y, "Prix")
-                p.drawString(col4, position_y, "Total")
-                position_y -= 0.5 * cm
-
-                p.line(marge_gauche, position_y, marge_droite, position_y)
-                position_y -= 0.7 * cm
-
-        p.line(marge_gauche, position_y, marge_droite, position_y)
-        position_y -= 1 * cm
-
-        p.setFont("Helvetica-Bold", 12)
-        total_label = "Total:"
-        total_value = f"{action.prix:.2f} MGA"
-        p.drawRightString(col3 + 1 * cm, position_y, total_label)
-        p.drawRightString(col4 + 1 * cm, position_y, total_value)
-        position_y -= 2 * cm
-
-        # Conditions et notes
-        p.setFont("Helvetica-Bold", 10)
-        p.drawString(marge_gauche, position_y, "CONDITIONS ET NOTES:")
-        position_y -= 0.5 * cm
-        p.setFont("Helvetica", 8)
-
-        if est_achat:
-            p.drawString(
-                marge_gauche,
-                position_y,
-                "• Les clés d'activation sont à usage unique et ne peuvent pas être remboursées.",
-            )
-            position_y -= 0.5 * cm
-            p.drawString(
-                marge_gauche,
-                position_y,
-                f"• Support technique disponible à {os.getenv('EMAIL_HOST_USER')}",
-            )
-            position_y -= 0.5 * cm
-            p.drawString(marge_gauche, position_y, "• Merci pour votre achat!")
-        else:
-            p.drawString(
-                marge_gauche,
-                position_y,
-                "• Ce devis est valable pour une durée de 30 jours à compter de sa date d'émission.",
-            )
-            position_y -= 0.5 * cm
-            p.drawString(
-                marge_gauche,
-                position_y,
-                f"• Pour accepter ce devis, veuillez nous contacter à {os.getenv('EMAIL_HOST_USER')}",
-            )
-            position_y -= 0.5 * cm
-
-        p.setFont("Helvetica", 8)
-        p.drawCentredString(width / 2, 1 * cm, "EJ Logiciel - Tous droits réservés")
-
-        p.showPage()
-        p.save()
-        buffer.seek(0)
-
-        if est_achat:
-            sujet = (
-                f"Votre facture et clés d'activation - Commande #{action.code_action}"
-            )
-            corps_message = f"""
-            Bonjour {client.nom_complet},
-
-            Nous vous remercions pour votre achat (Commande #{action.code_action}).
-
-            Veuillez trouver ci-joint votre facture contenant les clés d'activation pour les produits achetés.
-
-            En cas de problème avec vos clés, n'hésitez pas à contacter notre service client.
-
-            Cordialement,
-            L'équipe EJ Logiciel
-            """
-            nom_fichier = f"facture_{action.code_action}.pdf"
-        else:
-            sujet = f"Votre devis - Référence #{action.code_action}"
-            corps_message = f"""
-            Bonjour {client.nom_complet},
-
-            Suite à votre demande, veuillez trouver ci-joint votre devis (Réf: #{action.code_action}).
+    except (Utilisateur.DoesNotExist, Action.DoesNotExist) as e:
+        logger.error(f"Entité introuvable: {str(e)}")
+        return f"Erreur: {str(e)}"
 
-            Ce devis est valable pour une durée de 30 jours à compter de sa date d'émission.
+    except Exception as e:
+        logger.error(f"Erreur lors de la génération de la facture: {str(e)}")
+        countdown = 10 * (2**self.request.retries)  # 10s, 20s, 40s
+        raise self.retry(exc=e, countdown=countdown)
 
-            Pour toute question ou pour valider ce devis, n'hésitez pas à nous contacter.
+    try:
+        _mettre_en_attente([facture.id])
+    except redis.RedisError as e:
+        # La facture reste sans date d'envoi : le balayage la reprendra
+        logger.error(f"Mise en file de la facture {facture.id} impossible: {str(e)}")
+    return facture.id
+
+
+def _mettre_en_attente(facture_ids):
+    """Ajoute des factures à la file d'envoi et planifie un vidage si besoin."""
+    for facture_id in facture_ids:
+        mettre_facture_en_attente(facture_id)
+    if reserver_vidage(settings.EMAIL_DELAI_LOT * 10):
+        envoyer_factures_en_attente.apply_async(countdown=settings.EMAIL_DELAI_LOT)
+
+
+@shared_task(bind=True, max_retries=5)
+def envoyer_cles_email_async(self, client_id, action_id, cles_data=None):
+    """
+    Étape d'envoi unitaire (file « emails »), utilisée pour les reprises.
+
+    Le PDF enregistré par ``generer_facture`` est renvoyé tel quel ; il n'est
+    rendu ici que s'il n'existe pas encore.
+    """
+    debut = time.perf_counter()
+    resultat = "erreur"
+    try:
+        client = Utilisateur.objects.get(id=client_id)
+        action = Action.objects.get(id=action_id)
 
-            Cordialement,
-            L'équipe EJ Logiciel
-            """
-            nom_fichier = f"devis_{action.code_action}.pdf"
+        # Déterminer le type d'action (achat ou devis)
+        est_achat = action.type.upper() == "ACHAT"
 
-        try:
-            email = EmailMessage(
-                subject=sujet,
-                body=corps_message,
-                to=[client.email],
-            )
-            email.attach(nom_fichier, buffer.read(), "application/pdf")
-            email.send(fail_silently=False)
+        facture = Facture.objects.filter(action=action).first()
+        if facture is None:
+            facture = enregistrer_facture(action, client, cles_data)
+        email = construire_email(
+            action, client, facture.cles_data, lire_facture(facture)
+        )
 
-            logger.info(
-                f"Email {'avec clés' if est_achat else 'de devis'} envoyé à {client.email} "
-                f"pour l'action {action.code_action}"
-            )
-            return f"Email {'avec clés' if est_achat else 'de devis'} envoyé à {client.email}"
-        except Exception as email_error:
+        echecs = envoyer_messages([email])
+        if echecs:
+            email_error = echecs[0][1]
             logger.error(f"Erreur lors de l'envoi de l'email: {str(email_error)}")
             EmailEchec.objects.create(
                 client=client,
                 action=action,
                 erreur=str(email_error),
-                donnees=json.dumps(cles_data),
+                donnees=json.dumps(facture.cles_data),
             )
-            raise
-        finally:
-            buffer.close()
+            raise email_error
+
+        Facture.objects.filter(pk=facture.pk).update(date_envoi=timezone.now())
+        resoudre([action.id])
+        resultat = "envoye"
+        logger.info(
+            f"Email {'avec clés' if est_achat else 'de devis'} envoyé à {client.email} "
+            f"pour l'action {action.code_action}"
+        )
+        return (
+            f"Email {'avec clés' if est_achat else 'de devis'} envoyé à {client.email}"
+        )
 
     except (Utilisateur.DoesNotExist, Action.DoesNotExist) as e:
+        resultat = "introuvable"
         logger.error(f"Entité introuvable: {str(e)}")
         return f"Erreur: {str(e)}"
 
     except Exception as e:
         logger.error(f"Erreur lors de l'envoi de l'email: {str(e)}")
+        if self.request.retries < self.max_retries:
+            REPRISES_EMAIL.inc()
+        else:
+            ECHECS_EMAIL.inc()
         countdown = 60 * (2**self.request.retries)  # 1min, 2min, 4min, etc.
         raise self.retry(exc=e, countdown=countdown)
+
+    finally:
+        ENVOI_EMAIL.observer(time.perf_counter() - debut, resultat=resultat)
+
+
+def planifier_envoi_facture(client_id, action_id, cles_data):
+    """
+    Lance le rendu de la facture d'une action, puis son envoi.
+
+    Le rendu (CPU) et l'envoi (réseau) passent par des files distinctes ; à
+    l'envoi, un seul vidage est planifié à la fois, si bien que les factures
+    prêtes entre-temps partent dans le même lot, sur la même connexion SMTP.
+    """
+    generer_facture.delay(client_id, action_id, cles_data)
+
+
+@shared_task
+def envoyer_factures_en_attente(taille_lot=None, lots_max=20):
+    """Vide la file des factures rendues par lots, sur une connexion partagée."""
+    taille_lot = taille_lot or settings.EMAIL_TAILLE_LOT
+    # Les factures mises en file à partir d'ici planifieront un nouveau vidage
+    liberer_vidage()
+
+    envoyes = 0
+    for _ in range(lots_max):
+        facture_ids = prendre_factures(taille_lot)
+        if not facture_ids:
+            break
+        envoyes += _envoyer_lot(facture_ids)
+    else:
+        if factures_en_attente() and reserver_vidage(settings.EMAIL_DELAI_LOT * 10):
+            envoyer_factures_en_attente.delay(taille_lot, lots_max)
+
+    if envoyes:
+        logger.info(f"{envoyes} email(s) de factures envoyé(s) par lots")
+    return envoyes
+
+
+@shared_task
+def reprendre_factures_non_envoyees(taille_lot=None):
+    """
+    Tâche périodique : remet en file les factures rendues depuis plus de
+    ``EMAIL_FACTURE_DELAI_REPRISE`` secondes et toujours pas envoyées.
+
+    La file Redis ne garde une facture que jusqu'à son retrait : un worker
+    arrêté après le LPOP, ou une mise en file échouée, la laisserait sans
+    envoi. Les factures dont l'échec est déjà suivi par un ``EmailEchec``
+    sont laissées à la reprise des échecs.
+    """
+    taille_lot = taille_lot or settings.EMAIL_TAILLE_LOT * 10
+    limite = timezone.now() - timedelta(seconds=settings.EMAIL_FACTURE_DELAI_REPRISE)
+    facture_ids = list(
+        Facture.objects.filter(date_envoi__isnull=True, date_creation__lte=limite)
+        .exclude(action__emailechec__resolu=False)
+        .order_by("date_creation")
+        .values_list("id", flat=True)[:taille_lot]
+    )
+    if facture_ids:
+        logger.warning(
+            f"{len(facture_ids)} facture(s) non envoyée(s) remise(s) en file"
+        )
+        _mettre_en_attente(facture_ids)
+    return len(facture_ids)
+
+
+def _envoyer_lot(facture_ids):
+    # Une facture reprise par le balayage peut être en file deux fois
+    factures = (
+        Facture.objects.filter(date_envoi__isnull=True)
+        .select_related("action__client")
+        .in_bulk(facture_ids)
+    )
+    factures = [factures[i] for i in facture_ids if i in factures]
+    messages = [
+        construire_email(
+            facture.action,
+            facture.action.client,
+            facture.cles_data,
+            lire_facture(facture),
+        )
+        for facture in factures
+    ]
+
+    echecs = envoyer_messages(messages)
+    en_echec = set()
+    for indice, erreur in echecs:
+        facture = factures[indice]
+        action = facture.action
+        en_echec.add(facture.pk)
+        logger.error(
+            f"Erreur lors de l'envoi de l'email de l'action {action.code_action}: "
+            f"{str(erreur)}"
+        )
+        EmailEchec.objects.create(
+            client=action.client,
+            action=action,
+            erreur=str(erreur),
+            donnees=json.dumps(facture.cles_data),
+        )
+        # La facture est retentée seule, avec le délai croissant de la tâche
+        envoyer_cles_email_async.apply_async(
+            kwargs={"client_id": action.client_id, "action_id": action.id},
+            countdown=60,
+        )
+
+    envoyees = [facture for facture in factures if facture.pk not in en_echec]
+    Facture.objects.filter(pk__in=[facture.pk for facture in envoyees]).update(
+        date_envoi=timezone.now()
+    )
+    resoudre([facture.action_id for facture in envoyees])
+    EMAILS_LOTS.inc(len(envoyees), resultat="envoye")
+    if echecs:
+        EMAILS_LOTS.inc(len(echecs), resultat="echec")
+    return len(messages) - len(echecs)
+
+
+@shared_task
+def rejouer_emails_echec(taille_lot=None):
+    """Tâche périodique : renvoie un lot borné d'emails en échec."""
+    envoyes, echoues = rejouer_echecs(taille_lot)
+    if envoyes or echoues:
+        logger.info(
+            f"Reprise des emails en échec: {envoyes} envoyé(s), {echoues} reporté(s)"
+        )
+    return envoyes
+
+
+@shared_task
+def actualiser_statistiques_journalieres(jours=2):
+    """Tâche périodique : recalcule les agrégats du tableau de bord."""
+    ventes, produits, clients = actualiser_statistiques(jours)
+    logger.info(
+        f"Statistiques actualisées: {ventes} ligne(s) de ventes, "
+        f"{produits} ligne(s) produits, {clients} ligne(s) clients"
+    )
+
+
+@shared_task
+def appliquer_mouvements_stock():
+    """Tâche périodique : reporte les mouvements de clés sur StockCle."""
+    return MouvementStock.objects.appliquer()
+
+
+@shared_task
+def purger_cles_idempotence():
+    """Tâche périodique : supprime les clés d'idempotence expirées."""
+    supprimees = purger_cles_expirees()
+    if supprimees:
+        logger.info(f"{supprimees} clé(s) d'idempotence expirée(s) supprimée(s)")
+    return supprimees
+
+
+@shared_task
+def purger_liste_noire_jwt():
+    """Tâche périodique : vide les tables de token_blacklist (voir jetons.py)."""
+    return purger_jetons()
+
+
+@shared_task
+def traiter_commandes(taille_lot=None, lots_max=20):
+    """Vide la file des commandes asynchrones par micro-lots."""
+    taille_lot = taille_lot or settings.COMMANDES_TAILLE_LOT
+    # Les commandes reçues à partir d'ici planifieront un nouveau traitement
+    liberer_traitement()
+
+    traitees = 0
+    for _ in range(lots_max):
+        nombre = traiter_lot(taille_lot)
+        if not nombre:
+            break
+        traitees += nombre
+    else:
+        if commandes_en_attente():
+            planifier_traitement()
+
+    if traitees:
+        logger.info(f"{traitees} commande(s) traitée(s) par lots")
+    return traitees
+
+
+@shared_task(bind=True, max_retries=3)
+def generer_variantes_image(self, produit_id):
+    """
+    Crée les variantes WebP de l'image d'un produit (file « images ») et
+    les enregistre, sauf si l'image a changé entre-temps : la tâche planifiée
+    pour la nouvelle image s'en charge.
+    """
+    try:
+        produit = Produit.objects.get(id=produit_id)
+    except Produit.DoesNotExist:
+        return None
+    if not produit.image or produit.variantes.get("source") == produit.image.name:
+        return None
+
+    try:
+        variantes = generer_variantes(produit)
+    except (FileNotFoundError, UnidentifiedImageError) as e:
+        logger.error(f"Image du produit {produit_id} illisible: {str(e)}")
+        return None
+    except OSError as e:
+        countdown = 10 * (2**self.request.retries)
+        raise self.retry(exc=e, countdown=countdown)
+
+    # update() : pas de post_save, donc pas de nouvelle planification
+    enregistrees = Produit.objects.filter(
+        id=produit_id, image=produit.image.name
+    ).update(variantes=variantes)
+    if enregistrees:
+        supprimer_variantes(produit.variantes, conservees=variantes.values())
+        invalider_catalogue(Produit)
+    else:
+        actuelles = Produit.objects.filter(id=produit_id).values_list(
+            "variantes", flat=True
+        )
+        supprimer_variantes(variantes, conservees=(actuelles.first() or {}).values())
+    return variantes
@@ -1,3 +1,2046 @@
-from django.test import TestCase
+import base64
+import json
+import re
+import smtplib
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from datetime import timezone as dt_timezone
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
 
-# Create your tests here.
+import redis
+from celery import current_app
+from django.conf import settings
+from django.contrib.auth.signals import user_login_failed
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from PIL import Image
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import commandes, emails, metriques
+from .authentification import CachedJWTAuthentication, cle_utilisateur
+from .commandes import traiter_lot
+from .factures import _logo, rendre_facture
+from .idempotence import _cle_cache
+from .import_cles import importer_cles
+from .jetons import RefreshTokenRedis, est_revoque, purger_jetons
+from .metriques import ACTIONS_CREEES, RESERVATION_CLES
+from .models import (
+    Action,
+    CleIdempotence,
+    CommandeEnAttente,
+    Categorie,
+    Cle,
+    ElementAchatDevis,
+    EmailEchec,
+    Facture,
+    MethodePaiement,
+    MouvementStock,
+    Produit,
+    StockCle,
+    StockInsuffisant,
+    Utilisateur,
+    VenteClientJournaliere,
+    VenteJournaliere,
+    VenteProduitJournaliere,
+)
+from .pagination import KeysetPagination
+from .replique import RepliqueMiddleware, RouteurReplique, lecture_principale
+from .reprise_emails import delai_attente, rejouer_echecs, resoudre
+from .statistiques import actualiser_statistiques, reconstruire_statistiques
+from .tasks import (
+    _envoyer_lot,
+    generer_variantes_image,
+    rejouer_emails_echec,
+    reprendre_factures_non_envoyees,
+    traiter_commandes,
+)
+from .views import (
+    ActionDetailAPIView,
+    ActionListAPIView,
+    CommandeDetailAPIView,
+    DashboardStatsAPIView,
+    ProduitListCreateAPIView,
+)
+from .vues_async import CatalogueAsyncView
+
+# Base Redis réservée aux tests (voir REDIS_TESTS_URL dans les réglages) : sous
+# manage.py test, toutes les URL Redis y mènent
+REDIS_TESTS = settings.REDIS_TESTS_URL
+# Cache en mémoire, pour les tests qui n'ont pas besoin de Redis
+CACHE_LOCAL = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def vider_redis_tests():
+    """Vide la base Redis des tests (seaux de la limitation de débit, files)."""
+    redis.Redis.from_url(REDIS_TESTS).flushdb()
+
+
+class ActionHistoriqueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendeur = Utilisateur.objects.create_user(
+            username="vendeur",
+            password="x",
+            nom_complet="Vendeur",
+            role="vendeur",
+            numero_telephone="0",
+            adresse="Antananarivo",
+        )
+        cls.clients = [
+            Utilisateur.objects.create_user(
+                username=f"client{n}",
+                password="x",
+                nom_complet=f"Client {n}",
+                numero_telephone="0",
+                adresse="Antananarivo",
+            )
+            for n in range(2)
+        ]
+        categorie = Categorie.objects.create(nom="Logiciels", description="")
+        produits = [
+            Produit.objects.create(
+                categorie=categorie,
+                nom=f"Produit {n}",
+                description="",
+                image="produits/test.png",
+                prix_min=1,
+                prix=10,
+                prix_max=100,
+            )
+            for n in range(3)
+        ]
+        methode = MethodePaiement.objects.create(nom="Espèces", description="")
+
+        for n in range(12):
+            action = Action.objects.create(
+                type="achat",
+                prix=30,
+                client=cls.clients[n % 2],
+                vendeur=cls.vendeur,
+                methode_paiement=methode,
+            )
+            ElementAchatDevis.objects.bulk_create(
+                ElementAchatDevis(
+                    action=action, produit=produit, quantite=1, prix_total=10
+                )
+                for produit in produits
+            )
+        cls.achat = action
+
+        # Une action ancienne, hors des périodes récentes
+        cls.ancienne = Action.objects.create(
+            type="devis", prix=10, client=cls.clients[0], methode_paiement=methode
+        )
+        Action.objects.filter(pk=cls.ancienne.pk).update(
+            date_action=timezone.now() - timedelta(days=40)
+        )
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.vendeur)
+
+    def nombre_de_requetes(self, page_size):
+        with CaptureQueriesContext(connection) as requetes:
+            reponse = self.api.get("/api/actions/historique/", {"page_size": page_size})
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(len(reponse.data["results"]), page_size)
+        return len(requetes)
+
+    def test_nombre_de_requetes_constant(self):
+        # Actions et objets liés, lignes, produits des lignes
+        self.assertEqual(self.nombre_de_requetes(1), 3)
+        self.assertEqual(self.nombre_de_requetes(5), 3)
+        self.assertEqual(self.nombre_de_requetes(12), 3)
+
+    def test_lignes_imbriquees(self):
+        reponse = self.api.get("/api/actions/historique/", {"page_size": 1})
+        action = reponse.data["results"][0]
+        self.assertEqual(action["vendeur_nom"], "Vendeur")
+        self.assertEqual(len(action["elements"]), 3)
+        self.assertEqual(action["elements"][0]["produit_nom"], "Produit 0")
+
+    def test_client_ne_voit_que_ses_actions(self):
+        client = self.clients[1]
+        self.api.force_authenticate(client)
+        reponse = self.api.get("/api/actions/historique/", {"page_size": 50})
+        self.assertEqual(len(reponse.data["results"]), 6)
+        self.assertTrue(all(a["client"] == client.pk for a in reponse.data["results"]))
+
+        reponse = self.api.get(f"/api/actions/{self.ancienne.pk}/")
+        self.assertEqual(reponse.status_code, 404)
+
+    def test_filtres(self):
+        reponse = self.api.get(
+            "/api/actions/historique/",
+            {"client": self.clients[0].pk, "page_size": 50},
+        )
+        self.assertEqual(len(reponse.data["results"]), 7)
+
+        reponse = self.api.get(
+            "/api/actions/historique/",
+            {
+                "date_debut": (timezone.localdate() - timedelta(days=1)).isoformat(),
+                "page_size": 50,
+            },
+        )
+        self.assertEqual(len(reponse.data["results"]), 12)
+        self.assertNotIn(self.ancienne.pk, [a["id"] for a in reponse.data["results"]])
+
+    def test_detail(self):
+        with self.assertNumQueries(3):
+            reponse = self.api.get(f"/api/actions/{self.achat.pk}/")
+        self.assertEqual(reponse.data["code_action"], f"EJ-achat-{self.achat.pk}")
+        self.assertEqual(len(reponse.data["elements"]), 3)
+
+        reponse = self.api.get(f"/api/actions/{self.ancienne.pk}/")
+        self.assertEqual(reponse.data["code_action"], f"EJ-devis-{self.ancienne.pk}")
+        self.assertIsNone(reponse.data["vendeur_nom"])
+
+
+class GenerationDonneesBenchTests(TestCase):
+    def generer(self, *options):
+        call_command(
+            "generer_donnees_bench",
+            "--produits=20",
+            "--cles=300",
+            "--actions=50",
+            "--vendeurs=2",
+            "--clients=5",
+            *options,
+            stdout=StringIO(),
+        )
+
+    def test_volumes_et_stock(self):
+        self.generer()
+        self.assertEqual(Produit.objects.count(), 20)
+        self.assertEqual(Cle.objects.count(), 300)
+        self.assertEqual(Action.objects.count(), 50)
+        self.assertEqual(StockCle.objects.aggregate(n=Sum("disponibles"))["n"], 300)
+        self.assertTrue(
+            all(
+                action.prix == sum(e.prix_total for e in action.elements.all())
+                for action in Action.objects.prefetch_related("elements")
+            )
+        )
+
+    def test_reproductible_et_purge(self):
+        self.generer()
+        contenus = list(Cle.objects.order_by("contenue").values_list("contenue"))
+        self.generer("--purger")
+        self.assertFalse(Utilisateur.objects.exists())
+        self.assertFalse(Action.objects.exists())
+        self.generer()
+        self.assertEqual(
+            list(Cle.objects.order_by("contenue").values_list("contenue")), contenus
+        )
+
+
+@contextmanager
+def taches_immediates():
+    """Tâches Celery exécutées dans le thread appelant (mode « eager »)."""
+    eager = current_app.conf.task_always_eager
+    current_app.conf.task_always_eager = True
+    try:
+        yield
+    finally:
+        current_app.conf.task_always_eager = eager
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class CommandeTestCase(TestCase):
+    """Un vendeur, un client et un produit avec 5 clés disponibles."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vendeur = Utilisateur.objects.create_user(
+            username="vendeur",
+            password="x",
+            nom_complet="Vendeur",
+            role="vendeur",
+            numero_telephone="0",
+            adresse="Antananarivo",
+        )
+        cls.client_ = Utilisateur.objects.create_user(
+            username="client",
+            password="x",
+            nom_complet="Client",
+            numero_telephone="0",
+            adresse="Antananarivo",
+        )
+        categorie = Categorie.objects.create(nom="Logiciels", description="")
+        cls.produit = Produit.objects.create(
+            categorie=categorie,
+            nom="Produit",
+            description="",
+            image="produits/test.png",
+            prix_min=1,
+            prix=10,
+            prix_max=100,
+        )
+        Cle.objects.bulk_create(
+            Cle(contenue=f"CLE-{n}", produit=cls.produit, validite="1 ans")
+            for n in range(5)
+        )
+        MouvementStock.objects.appliquer()
+        cls.methode = MethodePaiement.objects.create(nom="Espèces", description="")
+
+    def setUp(self):
+        cache.clear()
+        vider_redis_tests()
+        self.api = APIClient()
+        self.api.force_authenticate(self.vendeur)
+
+    def commander(self, cle=None, quantite=1, **entetes):
+        if cle:
+            entetes["HTTP_IDEMPOTENCY_KEY"] = cle
+        return self.api.post(
+            "/api/actions/",
+            {
+                "action": {
+                    "type": "achat",
+                    "prix": 10 * quantite,
+                    "client": self.client_.pk,
+                    "methode_paiement": self.methode.pk,
+                },
+                "produits": [
+                    {
+                        "produit": self.produit.pk,
+                        "quantite": quantite,
+                        "prix_total": 10 * quantite,
+                    }
+                ],
+            },
+            format="json",
+            **entetes,
+        )
+
+
+def creer_produits_avec_cles(*stocks):
+    """Un produit par élément de ``stocks``, avec autant de clés disponibles."""
+    categorie = Categorie.objects.create(nom="Logiciels", description="")
+    # bulk_create : pas de signal post_save, donc pas de tâche Celery planifiée
+    produits = Produit.objects.bulk_create(
+        Produit(
+            categorie=categorie,
+            nom=f"Produit {n}",
+            description="",
+            image="produits/test.png",
+            prix_min=1,
+            prix=10,
+            prix_max=100,
+        )
+        for n in range(len(stocks))
+    )
+    Cle.objects.bulk_create(
+        Cle(contenue=f"CLE-{produit.pk}-{n}", produit=produit, validite="1 ans")
+        for produit, stock in zip(produits, stocks)
+        for n in range(stock)
+    )
+    return produits
+
+
+class ReservationClesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.premier, cls.second = creer_produits_avec_cles(3, 2)
+
+    def disponibles(self, produit):
+        return Cle.objects.filter(produit=produit, disponiblite=True).count()
+
+    def test_plusieurs_produits_en_une_requete(self):
+        with self.assertNumQueries(1):
+            cles = Cle.objects.reserver({self.premier.pk: 2, str(self.second.pk): 1})
+
+        self.assertEqual(len(cles[self.premier.pk]), 2)
+        self.assertEqual(len(cles[self.second.pk]), 1)
+        # Les plus anciennes d'abord, avec leur code calculé en base
+        premiere = Cle.objects.filter(produit=self.premier).order_by("id").first()
+        self.assertEqual(cles[self.premier.pk][0]["id"], premiere.pk)
+        self.assertEqual(cles[self.premier.pk][0]["code_cle"], premiere.code_cle)
+        self.assertEqual(self.disponibles(self.premier), 1)
+        self.assertEqual(self.disponibles(self.second), 1)
+
+    def test_stock_insuffisant_et_annulation(self):
+        with self.assertRaises(StockInsuffisant) as erreur:
+            with transaction.atomic():
+                Cle.objects.reserver({self.premier.pk: 2, self.second.pk: 5})
+
+        self.assertEqual(erreur.exception.produit_id, self.second.pk)
+        self.assertEqual(erreur.exception.disponibles, 2)
+        self.assertEqual(erreur.exception.demandees, 5)
+        # Rien n'est vendu, y compris pour le produit servi en entier
+        self.assertEqual(self.disponibles(self.premier), 3)
+        self.assertEqual(self.disponibles(self.second), 2)
+
+
+class StockCleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        (cls.produit,) = creer_produits_avec_cles(4)
+        StockCle.objects.create(produit=cls.produit)
+
+    def stock(self):
+        return StockCle.objects.a_jour().get(produit=self.produit).disponibles_a_jour
+
+    def assertStock(self, attendu):
+        reel = Cle.objects.filter(produit=self.produit, disponiblite=True).count()
+        self.assertEqual(reel, attendu)
+        self.assertEqual(self.stock(), attendu)
+        MouvementStock.objects.appliquer()
+        self.assertFalse(MouvementStock.objects.exists())
+        self.assertEqual(
+            StockCle.objects.get(produit=self.produit).disponibles, attendu
+        )
+
+    def test_creation_initiale(self):
+        self.assertStock(4)
+
+    def test_vente_sans_verrou_sur_le_compteur(self):
+        with CaptureQueriesContext(connection) as requetes:
+            Cle.objects.reserver({self.produit.pk: 3})
+        self.assertNotIn("api_stockcle", requetes[0]["sql"])
+        self.assertStock(1)
+
+    def test_import(self):
+        rapport = importer_cles(
+            ["contenue", "NOUVELLE-1", "NOUVELLE-2"],
+            produit=self.produit.pk,
+            validite="1 ans",
+        )
+        self.assertEqual(rapport["creees"], 2)
+        self.assertStock(6)
+
+    def test_suppressions(self):
+        Cle.objects.filter(produit=self.produit).first().delete()
+        self.assertStock(3)
+        # QuerySet.delete(), comme l'action « supprimer » de l'admin
+        ids = Cle.objects.filter(produit=self.produit).values_list("id", flat=True)[:2]
+        Cle.objects.filter(id__in=list(ids)).delete()
+        self.assertStock(1)
+
+    def test_modification_d_une_cle_lue_avant_une_vente(self):
+        cle = Cle.objects.filter(produit=self.produit).order_by("id").first()
+        Cle.objects.reserver({self.produit.pk: 4})
+        # L'admin enregistre la clé lue avant la vente : elle redevient disponible
+        cle.save()
+        self.assertStock(1)
+        cle.disponiblite = False
+        cle.save()
+        self.assertStock(0)
+
+    def test_produit_supprime(self):
+        MouvementStock.objects.appliquer()
+        self.produit.delete()
+        self.assertEqual(MouvementStock.objects.appliquer(), 0)
+        self.assertFalse(MouvementStock.objects.exists())
+
+
+class ImportClesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.produit, cls.autre = creer_produits_avec_cles(1, 0)
+        StockCle.objects.bulk_create(
+            StockCle(produit=produit) for produit in (cls.produit, cls.autre)
+        )
+        MouvementStock.objects.appliquer()
+        cls.admin = Utilisateur.objects.create_user(
+            username="admin",
+            password="x",
+            nom_complet="Admin",
+            role="admin",
+            numero_telephone="0",
+            adresse="Antananarivo",
+        )
+
+    def importer(self, contenu, nom="cles.csv", **donnees):
+        api = APIClient()
+        api.force_authenticate(self.admin)
+        fichier = SimpleUploadedFile(nom, contenu)
+        return api.post(
+            "/api/cles/import/", {"fichier": fichier, **donnees}, format="multipart"
+        )
+
+    def disponibles(self, produit):
+        return StockCle.objects.a_jour().get(produit=produit).disponibles_a_jour
+
+    def test_csv_avec_doublons(self):
+        existante = Cle.objects.get(produit=self.produit).contenue
+        reponse = self.importer(
+            "\ufeffcontenue,produit\n"
+            f"A-1,{self.autre.pk}\n"
+            f"A-2,{self.autre.pk}\n"
+            f"A-1,{self.autre.pk}\n"
+            f"{existante},{self.autre.pk}\n"
+            "A-3,0\n".encode(),
+            validite="1 ans",
+        )
+        self.assertEqual(reponse.status_code, 200)
+        rapport = reponse.json()
+        self.assertEqual(
+            (rapport["lignes"], rapport["creees"], rapport["doublons"]), (5, 2, 2)
+        )
+        self.assertEqual([erreur["ligne"] for erreur in rapport["erreurs"]], [4, 6, 5])
+        self.assertEqual(
+            sorted(
+                Cle.objects.filter(produit=self.autre).values_list(
+                    "contenue", flat=True
+                )
+            ),
+            ["A-1", "A-2"],
+        )
+        self.assertEqual(self.disponibles(self.autre), 2)
+        self.assertEqual(self.disponibles(self.produit), 1)
+
+    def test_jsonl(self):
+        lignes = [
+            {"contenue": "J-1", "produit": self.autre.pk, "validite": "1 ans"},
+            {"contenue": "J-2"},
+            "pas un objet",
+        ]
+        reponse = self.importer(
+            "\n".join(json.dumps(ligne) for ligne in lignes).encode() + b"\n{",
+            nom="cles.jsonl",
+            produit=self.produit.pk,
+            validite="1 ans",
+        )
+        rapport = reponse.json()
+        self.assertEqual((rapport["creees"], rapport["nombre_erreurs"]), (2, 2))
+        self.assertEqual(Cle.objects.get(contenue="J-2").produit, self.produit)
+        self.assertEqual(self.disponibles(self.produit), 2)
+        self.assertEqual(self.disponibles(self.autre), 1)
+
+    def test_doublons_entre_lots(self):
+        rapport = importer_cles(
+            ["contenue", "L-1", "L-2", "L-1", "L-3"],
+            produit=self.autre.pk,
+            validite="1 ans",
+            taille_lot=2,
+        )
+        self.assertEqual((rapport["creees"], rapport["doublons"]), (3, 1))
+        rapport = importer_cles(
+            ["contenue", "L-3", "L-4"], produit=self.autre.pk, validite="1 ans"
+        )
+        self.assertEqual((rapport["creees"], rapport["doublons"]), (1, 1))
+        self.assertEqual(
+            rapport["erreurs"], [{"ligne": 2, "erreur": "Clé déjà existante."}]
+        )
+        self.assertEqual(self.disponibles(self.autre), 4)
+
+    def test_fichier_non_utf8(self):
+        reponse = self.importer(
+            f"contenue\nA-1\nCLÉ-2\n".encode("latin-1"), produit=self.autre.pk
+        )
+        self.assertEqual(reponse.status_code, 400)
+        self.assertIn("Ligne 3", reponse.json()["error"])
+        self.assertFalse(Cle.objects.filter(produit=self.autre).exists())
+
+        reponse = self.importer("contenue\nA-1\n".encode("utf-16"))
+        self.assertEqual(reponse.status_code, 400)
+        self.assertIn("Ligne 1", reponse.json()["error"])
+
+
+class CodesCalculesTests(CommandeTestCase):
+    def test_codes_calcules_en_base(self):
+        self.assertEqual(self.client_.code_utilisateur, f"client-{self.client_.pk}")
+        self.assertEqual(self.vendeur.code_utilisateur, f"vendeur-{self.vendeur.pk}")
+        action = Action.objects.create(
+            type="devis", prix=10, client=self.client_, methode_paiement=self.methode
+        )
+        # Relus par INSERT ... RETURNING, sans nouvelle requête
+        self.assertEqual(action.code_action, f"EJ-devis-{action.pk}")
+        (cle,) = Cle.objects.bulk_create(
+            [Cle(contenue="CLE-X", produit=self.produit, validite="1 ans")]
+        )
+        self.assertEqual(cle.code_cle, f"Produit-{cle.pk}")
+        self.assertEqual(Cle.objects.get(pk=cle.pk).code_cle, f"Produit-{cle.pk}")
+
+
+class MigrationCodeCleTests(TransactionTestCase):
+    avant = [("api", "0016_facture_non_envoyee_idx")]
+    apres = [("api", "0017_recalculer_code_cle")]
+
+    def migrer(self, cible=None):
+        executor = MigrationExecutor(connection)
+        executor.migrate(cible or executor.loader.graph.leaf_nodes())
+
+    def test_codes_existants_recalcules(self):
+        self.migrer(self.avant)
+        self.addCleanup(self.migrer)
+        (produit,) = creer_produits_avec_cles(2)
+        cles = list(Cle.objects.order_by("pk").values_list("pk", flat=True))
+        # Codes laissés par l'ancien calcul ; le trigger ne réagit qu'à produit_id
+        Cle.objects.update(code_cle=f"{produit.nom}-None")
+
+        self.migrer(self.apres)
+        self.assertEqual(
+            list(Cle.objects.order_by("pk").values_list("code_cle", flat=True)),
+            [f"{produit.nom}-{pk}" for pk in cles],
+        )
+
+
+class MigrationClesEnDoubleTests(TransactionTestCase):
+    avant = [("api", "0014_mouvementstock")]
+    apres = [("api", "0015_cle_contenue_unique")]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.avant)
+        self.addCleanup(self.migrer)
+        modeles = executor.loader.project_state(self.avant).apps
+        Cle = modeles.get_model("api", "Cle")
+        categorie = modeles.get_model("api", "Categorie").objects.create(
+            nom="Logiciels", description=""
+        )
+        self.produit = modeles.get_model("api", "Produit").objects.create(
+            categorie=categorie,
+            nom="Produit",
+            description="",
+            image="produits/test.png",
+            prix_min=1,
+            prix=10,
+            prix_max=100,
+        )
+        self.cles = Cle.objects.bulk_create(
+            Cle(
+                contenue=contenue,
+                produit=self.produit,
+                validite="1 ans",
+                disponiblite=disponible,
+            )
+            for contenue, disponible in [
+                ("A", True),
+                ("A", True),
+                ("B", True),
+                ("B", False),
+                ("B", True),
+                ("C", True),
+            ]
+        )
+
+    def migrer(self, cible=None):
+        executor = MigrationExecutor(connection)
+        executor.migrate(cible or executor.loader.graph.leaf_nodes())
+
+    def test_doublons_disponibles_supprimes(self):
+        self.migrer(self.apres)
+        a, _, _, b, _, c = (cle.pk for cle in self.cles)
+        self.assertEqual(
+            sorted(Cle.objects.values_list("pk", flat=True)), sorted([a, b, c])
+        )
+        # Le trigger de stock a noté les trois suppressions
+        self.assertEqual(
+            MouvementStock.objects.filter(produit=self.produit.pk).aggregate(
+                total=Sum("delta")
+            )["total"],
+            2,
+        )
+
+    def test_cle_vendue_en_double(self):
+        Cle.objects.filter(pk=self.cles[0].pk).update(disponiblite=False)
+        Cle.objects.filter(pk=self.cles[1].pk).update(disponiblite=False)
+        with self.assertRaisesMessage(
+            RuntimeError, f"ids : {self.cles[0].pk}, {self.cles[1].pk})"
+        ):
+            self.migrer(self.apres)
+        # Rien n'a été supprimé
+        self.assertEqual(Cle.objects.count(), 6)
+        # Doublon remplacé : la migration passe
+        Cle.objects.filter(pk=self.cles[1].pk).delete()
+        self.migrer(self.apres)
+        self.assertEqual(Cle.objects.count(), 3)
+
+
+class StatistiquesTests(CommandeTestCase):
+    jour = date(2026, 3, 10)
+
+    def setUp(self):
+        super().setUp()
+        veille, avant_veille = self.jour - timedelta(1), self.jour - timedelta(2)
+        self.ancienne = self.action(avant_veille, "achat", 100)
+        self.action(veille, "achat", 30, quantite=3)
+        self.action(veille, "devis", 50)
+        self.action(self.jour, "achat", 10)
+        self.action(self.jour, "achat", 20, client=self.vendeur)
+
+    def action(self, jour, type, prix, client=None, quantite=1):
+        action = Action.objects.create(
+            type=type,
+            prix=prix,
+            client=client or self.client_,
+            methode_paiement=self.methode,
+        )
+        ElementAchatDevis.objects.create(
+            action=action, produit=self.produit, quantite=quantite, prix_total=prix
+        )
+        # date_action est renseignée à la création (auto_now_add)
+        midi = timezone.make_aware(datetime.combine(jour, time(12)))
+        Action.objects.filter(pk=action.pk).update(date_action=midi)
+        return action
+
+    def ventes(self):
+        return {
+            (v.jour, v.type): (v.nombre_actions, v.montant_total)
+            for v in VenteJournaliere.objects.all()
+        }
+
+    def test_agregats_journaliers(self):
+        veille, avant_veille = self.jour - timedelta(1), self.jour - timedelta(2)
+        for _ in range(2):
+            # Relancer remplace les lignes au lieu de les cumuler
+            self.assertEqual(
+                reconstruire_statistiques(avant_veille, self.jour), (4, 3, 4)
+            )
+        self.assertEqual(
+            self.ventes(),
+            {
+                (avant_veille, "achat"): (1, 100),
+                (veille, "achat"): (1, 30),
+                (veille, "devis"): (1, 50),
+                (self.jour, "achat"): (2, 30),
+            },
+        )
+        self.assertEqual(
+            {
+                v.jour: (v.nombre_lignes, v.quantite, v.montant_total)
+                for v in VenteProduitJournaliere.objects.filter(produit=self.produit)
+            },
+            {avant_veille: (1, 1, 100), veille: (2, 4, 80), self.jour: (2, 2, 30)},
+        )
+        self.assertEqual(
+            {
+                (v.jour, v.client_id): (v.nombre_actions, v.montant_total)
+                for v in VenteClientJournaliere.objects.all()
+            },
+            {
+                (avant_veille, self.client_.pk): (1, 100),
+                (veille, self.client_.pk): (2, 80),
+                (self.jour, self.client_.pk): (1, 10),
+                (self.jour, self.vendeur.pk): (1, 20),
+            },
+        )
+
+    def test_actualisation_des_deux_derniers_jours(self):
+        reconstruire_statistiques(self.jour - timedelta(2), self.jour)
+        Action.objects.filter(pk=self.ancienne.pk).update(prix=1)
+        self.action(self.jour, "devis", 5)
+        with mock.patch.object(timezone, "localdate", return_value=self.jour):
+            actualiser_statistiques()
+        ventes = self.ventes()
+        # L'avant-veille, hors fenêtre, n'est pas recalculée
+        self.assertEqual(ventes[self.jour - timedelta(2), "achat"], (1, 100))
+        self.assertEqual(ventes[self.jour, "devis"], (1, 5))
+
+    def test_tableau_de_bord(self):
+        reconstruire_statistiques(self.jour - timedelta(2), self.jour)
+        self.api.force_authenticate(
+            Utilisateur.objects.create_user(
+                username="admin", password="x", role="admin"
+            )
+        )
+        veille = self.jour - timedelta(1)
+        reponse = self.api.get(f"/api/stats/?from={veille}&to={self.jour}")
+        self.assertEqual(reponse.status_code, 200)
+        donnees = reponse.json()
+        self.assertEqual(donnees["total_actions"], 5)
+        # Les achats seulement : le devis de la veille n'est pas une vente
+        self.assertEqual(donnees["recent_sales"], {"total": 60.0, "count": 3})
+        self.assertEqual(
+            donnees["sales_per_day"],
+            [
+                {"jour": str(veille), "total": 30.0, "count": 1},
+                {"jour": str(self.jour), "total": 30.0, "count": 2},
+            ],
+        )
+        self.assertEqual(
+            donnees["top_products"], [{"produit__nom": "Produit", "total_sales": 4}]
+        )
+        self.assertEqual(
+            donnees["top_clients"],
+            [
+                {
+                    "client__nom_complet": "Client",
+                    "total_purchases": 3,
+                    "total_spent": 90.0,
+                },
+                {
+                    "client__nom_complet": "Vendeur",
+                    "total_purchases": 1,
+                    "total_spent": 20.0,
+                },
+            ],
+        )
+        reponse = self.api.get(f"/api/stats/?from={self.jour}&to={veille}")
+        self.assertEqual(reponse.status_code, 400)
+
+
+class ChampsSelectionnablesTests(CommandeTestCase):
+    def test_liste_restreinte(self):
+        with CaptureQueriesContext(connection) as requetes:
+            reponse = self.api.get("/api/cles/?fields=id,contenue")
+        self.assertEqual(reponse.status_code, 200)
+        lignes = reponse.json()["results"]
+        self.assertEqual(len(lignes), 5)
+        self.assertEqual({tuple(ligne) for ligne in lignes}, {("id", "contenue")})
+        # Seules les colonnes demandées sont lues
+        (lecture,) = [r["sql"] for r in requetes if '"api_cle"."contenue"' in r["sql"]]
+        self.assertNotIn("validite", lecture)
+
+    def test_detail_restreint(self):
+        cle = Cle.objects.earliest("pk")
+        reponse = self.api.get(f"/api/cles/{cle.pk}/?fields=code_cle")
+        self.assertEqual(reponse.json(), {"code_cle": f"Produit-{cle.pk}"})
+        # Sans ?fields=, tous les champs
+        complet = self.api.get(f"/api/cles/{cle.pk}/").json()
+        self.assertLessEqual({"id", "contenue", "validite"}, set(complet))
+
+    def test_champs_inconnus(self):
+        for url in (
+            "/api/cles/?fields=id,secret,autre",
+            "/api/produits/?fields=id,secret,autre",
+        ):
+            with self.subTest(url=url):
+                reponse = self.api.get(url)
+                self.assertEqual(reponse.status_code, 400)
+                self.assertEqual(
+                    reponse.json(), {"fields": "Champs inconnus: autre, secret."}
+                )
+
+    def test_bench_serialisation(self):
+        sortie = StringIO()
+        call_command(
+            "bench_serialisation",
+            "--nombre=50",
+            "--repetitions=1",
+            "--champs=id,contenue",
+            stdout=sortie,
+        )
+        lignes = sortie.getvalue().splitlines()
+        self.assertEqual(len(lignes), 2)
+        self.assertTrue(lignes[0].startswith("ModelSerializer: 50 clés en "))
+        self.assertTrue(lignes[1].startswith(".values(): 50 clés en "))
+        # Les données du bench sont annulées
+        self.assertEqual(Cle.objects.count(), 5)
+
+
+class KeysetPaginationTests(CommandeTestCase):
+    def setUp(self):
+        super().setUp()
+        # Deux paires d'actions à la même date : le curseur départage par id
+        dates = [
+            datetime(2026, 3, 10, 12, 0, 0, 123456, tzinfo=dt_timezone.utc),
+            datetime(2026, 3, 10, 12, 0, 0, 123456, tzinfo=dt_timezone.utc),
+            datetime(2026, 3, 10, 12, 0, 0, 123457, tzinfo=dt_timezone.utc),
+            datetime(2026, 3, 9, 8, 30, tzinfo=dt_timezone.utc),
+            datetime(2026, 3, 9, 8, 30, tzinfo=dt_timezone.utc),
+        ]
+        self.actions = []
+        for prix, date_action in zip(
+            ["10.10", "10.10", "9.99", "10.01", "10.1"], dates
+        ):
+            action = Action.objects.create(
+                type="achat",
+                prix=prix,
+                client=self.client_,
+                methode_paiement=self.methode,
+            )
+            Action.objects.filter(pk=action.pk).update(date_action=date_action)
+            self.actions.append(action.pk)
+
+    def pages(self, url, lien="next"):
+        pages = []
+        while url:
+            reponse = self.api.get(url)
+            self.assertEqual(reponse.status_code, 200)
+            pages.append(reponse.json())
+            url = pages[-1][lien]
+        return pages
+
+    def test_parcours_avant_et_arriere(self):
+        a, b, c, d, e = self.actions
+        attendu = [[c, a], [b, d], [e]]
+        pages = self.pages("/api/actions/historique/?page_size=2&fields=id")
+        ids = [[ligne["id"] for ligne in page["results"]] for page in pages]
+        self.assertEqual(ids, attendu)
+
+        # Retour depuis la dernière page
+        precedentes = self.pages(pages[-1]["previous"], lien="previous")
+        ids = [[ligne["id"] for ligne in page["results"]] for page in precedentes]
+        self.assertEqual(ids, attendu[-2::-1])
+
+    def test_criteres_decimaux(self):
+        a, b, c, d, e = self.actions
+        vue = SimpleNamespace(ordering=["prix"])
+        url, ordre = "/?page_size=2", []
+        while url:
+            pagination = KeysetPagination()
+            requete = Request(APIRequestFactory().get(url))
+            page = pagination.paginate_queryset(Action.objects.all(), requete, vue)
+            ordre += [action.pk for action in page]
+            url = pagination.get_next_link()
+        # 10.1 et 10.10 sont égaux : départagés par id
+        self.assertEqual(ordre, [c, d, a, b, e])
+
+    def test_curseur_invalide(self):
+        for curseur in ("invalide", "cD1bIjIwMjYiXQ==", "cD1bInRleHRlIiwgMV0="):
+            reponse = self.api.get(f"/api/actions/historique/?cursor={curseur}")
+            self.assertEqual(reponse.status_code, 404, curseur)
+
+    def test_critere_nullable_refuse(self):
+        vue = SimpleNamespace(ordering=["vendeur"])
+        requete = Request(APIRequestFactory().get("/"))
+        with self.assertRaises(ImproperlyConfigured):
+            KeysetPagination().paginate_queryset(Action.objects.all(), requete, vue)
+
+
+class ReservationConcurrenteTests(TransactionTestCase):
+    def test_cles_verrouillees_sautees(self):
+        (produit,) = creer_produits_avec_cles(3)
+        resultats = {}
+
+        def reserver_ailleurs():
+            # Autre thread, donc autre connexion et autre transaction
+            try:
+                with transaction.atomic():
+                    resultats["autre"] = Cle.objects.reserver({produit.pk: 2})
+            except StockInsuffisant as e:
+                resultats["autre"] = e
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            premieres = Cle.objects.reserver({produit.pk: 2})
+            autre = threading.Thread(target=reserver_ailleurs)
+            autre.start()
+            autre.join(timeout=10)
+            # Sans attendre le verrou : seule la troisième clé était libre
+            self.assertFalse(autre.is_alive())
+
+        self.assertIsInstance(resultats["autre"], StockInsuffisant)
+        self.assertEqual(resultats["autre"].disponibles, 1)
+        self.assertEqual(
+            Cle.objects.filter(disponiblite=False).count(), len(premieres[produit.pk])
+        )
+
+
+class IdempotenceTests(CommandeTestCase):
+    def test_renvoi_rejoue_la_reponse(self):
+        cle = uuid4().hex
+        premiere = self.commander(cle)
+        self.assertEqual(premiere.status_code, 200)
+
+        with self.assertNumQueries(0):
+            seconde = self.commander(cle)
+        self.assertEqual(seconde.status_code, 200)
+        self.assertEqual(seconde["Idempotent-Replayed"], "true")
+        self.assertEqual(seconde.json(), premiere.json())
+        self.assertEqual(Action.objects.count(), 1)
+        self.assertEqual(Cle.objects.filter(disponiblite=False).count(), 1)
+
+    def test_entetes_rejoues(self):
+        cle = uuid4().hex
+        premiere = self.commander(cle, HTTP_PREFER="respond-async")
+        self.assertEqual(premiere.status_code, 202)
+        for vider_cache in (False, True):
+            if vider_cache:
+                cache.clear()
+            seconde = self.commander(cle, HTTP_PREFER="respond-async")
+            self.assertEqual(seconde.status_code, 202)
+            self.assertEqual(seconde["Location"], premiere["Location"])
+        self.assertEqual(CommandeEnAttente.objects.count(), 1)
+
+    def test_reponse_relue_en_base(self):
+        cle = uuid4().hex
+        premiere = self.commander(cle)
+        cache.clear()
+        seconde = self.commander(cle)
+        self.assertEqual(seconde.json(), premiere.json())
+        self.assertEqual(Action.objects.count(), 1)
+
+    def test_cle_reutilisee_pour_une_autre_requete(self):
+        cle = uuid4().hex
+        self.commander(cle)
+        self.assertEqual(self.commander(cle, quantite=2).status_code, 422)
+        self.assertEqual(Action.objects.count(), 1)
+
+    def test_erreur_libere_la_cle(self):
+        cle = uuid4().hex
+        self.assertEqual(self.commander(cle, quantite=10).status_code, 400)
+        self.assertFalse(CleIdempotence.objects.exists())
+        self.assertEqual(self.commander(cle).status_code, 200)
+
+    def test_requete_en_cours(self):
+        cle = uuid4().hex
+        premiere = self.commander(cle)
+        # La requête n'a pas encore de réponse : un renvoi doit attendre
+        CleIdempotence.objects.filter(cle=cle).update(statut=None, reponse=None)
+        cache.delete(_cle_cache(self.vendeur.pk, cle))
+        reponse = self.commander(cle)
+        self.assertEqual(reponse.status_code, 409)
+        self.assertEqual(reponse["Retry-After"], "1")
+
+        # Passé le délai de traitement, la requête interrompue est reprise
+        CleIdempotence.objects.filter(cle=cle).update(
+            date_creation=timezone.now() - timedelta(hours=1)
+        )
+        reponse = self.commander(cle)
+        self.assertEqual(reponse.status_code, 200)
+        self.assertNotEqual(reponse.json()["action_id"], premiere.json()["action_id"])
+
+    def test_sans_cle(self):
+        self.commander()
+        self.commander()
+        self.assertEqual(Action.objects.count(), 2)
+
+
+class CommandeAsynchroneTests(CommandeTestCase):
+    def commander_async(self, quantite=1):
+        return self.commander(quantite=quantite, HTTP_PREFER="respond-async")
+
+    def test_commande_acceptee_puis_traitee(self):
+        reponse = self.commander_async()
+        self.assertEqual(reponse.status_code, 202)
+        self.assertEqual(reponse["Location"], reponse.data["url"])
+        self.assertFalse(Action.objects.exists())
+
+        statut = self.api.get(reponse["Location"]).json()
+        self.assertEqual(statut["statut"], "en_attente")
+
+        self.assertEqual(traiter_lot(10), 1)
+        statut = self.api.get(reponse["Location"]).json()
+        self.assertEqual(statut["statut"], "traitee")
+        action = Action.objects.get()
+        self.assertEqual(statut["action"], action.pk)
+        self.assertEqual(statut["resultat"]["action_id"], action.pk)
+        self.assertEqual(len(statut["resultat"]["cles"]["Produit"]), 1)
+        self.assertEqual(Cle.objects.filter(disponiblite=False).count(), 1)
+
+    def test_validation_immediate(self):
+        reponse = self.api.post(
+            "/api/actions/",
+            {"action": {"type": "achat"}, "produits": [{"produit": 0}]},
+            format="json",
+            HTTP_PREFER="respond-async",
+        )
+        self.assertEqual(reponse.status_code, 400)
+        self.assertFalse(CommandeEnAttente.objects.exists())
+
+    def test_une_reservation_par_lot(self):
+        for _ in range(3):
+            self.commander_async()
+        with CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(traiter_lot(10), 3)
+        reservations = [
+            requete
+            for requete in requetes.captured_queries
+            if "SKIP LOCKED" in requete["sql"] and "api_cle" in requete["sql"]
+        ]
+        self.assertEqual(len(reservations), 1)
+        self.assertEqual(Action.objects.count(), 3)
+        MouvementStock.objects.appliquer()
+        self.assertEqual(StockCle.objects.get(produit=self.produit).disponibles, 2)
+
+    def test_lot_au_dela_du_stock(self):
+        # 3 + 3 clés pour 5 disponibles : la réservation groupée échoue, chaque
+        # commande réserve alors les siennes et seule la première passe
+        premiere = self.commander_async(quantite=3)
+        seconde = self.commander_async(quantite=3)
+        self.assertEqual(traiter_lot(10), 2)
+
+        self.assertEqual(self.api.get(premiere["Location"]).json()["statut"], "traitee")
+        refus = self.api.get(seconde["Location"]).json()
+        self.assertEqual(refus["statut"], "refusee")
+        self.assertIn("Pas assez de clés", refus["resultat"]["error"])
+        self.assertEqual(Cle.objects.filter(disponiblite=False).count(), 3)
+        MouvementStock.objects.appliquer()
+        self.assertEqual(StockCle.objects.get(produit=self.produit).disponibles, 2)
+
+    def statuts(self):
+        return list(
+            CommandeEnAttente.objects.order_by("id").values_list("statut", flat=True)
+        )
+
+    def traitement_planifie(self):
+        return bool(commandes._redis().exists(commandes.TRAITEMENT_PLANIFIE))
+
+    def test_drapeau_reserve_puis_libere(self):
+        with mock.patch.object(traiter_commandes, "apply_async") as planifiee:
+            for _ in range(2):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.commander_async()
+        # Un seul traitement planifié pour les deux commandes
+        planifiee.assert_called_once_with(countdown=settings.COMMANDES_DELAI_LOT)
+        self.assertTrue(self.traitement_planifie())
+
+        with taches_immediates():
+            self.assertEqual(traiter_commandes.delay().get(), 2)
+        self.assertFalse(self.traitement_planifie())
+        self.assertEqual(self.statuts(), ["traitee"] * 2)
+
+    def test_vidage_par_lots(self):
+        for _ in range(5):
+            self.commander_async()
+        with (
+            taches_immediates(),
+            CaptureQueriesContext(connection) as requetes,
+        ):
+            self.assertEqual(traiter_commandes.delay(taille_lot=2).get(), 5)
+        lots = [
+            r
+            for r in requetes
+            if "api_commandeenattente" in r["sql"] and "SKIP LOCKED" in r["sql"]
+        ]
+        # 2 + 2 + 1, puis un lot vide qui arrête la boucle
+        self.assertEqual(len(lots), 4)
+        self.assertEqual(self.statuts(), ["traitee"] * 5)
+        self.assertFalse(self.traitement_planifie())
+
+    def test_replanifie_apres_lots_max(self):
+        for _ in range(5):
+            self.commander_async()
+        with (
+            taches_immediates(),
+            mock.patch.object(
+                traiter_commandes, "apply_async", wraps=traiter_commandes.apply_async
+            ) as planifiee,
+        ):
+            # Deux lots de 2, puis la suite est replanifiée (et exécutée ici)
+            self.assertEqual(traiter_commandes(taille_lot=2, lots_max=2), 4)
+        planifiee.assert_called_once_with(countdown=settings.COMMANDES_DELAI_LOT)
+        self.assertEqual(self.statuts(), ["traitee"] * 5)
+        self.assertFalse(self.traitement_planifie())
+
+    def test_commandes_d_un_autre_vendeur(self):
+        reponse = self.commander_async()
+        autre = Utilisateur.objects.create_user(
+            username="autre",
+            password="x",
+            nom_complet="Autre",
+            role="vendeur",
+            numero_telephone="0",
+            adresse="Antananarivo",
+        )
+        self.api.force_authenticate(autre)
+        self.assertEqual(self.api.get(reponse["Location"]).status_code, 404)
+
+
+# Cache Redis (base des tests) : connexions du client Redis du processus
+@override_settings(CACHES=settings.CACHES)
+class VuesAsyncTests(CommandeTestCase):
+
+    def test_liste_identique_a_la_vue_drf(self):
+        Produit.objects.bulk_create(
+            Produit(
+                categorie=self.produit.categorie,
+                nom=f"Produit {n}",
+                description="",
+                image="produits/test.png",
+                prix_min=1,
+                prix=n,
+                prix_max=100,
+            )
+            for n in range(3)
+        )
+        vue = ProduitListCreateAPIView.as_view()
+        url = "/api/produits/?page_size=2&fields=id,nom,prix,image"
+        while url:
+            cache.clear()
+            attendu = vue(APIRequestFactory().get(url)).render()
+            cache.clear()
+            reponse = self.client.get(url)
+            self.assertEqual(reponse.json(), json.loads(attendu.content))
+            url = reponse.json()["next"]
+
+        # Mêmes entrées de cache et même ETag que la vue DRF
+        reponse = self.client.get("/api/produits/")
+        attendu = vue(APIRequestFactory().get("/api/produits/"))
+        self.assertEqual(reponse["ETag"], attendu["ETag"])
+
+    def connexions_cache(self):
+        client = cache._cache.get_client()
+        base = client.connection_pool.connection_kwargs.get("db", 0)
+        return sum(1 for c in client.client_list() if int(c["db"]) == base)
+
+    def test_catalogue_sous_wsgi(self):
+        # Sous WSGI, chaque requête d'une vue asynchrone a sa propre boucle
+        # d'événements : aucune ne doit ouvrir de nouvelle connexion Redis
+        self.client.get("/api/categories/")
+        avant = self.connexions_cache()
+        for _ in range(5):
+            reponse = self.client.get("/api/categories/")
+            self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(self.connexions_cache(), avant)
+
+        reponse = self.client.get(
+            "/api/categories/", HTTP_IF_NONE_MATCH=reponse["ETag"]
+        )
+        self.assertEqual(reponse.status_code, 304)
+
+    def test_echec_de_connexion_signale(self):
+        echecs = []
+
+        def recevoir(sender, credentials, **kwargs):
+            echecs.append(credentials["username"])
+
+        user_login_failed.connect(recevoir)
+        self.addCleanup(user_login_failed.disconnect, recevoir)
+        reponse = self.client.post(
+            "/api/token/", {"username": "vendeur", "password": "mauvais"}
+        )
+        self.assertEqual(reponse.status_code, 401)
+        self.assertEqual(echecs, ["vendeur"])
+
+    async def test_connexion_et_deconnexion(self):
+        refus = await self.async_client.post(
+            "/api/token/",
+            {"username": "vendeur", "password": "mauvais"},
+            content_type="application/json",
+        )
+        self.assertEqual(refus.status_code, 401)
+
+        reponse = await self.async_client.post(
+            "/api/token/",
+            {"username": "vendeur", "password": "x"},
+            content_type="application/json",
+        )
+        self.assertEqual(reponse.status_code, 200)
+        self.assertIn("refresh_token", reponse.cookies)
+
+        acces = {"Authorization": f"Bearer {reponse.json()['access']}"}
+        categorie = f"/api/categories/{self.produit.categorie_id}/"
+        self.assertEqual((await self.async_client.get(categorie)).status_code, 401)
+        self.assertEqual(
+            (await self.async_client.get(categorie, headers=acces)).status_code, 403
+        )
+        self.assertEqual(
+            (await self.async_client.post("/api/logout/", headers=acces)).status_code,
+            200,
+        )
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class RechercheProduitsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.categorie = Categorie.objects.create(nom="Logiciels", description="")
+        autre = Categorie.objects.create(nom="Jeux", description="")
+        for nom, description, categorie in (
+            ("Antivirus Pro", "Protection complète du poste", cls.categorie),
+            ("Suite bureautique", "Traitement de texte et antivirus", cls.categorie),
+            ("Jeu de course", "Voitures et circuits", autre),
+        ):
+            Produit.objects.create(
+                categorie=categorie,
+                nom=nom,
+                description=description,
+                image="produits/test.png",
+                prix_min=1,
+                prix=10,
+                prix_max=100,
+            )
+
+    def setUp(self):
+        cache.clear()
+        vider_redis_tests()
+
+    def rechercher(self, **parametres):
+        return self.client.get("/api/produits/search/", parametres)
+
+    def test_classement_par_pertinence(self):
+        reponse = self.rechercher(q="antivirus")
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(reponse.json()["count"], 2)
+        # Le nom pèse plus que la description
+        self.assertEqual(
+            [p["nom"] for p in reponse.json()["results"]],
+            ["Antivirus Pro", "Suite bureautique"],
+        )
+
+    def test_recherche_approchee(self):
+        reponse = self.rechercher(q="bureauti")
+        self.assertEqual(
+            [p["nom"] for p in reponse.json()["results"]], ["Suite bureautique"]
+        )
+
+    def test_filtre_et_parametre_obligatoire(self):
+        reponse = self.rechercher(q="voitures", categorie=self.categorie.pk)
+        self.assertEqual(reponse.json()["count"], 0)
+        self.assertEqual(self.rechercher(q=" ").status_code, 400)
+
+
+class FacturesTests(CommandeTestCase):
+    def test_deux_factures_partagent_le_logo(self):
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        chemin = f"{dossier.name}/logo.jpg"
+        Image.new("RGB", (400, 200), "blue").save(chemin, "JPEG")
+        actions = [
+            Action.objects.create(
+                type="achat",
+                prix=10,
+                client=self.client_,
+                vendeur=self.vendeur,
+                methode_paiement=self.methode,
+            )
+            for _ in range(2)
+        ]
+        cles_data = {"Produit": [{"contenue": "CLE-0", "validite": "1 ans"}]}
+
+        with override_settings(FACTURE_LOGO=chemin):
+            pdfs = [
+                rendre_facture(action, self.client_, cles_data) for action in actions
+            ]
+        self.assertEqual(len(pdfs), 2)
+        for pdf in pdfs:
+            self.assertTrue(pdf.startswith(b"%PDF"))
+            # Une seule image par document, le logo en JPEG
+            self.assertEqual(pdf.count(b"/Subtype /Image"), 1)
+            self.assertEqual(pdf.count(b"/DCTDecode ] /Height 200"), 1)
+        self.assertEqual(_logo.cache_info().currsize, 1)
+
+    def test_email_de_l_entreprise(self):
+        action = Action.objects.create(
+            type="devis", prix=10, client=self.client_, methode_paiement=self.methode
+        )
+        with override_settings(EMAIL_HOST_USER="contact@example.com"):
+            pdf = rendre_facture(action, self.client_, {})
+        # Flux de l'en-tête (forme PDF) et de la page, compressés puis encodés
+        # en ASCII85
+        flux = re.findall(rb"stream\r?\n([!-uz\s]*)~>endstream", pdf)
+        texte = b"".join(zlib.decompress(base64.a85decode(f)) for f in flux)
+        self.assertEqual(texte.count(b"contact@example.com"), 2)
+
+
+class RepriseFacturesTests(CommandeTestCase):
+    def setUp(self):
+        super().setUp()
+        # Vidage déjà planifié : la tâche ne fait que remplir la file
+        emails.reserver_vidage(60)
+
+    def facture(self, age, envoyee=False):
+        action = Action.objects.create(
+            type="achat",
+            prix=10,
+            client=self.client_,
+            vendeur=self.vendeur,
+            methode_paiement=self.methode,
+        )
+        facture = Facture.objects.create(action=action, fichier="factures/test.pdf")
+        Facture.objects.filter(pk=facture.pk).update(
+            date_creation=timezone.now() - age,
+            date_envoi=timezone.now() if envoyee else None,
+        )
+        return facture
+
+    def test_factures_non_envoyees_remises_en_file(self):
+        perdue = self.facture(timedelta(hours=1))
+        self.facture(timedelta(hours=1), envoyee=True)
+        self.facture(timedelta(minutes=1))
+        en_echec = self.facture(timedelta(hours=1))
+        EmailEchec.objects.create(
+            client=self.client_, action=en_echec.action, erreur="x", donnees="{}"
+        )
+
+        self.assertEqual(reprendre_factures_non_envoyees(), 1)
+        self.assertEqual(emails.prendre_factures(10), [perdue.pk])
+
+    def test_facture_deja_envoyee_ignoree(self):
+        envoyee = self.facture(timedelta(hours=1), envoyee=True)
+        self.assertEqual(_envoyer_lot([envoyee.pk]), 0)
+        self.assertEqual(mail.outbox, [])
+
+
+class RepriseEmailsTests(CommandeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.autre = Utilisateur.objects.create_user(
+            username="autre", password="x", email="autre@example.com"
+        )
+
+    def echec(self, client=None, age=timedelta(hours=2), action=None):
+        client = client or self.client_
+        action = action or Action.objects.create(
+            type="achat", prix=10, client=client, methode_paiement=self.methode
+        )
+        echec = EmailEchec.objects.create(
+            client=client,
+            action=action,
+            erreur="Connexion refusée",
+            donnees=json.dumps({"Produit": [{"contenue": "CLE", "validite": "1 ans"}]}),
+        )
+        EmailEchec.objects.filter(pk=echec.pk).update(date_echec=timezone.now() - age)
+        return echec
+
+    def test_reprise_et_resolution(self):
+        premier = self.echec()
+        doublon = self.echec(action=premier.action)
+        autre = self.echec(self.autre)
+        recent = self.echec(age=timedelta(minutes=5))
+
+        self.assertEqual(rejouer_emails_echec(), 2)
+        # Un email par action, même avec deux échecs
+        self.assertEqual(
+            sorted(email.to[0] for email in mail.outbox), ["", "autre@example.com"]
+        )
+        resolus = EmailEchec.objects.filter(resolu=True, date_resolution__isnull=False)
+        self.assertEqual(
+            set(resolus.values_list("pk", flat=True)),
+            {premier.pk, doublon.pk, autre.pk},
+        )
+        self.assertEqual(Facture.objects.filter(date_envoi__isnull=False).count(), 2)
+        # L'échec récent est laissé aux tentatives de la tâche d'envoi
+        recent.refresh_from_db()
+        self.assertFalse(recent.resolu)
+
+    def test_lot_borne(self):
+        for _ in range(3):
+            self.echec()
+        self.assertEqual(rejouer_emails_echec(taille_lot=2), 2)
+        self.assertEqual(EmailEchec.objects.filter(resolu=False).count(), 1)
+        self.assertEqual(rejouer_emails_echec(taille_lot=2), 1)
+        self.assertEqual(rejouer_emails_echec(taille_lot=2), 0)
+
+    def test_attente_par_client(self):
+        premier, second = self.echec(), self.echec(age=timedelta(hours=1))
+        autre = self.echec(self.autre, age=timedelta(minutes=90))
+        refus = smtplib.SMTPRecipientsRefused({})
+        with mock.patch(
+            "api.reprise_emails.envoyer_messages", return_value=[(0, refus)]
+        ):
+            self.assertEqual(rejouer_echecs(taille_lot=1), (0, 1))
+
+        premier.refresh_from_db()
+        second.refresh_from_db()
+        autre.refresh_from_db()
+        self.assertEqual(premier.tentatives, 1)
+        self.assertEqual(second.tentatives, 0)
+        # Tous les échecs du client attendent, pas ceux des autres clients
+        attente = premier.prochain_essai - timezone.now()
+        self.assertAlmostEqual(attente.total_seconds(), 60, delta=5)
+        self.assertEqual(second.prochain_essai, premier.prochain_essai)
+        self.assertIsNone(autre.prochain_essai)
+
+        self.assertEqual(rejouer_echecs(), (1, 0))
+        self.assertTrue(EmailEchec.objects.get(pk=autre.pk).resolu)
+
+    def test_attente_exponentielle_plafonnee(self):
+        self.assertEqual(
+            [delai_attente(n).total_seconds() for n in (1, 2, 3)], [60, 120, 240]
+        )
+        self.assertEqual(delai_attente(20), timedelta(hours=6))
+
+    def test_statistiques(self):
+        self.echec()
+        self.echec(age=timedelta(minutes=10))
+        resolu = self.echec(age=timedelta(minutes=30))
+        resoudre([resolu.action_id])
+
+        admin = APIClient()
+        admin.force_authenticate(
+            Utilisateur.objects.create_user(
+                username="admin", password="x", role="admin"
+            )
+        )
+        reponse = admin.get("/api/emails/echecs/stats/?minutes=60")
+        self.assertEqual(reponse.status_code, 200)
+        donnees = reponse.json()
+        plus_ancien = donnees.pop("plus_ancien")
+        self.assertEqual(
+            donnees,
+            {
+                "en_attente": 2,
+                "a_rejouer": 1,
+                "nouveaux": 2,
+                "resolus": 1,
+                "periode_minutes": 60,
+                "debit_par_minute": 0.02,
+            },
+        )
+        self.assertEqual(
+            parse_datetime(plus_ancien),
+            EmailEchec.objects.filter(resolu=False).earliest("date_echec").date_echec,
+        )
+        reponse = admin.get("/api/emails/echecs/stats/?minutes=0")
+        self.assertEqual(reponse.status_code, 400)
+
+
+class ConnexionFactice:
+    """Backend email factice ; ``pannes`` : erreurs levées aux premiers envois."""
+
+    def __init__(self, *pannes):
+        self.pannes = list(pannes)
+        self.envoyes = []
+        self.connection = None
+
+    def open(self):
+        self.connection = self
+
+    def close(self):
+        self.connection = None
+
+    def noop(self):
+        return (250, b"OK")
+
+    def send_messages(self, messages):
+        if self.pannes:
+            raise self.pannes.pop(0)
+        self.envoyes += messages
+        return len(messages)
+
+
+class ConnexionEmailTests(SimpleTestCase):
+    def setUp(self):
+        emails.fermer_connexion_email()
+        self.addCleanup(emails.fermer_connexion_email)
+
+    def envoyer(self, *connexions):
+        messages = [EmailMessage(to=[f"{n}@example.com"]) for n in range(2)]
+        with mock.patch.object(
+            emails, "get_connection", side_effect=connexions
+        ) as get_connection:
+            echecs = emails.envoyer_messages(messages)
+        return messages, echecs, get_connection.call_count
+
+    def test_reconnexion_apres_deconnexion(self):
+        premiere = ConnexionFactice(smtplib.SMTPServerDisconnected("fermée"))
+        seconde = ConnexionFactice()
+        with self.assertLogs("api.emails", "WARNING"):
+            messages, echecs, ouvertures = self.envoyer(premiere, seconde)
+        self.assertEqual(echecs, [])
+        self.assertEqual(ouvertures, 2)
+        self.assertIsNone(premiere.connection)
+        # Le message en cours est retenté sur la nouvelle connexion
+        self.assertEqual(seconde.envoyes, messages)
+
+    def test_message_refuse_sans_reconnexion(self):
+        refus = smtplib.SMTPRecipientsRefused({"0@example.com": (550, b"Inconnu")})
+        connexion = ConnexionFactice(refus)
+        messages, echecs, ouvertures = self.envoyer(connexion)
+        self.assertEqual(echecs, [(0, refus)])
+        self.assertEqual(ouvertures, 1)
+        self.assertEqual(connexion.envoyes, messages[1:])
+
+    def test_connexion_perdue(self):
+        for erreur, perdue in (
+            (smtplib.SMTPServerDisconnected(), True),
+            (ConnectionResetError(), True),
+            (TimeoutError(), True),
+            (smtplib.SMTPRecipientsRefused({}), False),
+            (smtplib.SMTPDataError(554, b"Refus"), False),
+            (ValueError(), False),
+        ):
+            with self.subTest(erreur=type(erreur).__name__):
+                self.assertIs(emails._connexion_perdue(erreur), perdue)
+
+    def test_une_connexion_par_thread(self):
+        connexions = []
+
+        def dans_un_thread():
+            connexions.append(emails.connexion_email())
+            connexions.append(emails.connexion_email(reouvrir=True))
+
+        with mock.patch.object(
+            emails, "get_connection", side_effect=lambda **_: ConnexionFactice()
+        ):
+            principale = emails.connexion_email()
+            autre = threading.Thread(target=dans_un_thread)
+            autre.start()
+            autre.join()
+            self.assertIs(emails.connexion_email(), principale)
+        # La reconnexion de l'autre thread ne touche pas à celle-ci
+        self.assertIsNotNone(principale.connection)
+        self.assertIsNone(connexions[0].connection)
+
+        emails.fermer_connexion_email()
+        self.assertIsNone(principale.connection)
+        self.assertIsNone(connexions[1].connection)
+
+
+class CatalogueCacheTests(CommandeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = APIClient()
+        self.admin.force_authenticate(
+            Utilisateur.objects.create_user(
+                username="admin", password="x", role="admin"
+            )
+        )
+
+    def lire(self, url, etag=None, synchrone=False):
+        entetes = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        if synchrone:
+            vue = ProduitListCreateAPIView.as_view()
+            return vue(APIRequestFactory().get(url, **entetes)).render()
+        # Vue asynchrone (CatalogueAsyncView, alire_catalogue)
+        return self.client.get(url, **entetes)
+
+    def test_ecriture_invalide_le_cache(self):
+        for synchrone in (False, True):
+            with self.subTest(synchrone=synchrone):
+                premiere = self.lire("/api/produits/", synchrone=synchrone)
+                etag = premiere["ETag"]
+                self.assertEqual(
+                    self.lire("/api/produits/", etag, synchrone).status_code, 304
+                )
+                with self.captureOnCommitCallbacks(execute=True):
+                    reponse = self.admin.patch(
+                        f"/api/produits/{self.produit.pk}/",
+                        {"nom": f"Renommé {synchrone}"},
+                    )
+                self.assertEqual(reponse.status_code, 200)
+
+                # L'ETag du client ne correspond plus : réponse complète
+                seconde = self.lire("/api/produits/", etag, synchrone)
+                self.assertEqual(seconde.status_code, 200)
+                self.assertNotEqual(seconde["ETag"], etag)
+                self.assertEqual(
+                    json.loads(seconde.content)["results"][0]["nom"],
+                    f"Renommé {synchrone}",
+                )
+                # Puis 304 avec le nouvel ETag
+                self.assertEqual(
+                    self.lire("/api/produits/", seconde["ETag"], synchrone).status_code,
+                    304,
+                )
+
+    def test_version_par_modele(self):
+        produits = self.lire("/api/produits/")["ETag"]
+        categories = self.client.get("/api/categories/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Categorie.objects.create(nom="Jeux", description="")
+        self.assertEqual(self.lire("/api/produits/")["ETag"], produits)
+        nouvelles = self.client.get("/api/categories/", HTTP_IF_NONE_MATCH=categories)
+        self.assertEqual(nouvelles.status_code, 200)
+        self.assertEqual(len(nouvelles.json()["results"]), 2)
+
+    def test_variantes_image_invalident_le_cache(self):
+        url = f"/api/produits/{self.produit.pk}/"
+        etag = self.lire(url)["ETag"]
+        variantes = {"source": "produits/test.png", "miniature": "produits/m.webp"}
+        with (
+            mock.patch("api.tasks.generer_variantes", return_value=variantes),
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            generer_variantes_image(self.produit.pk)
+        reponse = self.lire(url, etag)
+        self.assertEqual(reponse.status_code, 200)
+        self.assertIn("miniature", reponse.json()["variantes"])
+
+
+@override_settings(CACHES=CACHE_LOCAL)
+class VariantesImageTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        reglages = override_settings(MEDIA_ROOT=media.name)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        cache.clear()
+
+    def test_variantes_webp_sans_metadonnees(self):
+        exif = Image.Exif()
+        exif[0x010F] = "Appareil photo"
+        photo = BytesIO()
+        Image.new("RGB", (1600, 1200), "red").save(photo, "JPEG", exif=exif)
+        produit = Produit.objects.create(
+            categorie=Categorie.objects.create(nom="Logiciels", description=""),
+            nom="Produit",
+            description="",
+            image=SimpleUploadedFile("photo.jpg", photo.getvalue()),
+            prix_min=1,
+            prix=10,
+            prix_max=100,
+        )
+        self.assertEqual(produit.variantes, {})
+
+        generer_variantes_image(produit.pk)
+        produit.refresh_from_db()
+        self.assertEqual(produit.variantes["source"], produit.image.name)
+        for nom, taille in (("miniature", (200, 200)), ("800w", (800, 600))):
+            with default_storage.open(produit.variantes[nom]) as fichier:
+                with Image.open(fichier) as variante:
+                    self.assertEqual(variante.format, "WEBP")
+                    self.assertEqual(variante.size, taille)
+                    self.assertNotIn("exif", variante.info)
+
+        reponse = self.client.get("/api/produits/?fields=id,variantes")
+        variantes = reponse.json()["results"][0]["variantes"]
+        self.assertEqual(set(variantes), {"miniature", "400w", "800w", "1200w"})
+        self.assertTrue(variantes["400w"].startswith("http://testserver/media/"))
+
+
+class AuthentificationCacheTests(CommandeTestCase):
+    def setUp(self):
+        super().setUp()
+        reponse = self.client.post(
+            "/api/token/", {"username": "vendeur", "password": "x"}
+        )
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f"Bearer {reponse.json()['access']}")
+
+    def requetes_utilisateur(self):
+        with CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(self.api.get("/api/cles/").status_code, 200)
+        return [r for r in requetes if '"api_utilisateur"' in r["sql"]]
+
+    def test_utilisateur_lu_une_fois(self):
+        self.assertEqual(len(self.requetes_utilisateur()), 1)
+        self.assertEqual(self.requetes_utilisateur(), [])
+
+    def test_modification_de_l_utilisateur(self):
+        self.requetes_utilisateur()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vendeur.nom_complet = "Vendeur renommé"
+            self.vendeur.save()
+        self.assertEqual(len(self.requetes_utilisateur()), 1)
+
+        # Token émis avec l'ancien rôle
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vendeur.role = "admin"
+            self.vendeur.save()
+        self.assertEqual(self.api.get("/api/cles/").status_code, 401)
+
+    def test_seuls_les_champs_utiles_en_cache(self):
+        self.requetes_utilisateur()
+        _, champs = cache.get(cle_utilisateur(self.vendeur.pk))
+        self.assertEqual(
+            champs, {"id": self.vendeur.pk, "role": "vendeur", "is_active": True}
+        )
+
+        jeton = AccessToken.for_user(self.vendeur)
+        utilisateur = CachedJWTAuthentication().get_user(jeton)
+        self.assertEqual(utilisateur.get_deferred_fields() & {"password"}, {"password"})
+        # Les autres champs restent lisibles, en base
+        self.assertEqual(utilisateur.nom_complet, "Vendeur")
+
+
+class ListeNoireJetonsTests(CommandeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.post("/api/token/", {"username": "vendeur", "password": "x"})
+
+    def rafraichir(self):
+        return self.client.post("/api/refresh/")
+
+    def test_rotation_et_deconnexion(self):
+        self.assertFalse(OutstandingToken.objects.exists())
+        ancien = self.client.cookies["refresh_token"].value
+
+        reponse = self.rafraichir()
+        self.assertEqual(reponse.status_code, 200)
+        self.assertIn("access", reponse.json())
+        nouveau = self.client.cookies["refresh_token"].value
+        self.assertNotEqual(nouveau, ancien)
+
+        # L'ancien refresh token ne sert qu'une fois
+        self.client.cookies["refresh_token"] = ancien
+        self.assertEqual(self.rafraichir().status_code, 401)
+
+        self.client.cookies["refresh_token"] = nouveau
+        acces = {"Authorization": f"Bearer {reponse.json()['access']}"}
+        self.assertEqual(
+            self.client.post("/api/logout/", headers=acces).status_code, 200
+        )
+        self.client.cookies["refresh_token"] = nouveau
+        self.assertEqual(self.rafraichir().status_code, 401)
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+    def test_purge_des_tables(self):
+        jeton = RefreshTokenRedis.for_user(self.vendeur)
+        revoque = OutstandingToken.objects.create(
+            user=self.vendeur,
+            jti=jeton["jti"],
+            token=str(jeton),
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+        BlacklistedToken.objects.create(token=revoque)
+        OutstandingToken.objects.create(
+            jti=uuid4().hex, token="", expires_at=timezone.now() - timedelta(days=1)
+        )
+
+        self.assertEqual(purger_jetons(), (1, 3))
+        self.assertTrue(est_revoque(jeton["jti"]))
+        self.assertFalse(OutstandingToken.objects.exists())
+
+
+@override_settings(
+    LIMITES_DEBIT={
+        "connexion": {"anonyme": "2/min"},
+        "catalogue": {"anonyme": "3/min", "vendeur": None},
+    }
+)
+class LimitationDebitTests(CommandeTestCase):
+    def test_connexion_limitee_par_adresse(self):
+        for _ in range(2):
+            reponse = self.client.post(
+                "/api/token/", {"username": "vendeur", "password": "mauvais"}
+            )
+            self.assertEqual(reponse.status_code, 401)
+        reponse = self.client.post(
+            "/api/token/", {"username": "vendeur", "password": "x"}
+        )
+        self.assertEqual(reponse.status_code, 429)
+        # Un jeton toutes les 30 secondes, moins le temps écoulé
+        self.assertIn(int(reponse["Retry-After"]), range(1, 31))
+
+        autre = self.client.post(
+            "/api/token/",
+            {"username": "vendeur", "password": "x"},
+            REMOTE_ADDR="10.0.0.2",
+        )
+        self.assertEqual(autre.status_code, 200)
+
+    def test_x_forwarded_for_ignore(self):
+        # Sans proxy de confiance, l'en-tête ne change pas le seau du client
+        for numero in range(3):
+            reponse = self.client.post(
+                "/api/token/",
+                {"username": "vendeur", "password": "mauvais"},
+                HTTP_X_FORWARDED_FOR=f"203.0.113.{numero}",
+            )
+        self.assertEqual(reponse.status_code, 429)
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "NUM_PROXIES": 1})
+    def test_x_forwarded_for_derriere_proxy(self):
+        # Le proxy ajoute l'adresse du client en fin d'en-tête : ce qui
+        # précède, fourni par le client, est ignoré
+        for numero in range(3):
+            reponse = self.client.post(
+                "/api/token/",
+                {"username": "vendeur", "password": "mauvais"},
+                HTTP_X_FORWARDED_FOR=f"203.0.113.{numero}, 198.51.100.7",
+            )
+        self.assertEqual(reponse.status_code, 429)
+        autre = self.client.post(
+            "/api/token/",
+            {"username": "vendeur", "password": "mauvais"},
+            HTTP_X_FORWARDED_FOR="198.51.100.8",
+        )
+        self.assertEqual(autre.status_code, 401)
+
+    def test_debit_par_role(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get("/api/produits/").status_code, 200)
+        self.assertEqual(self.client.get("/api/produits/").status_code, 429)
+        # Vue synchrone, et rôle sans limite
+        for _ in range(4):
+            self.assertEqual(self.api.get("/api/produits/search/?q=x").status_code, 200)
+
+
+class InstrumentationTests(CommandeTestCase):
+    def requete(self, **reglages):
+        with override_settings(**reglages):
+            # Le middleware lit ses réglages au premier appel du client
+            api = APIClient()
+            api.force_authenticate(self.vendeur)
+            with self.assertLogs("api.instrumentation") as journal:
+                reponse = api.get("/api/actions/historique/")
+        self.assertEqual(reponse.status_code, 200)
+        return reponse, [json.loads(ligne.split(":", 2)[2]) for ligne in journal.output]
+
+    def test_requete_echantillonnee(self):
+        self.commander()
+        reponse, (ligne,) = self.requete(INSTRUMENTATION_ECHANTILLON=1.0)
+        mesures = dict(
+            element.split(";dur=") for element in reponse["Server-Timing"].split(", ")
+        )
+        self.assertEqual(
+            list(mesures), ["db", "serialisation", "rendu", "app", "total"]
+        )
+        self.assertIn('desc="', mesures["db"])
+        self.assertEqual(ligne["vue"], "action-list")
+        self.assertGreater(ligne["requetes"], 0)
+        self.assertGreater(ligne["serialisation_ms"], 0)
+        self.assertGreater(ligne["rendu_ms"], 0)
+        self.assertLessEqual(
+            ligne["db_ms"]
+            + ligne["serialisation_ms"]
+            + ligne["rendu_ms"]
+            + ligne["app_ms"],
+            ligne["total_ms"] + 0.05,
+        )
+
+    def test_requete_hors_echantillon(self):
+        reponse, (ligne,) = self.requete(
+            INSTRUMENTATION_ECHANTILLON=0.0, INSTRUMENTATION_SEUIL_LENT=0
+        )
+        self.assertNotIn("Server-Timing", reponse)
+        # Journalisée seulement parce que plus lente que le seuil
+        self.assertEqual(
+            set(ligne) - {"vue", "methode", "chemin", "statut"}, {"total_ms"}
+        )
+
+        with override_settings(
+            INSTRUMENTATION_ECHANTILLON=0.0, INSTRUMENTATION_SEUIL_LENT=60_000
+        ):
+            with self.assertNoLogs("api.instrumentation"):
+                reponse = APIClient().get("/api/categories/")
+        self.assertNotIn("Server-Timing", reponse)
+
+
+class MetriquesTests(CommandeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.utiliser_redis(REDIS_TESTS)
+
+    def utiliser_redis(self, url):
+        reglages = override_settings(METRIQUES_URL=url, METRIQUES_JETON="secret")
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        metriques._client = None
+        self.addCleanup(setattr, metriques, "_client", None)
+
+    def lignes(self, prefixe):
+        return [
+            ligne
+            for ligne in metriques.exporter().splitlines()
+            if ligne.startswith(prefixe)
+        ]
+
+    def test_histogramme_cumule(self):
+        for duree in (0.003, 0.02, 0.02, 100):
+            RESERVATION_CLES.observer(duree, resultat="ok")
+        lignes = self.lignes("ejlogiciel_reservation_cles_secondes")
+        self.assertIn(
+            'ejlogiciel_reservation_cles_secondes_bucket{resultat="ok",le="0.005"} 1',
+            lignes,
+        )
+        self.assertIn(
+            'ejlogiciel_reservation_cles_secondes_bucket{resultat="ok",le="0.025"} 3',
+            lignes,
+        )
+        self.assertIn(
+            'ejlogiciel_reservation_cles_secondes_bucket{resultat="ok",le="30"} 3',
+            lignes,
+        )
+        self.assertIn(
+            'ejlogiciel_reservation_cles_secondes_bucket{resultat="ok",le="+Inf"} 4',
+            lignes,
+        )
+        self.assertIn(
+            'ejlogiciel_reservation_cles_secondes_count{resultat="ok"} 4', lignes
+        )
+        self.assertIn(
+            'ejlogiciel_reservation_cles_secondes_sum{resultat="ok"} 100.043', lignes
+        )
+
+    def test_echappement_des_etiquettes(self):
+        ACTIONS_CREEES.inc(type='a"b\\c\nd')
+        self.assertIn(
+            'ejlogiciel_actions_creees_total{type="a\\"b\\\\c\\nd"} 1',
+            self.lignes("ejlogiciel_actions_creees_total"),
+        )
+        with self.assertRaises(ValueError):
+            ACTIONS_CREEES.inc(produit="x")
+
+    def test_acces_reserve(self):
+        api = APIClient()
+        self.assertEqual(api.get("/api/metrics/").status_code, 401)
+        reponse = api.get("/api/metrics/", HTTP_AUTHORIZATION="Jeton autre")
+        self.assertEqual(reponse.status_code, 401)
+        api.force_authenticate(self.vendeur)
+        self.assertEqual(api.get("/api/metrics/").status_code, 403)
+
+        reponse = APIClient().get("/api/metrics/", HTTP_AUTHORIZATION="Jeton secret")
+        self.assertEqual(reponse.status_code, 200)
+        self.assertTrue(reponse["Content-Type"].startswith("text/plain; version=0.0.4"))
+        texte = reponse.content.decode()
+        self.assertIn("# TYPE ejlogiciel_actions_creees_total counter", texte)
+        self.assertIn("ejlogiciel_metriques_redis_disponible 1", texte)
+        self.assertIn(
+            f'ejlogiciel_cles_disponibles{{produit="Produit",produit_id="{self.produit.pk}"}} 5',
+            texte,
+        )
+
+    def test_redis_indisponible(self):
+        self.utiliser_redis("redis://127.0.0.1:1/0")
+        with self.assertLogs("api.metriques", "WARNING"):
+            reponse = APIClient().get(
+                "/api/metrics/", HTTP_AUTHORIZATION="Jeton secret"
+            )
+        self.assertEqual(reponse.status_code, 200)
+        texte = reponse.content.decode()
+        self.assertIn("ejlogiciel_metriques_redis_disponible 0", texte)
+        self.assertIn("ejlogiciel_cles_disponibles{", texte)
+        self.assertNotIn("ejlogiciel_actions_creees_total", texte)
+
+
+class RouteurRepliqueTests(SimpleTestCase):
+    def base_lue(self, methode, vue=ProduitListCreateAPIView, principale=False):
+        def get_response(request):
+            # Appelé par le gestionnaire de Django une fois la vue résolue
+            middleware.process_view(request, vue.as_view(), (), {})
+            if principale:
+                with lecture_principale():
+                    return RouteurReplique().db_for_read(Produit)
+            return RouteurReplique().db_for_read(Produit)
+
+        middleware = RepliqueMiddleware(get_response)
+        return middleware(RequestFactory().generic(methode, "/"))
+
+    def test_lectures_des_requetes_get(self):
+        self.assertEqual(self.base_lue("GET"), "replica")
+        self.assertEqual(self.base_lue("HEAD"), "replica")
+        self.assertEqual(self.base_lue("GET", DashboardStatsAPIView), "replica")
+        self.assertIsNone(self.base_lue("POST"))
+        self.assertIsNone(self.base_lue("GET", principale=True))
+        # Hors requête (tâches, commandes)
+        self.assertIsNone(RouteurReplique().db_for_read(Produit))
+
+    def test_lecture_apres_ecriture_sur_la_principale(self):
+        for vue in (CommandeDetailAPIView, ActionDetailAPIView, ActionListAPIView):
+            self.assertIsNone(self.base_lue("GET", vue))
+
+    @override_settings(
+        MIDDLEWARE=[*settings.MIDDLEWARE, "api.replique.RepliqueMiddleware"]
+    )
+    async def test_vues_sous_asgi(self):
+        lues = {}
+
+        def dispatch(vue, request, *args, **kwargs):
+            lues[type(vue)] = RouteurReplique().db_for_read(Produit)
+            return HttpResponse()
+
+        async def adispatch(vue, request, *args, **kwargs):
+            return dispatch(vue, request)
+
+        with (
+            mock.patch.object(CatalogueAsyncView, "dispatch", adispatch),
+            mock.patch.object(CommandeDetailAPIView, "dispatch", dispatch),
+        ):
+            await self.async_client.get("/api/produits/")
+            await self.async_client.get("/api/commandes/1/")
+        self.assertEqual(
+            lues, {CatalogueAsyncView: "replica", CommandeDetailAPIView: None}
+        )
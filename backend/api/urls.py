@@ -2,63 +2,98 @@ from django.urls import path
 
 from .views import (
     ClientSignUpAPIView,
-    CustomTokenObtainPairView,
-    CustomTokenRefreshView,
-    LogoutView,
     CategorieListCreateAPIView,
     RetrieveUpdateDestroyCategoryAPIView,
     ProduitListCreateAPIView,
     RetrieveUpdateDestroyProduitAPIView,
+    ProduitRechercheAPIView,
+    StockProduitListAPIView,
     MethodePaiementListCreateAPIView,
     MethodePaiementDetailAPIView,
     CleListCreateAPIView,
+    CleImportAPIView,
     RetrieveUpdateDestroyCleAPIView,
     ActionCreateAPIView,
+    ActionListAPIView,
+    ActionDetailAPIView,
+    CommandeDetailAPIView,
     DashboardStatsAPIView,
+    EmailEchecStatsAPIView,
+    MetriquesAPIView,
+)
+from .vues_async import (
+    CatalogueAsyncView,
+    ConnexionAsyncView,
+    DeconnexionAsyncView,
+    RafraichissementAsyncView,
 )
 
 urlpatterns = [
     # Authentication
     path("signup/", ClientSignUpAPIView.as_view(), name="signup"),
-    path("token/", CustomTokenObtainPairView.as_view(), name="login"),
-    path("refresh/", CustomTokenRefreshView.as_view(), name="refresh"),
-    path("logout/", LogoutView.as_view(), name="logout"),
+    path("token/", ConnexionAsyncView.as_view(), name="login"),
+    path("refresh/", RafraichissementAsyncView.as_view(), name="refresh"),
+    path("logout/", DeconnexionAsyncView.as_view(), name="logout"),
     # Produits
-    path("produits/", ProduitListCreateAPIView.as_view(), name="produit-list-create"),
+    path(
+        "produits/",
+        CatalogueAsyncView.as_view(vue_drf=ProduitListCreateAPIView),
+        name="produit-list-create",
+    ),
+    path("produits/stock/", StockProduitListAPIView.as_view(), name="produit-stock"),
+    path(
+        "produits/search/",
+        ProduitRechercheAPIView.as_view(),
+        name="produit-search",
+    ),
     path(
         "produits/<int:pk>/",
-        RetrieveUpdateDestroyProduitAPIView.as_view(),
+        CatalogueAsyncView.as_view(vue_drf=RetrieveUpdateDestroyProduitAPIView),
         name="produit-retrieve-update-destroy",
     ),
     # Clés
     path("cles/", CleListCreateAPIView.as_view(), name="cle-list-create"),
+    path("cles/import/", CleImportAPIView.as_view(), name="cle-import"),
     path(
         "cles/<int:pk>/", RetrieveUpdateDestroyCleAPIView.as_view(), name="cle-detail"
     ),
     # Categories
     path(
         "categories/",
-        CategorieListCreateAPIView.as_view(),
+        CatalogueAsyncView.as_view(vue_drf=CategorieListCreateAPIView),
         name="categorie-list-create",
     ),
     path(
         "categories/<int:pk>/",
-        RetrieveUpdateDestroyCategoryAPIView.as_view(),
+        CatalogueAsyncView.as_view(vue_drf=RetrieveUpdateDestroyCategoryAPIView),
         name="categorie-retrieve-update-destroy",
     ),
     # Methode Paiement
     path(
         "methode-paiement/",
-        MethodePaiementListCreateAPIView.as_view(),
+        CatalogueAsyncView.as_view(vue_drf=MethodePaiementListCreateAPIView),
         name="methode-paiement-list-create",
     ),
     path(
         "methode-paiement/<int:pk>/",
-        MethodePaiementDetailAPIView.as_view(),
+        CatalogueAsyncView.as_view(vue_drf=MethodePaiementDetailAPIView),
         name="methode-paiement-detail",
     ),
     # action
     path("actions/", ActionCreateAPIView.as_view(), name="action-create"),
+    path("actions/historique/", ActionListAPIView.as_view(), name="action-list"),
+    path("actions/<int:pk>/", ActionDetailAPIView.as_view(), name="action-detail"),
+    path(
+        "commandes/<int:pk>/",
+        CommandeDetailAPIView.as_view(),
+        name="commande-detail",
+    ),
     # stats
     path("stats/", DashboardStatsAPIView.as_view(), name="dashboard-stats"),
+    path(
+        "emails/echecs/stats/",
+        EmailEchecStatsAPIView.as_view(),
+        name="email-echec-stats",
+    ),
+    path("metrics/", MetriquesAPIView.as_view(), name="metrics"),
 ]
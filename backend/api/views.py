@@ -1,20 +1,53 @@
-from datetime import datetime, timedelta
+import codecs
+from datetime import timedelta
 
+from django.conf import settings
 from django.db import transaction
-from django.db.models import Sum, Count
+from django.db.models import F, Sum
+from django.http import HttpResponse
+from django.utils import timezone
+from django.urls import reverse
+from django.utils.dateparse import parse_date
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import (
     extend_schema,
     extend_schema_view,
     OpenApiParameter,
 )
 from rest_framework import generics
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import AllowAny
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
-from .custom_permissions import IsAdmin, IsAdminOrVendeur, IsVendeur
+from .cache import CatalogueCacheMixin
+from .champs import PARAMETRE_CHAMPS, ListeRapideMixin, champs_demandes
+from .commandes import (
+    CommandeInvalide,
+    creer_action,
+    mettre_en_attente,
+    valider_commande,
+)
+from .custom_permissions import (
+    IsAdmin,
+    IsAdminOrJetonMetriques,
+    IsAdminOrVendeur,
+    IsVendeur,
+)
+from .filters import ActionFilter
+from .idempotence import ENTETE as ENTETE_IDEMPOTENCE
+from .idempotence import PARAMETRE_IDEMPOTENCE, executer_une_fois
+from .import_cles import (
+    detecter_type_fichier,
+    importer_cles,
+    premiere_ligne_illisible,
+)
+from .instrumentation import SerialisationMesureeMixin
+from .jetons import revoquer_refresh
+from .metriques import exporter
 from .models import (
     Utilisateur,
     Produit,
@@ -22,19 +55,27 @@ from .models import (
     MethodePaiement,
     Cle,
     Action,
-    ElementAchatDevis,
+    StockCle,
+    CommandeEnAttente,
+    VenteJournaliere,
+    VenteProduitJournaliere,
+    VenteClientJournaliere,
 )
 from .serializers import (
     UserSerializer,
     ProduitSerializer,
     CategorieSerializer,
     MethodePaiementSerializer,
-    ActionSerializer,
-    ElementAchatDevisSerializer,
+    ActionHistoriqueSerializer,
     CleSerializer,
+    CommandeEnAttenteSerializer,
+    StockCleSerializer,
+    TokenRoleSerializer,
 )
-from .tasks import envoyer_cles_email_async, logger
-
+from .pagination import RecherchePagination
+from .recherche import rechercher_produits
+from .reprise_emails import statistiques_echecs
+from .tasks import logger
 
 # Authentification
 
@@ -45,12 +86,44 @@ from .tasks import envoyer_cles_email_async, logger
     description="Permet à un utilisateur de s'inscrire en tant que client.",
     responses={201: UserSerializer},
 )
-class ClientSignUpAPIView(generics.CreateAPIView):
+class ClientSignUpAPIView(SerialisationMesureeMixin, generics.CreateAPIView):
     permission_classes = [AllowAny]
+    throttle_scope = "inscription"
     queryset = Utilisateur.objects.all()
     serializer_class = UserSerializer
 
 
+def poser_cookie_refresh(response, refresh_token):
+    response.set_cookie(
+        key="refresh_token",
+        value=refresh_token,
+        httponly=True,
+        max_age=36000 * 24 * 7,
+        secure=True,
+    )
+
+
+def reponse_jetons(donnees, reponse=Response):
+    """
+    Réponse de connexion ou de rafraîchissement : l'access token dans le
+    corps, le refresh token en cookie. ``reponse`` construit la réponse (la
+    vue asynchrone passe une ``HttpResponse`` JSON).
+    """
+    donnees = dict(donnees)
+    refresh_token = donnees.pop("refresh")
+    response = reponse(donnees)
+    poser_cookie_refresh(response, refresh_token)
+    return response
+
+
+def reponse_deconnexion(request, reponse=Response):
+    """Révoque le refresh token du cookie et supprime celui-ci."""
+    revoquer_refresh(request.COOKIES.get("refresh_token"))
+    response = reponse({"detail": "Successfully logged out."})
+    response.delete_cookie("refresh_token")
+    return response
+
+
 @extend_schema(
     tags=["Authentication"],
     summary="Connexion utilisateur",
@@ -58,20 +131,17 @@ class ClientSignUpAPIView(generics.CreateAPIView):
     responses={200: {"type": "object", "properties": {"access": {"type": "string"}}}},
 )
 class CustomTokenObtainPairView(TokenObtainPairView):
-    """Endpoint pour obtenir un token d'authentification JWT."""
+    """
+    Endpoint pour obtenir un token d'authentification JWT. Servi par
+    ``ConnexionAsyncView`` (voir ``vues_async``) : cette vue porte la
+    configuration et la documentation.
+    """
+
+    serializer_class = TokenRoleSerializer
+    throttle_scope = "connexion"
 
     def post(self, request: Request, *args, **kwargs) -> Response:
-        res: Response = super().post(request, *args, **kwargs)
-        refresh_token = res.data.pop("refresh")
-
-        res.set_cookie(
-            key="refresh_token",
-            value=refresh_token,
-            httponly=True,
-            max_age=36000 * 24 * 7,
-            secure=True,
-        )
-        return res
+        return reponse_jetons(super().post(request, *args, **kwargs).data)
 
 
 @extend_schema(
@@ -84,36 +154,35 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     },
 )
 class CustomTokenRefreshView(TokenRefreshView):
-    """Endpoint pour rafraîchir un token d'authentification JWT."""
+    """
+    Endpoint pour rafraîchir un token d'authentification JWT. Servi par
+    ``RafraichissementAsyncView``.
+    """
+
+    throttle_scope = "rafraichissement"
 
     def post(self, request: Request, *args, **kwargs) -> Response:
         request._full_data = {"refresh": request.COOKIES.get("refresh_token")}
-        res: Response = super().post(request, *args, **kwargs)
-        refresh_token = res.data.pop("refresh")
-
-        res.set_cookie(
-            key="refresh_token",
-            value=refresh_token,
-            httponly=True,
-            max_age=36000 * 24 * 7,
-            secure=True,
-        )
-        return res
+        return reponse_jetons(super().post(request, *args, **kwargs).data)
 
 
 @extend_schema(
     tags=["Authentication"],
     summary="Déconnexion",
-    description="Déconnecte l'utilisateur en supprimant le refresh token.",
+    description=(
+        "Déconnecte l'utilisateur : le refresh token est révoqué et son cookie "
+        "supprimé."
+    ),
     responses={200: {"description": "Déconnexion réussie"}},
 )
 class LogoutView(APIView):
-    """Endpoint pour déconnecter un utilisateur."""
+    """
+    Endpoint pour déconnecter un utilisateur. Servi par
+    ``DeconnexionAsyncView``.
+    """
 
     def post(self, request: Request, *args, **kwargs) -> Response:
-        response = Response({"detail": "Successfully logged out."})
-        response.delete_cookie("refresh_token")
-        return response
+        return reponse_deconnexion(request)
 
 
 # Produits
@@ -141,6 +210,7 @@ class LogoutView(APIView):
                 required=False,
                 type=float,
             ),
+            PARAMETRE_CHAMPS,
         ],
     ),
     create=extend_schema(
@@ -149,7 +219,13 @@ class LogoutView(APIView):
         description="Crée un nouveau produit (réservé aux administrateurs).",
     ),
 )
-class ProduitListCreateAPIView(generics.ListCreateAPIView):
+class ProduitListCreateAPIView(
+    CatalogueCacheMixin,
+    ListeRapideMixin,
+    SerialisationMesureeMixin,
+    generics.ListCreateAPIView,
+):
+    cache_modeles = [Produit]
     serializer_class = ProduitSerializer
     filterset_fields = ["categorie", "prix"]
     ordering_fields = ["nom", "prix"]
@@ -169,6 +245,7 @@ class ProduitListCreateAPIView(generics.ListCreateAPIView):
         tags=["Produits"],
         summary="Récupère un produit",
         description="Récupère les détails d'un produit spécifique.",
+        parameters=[PARAMETRE_CHAMPS],
     ),
     update=extend_schema(
         tags=["Produits"],
@@ -181,7 +258,13 @@ class ProduitListCreateAPIView(generics.ListCreateAPIView):
         description="Supprime un produit (réservé aux administrateurs).",
     ),
 )
-class RetrieveUpdateDestroyProduitAPIView(generics.RetrieveUpdateDestroyAPIView):
+class RetrieveUpdateDestroyProduitAPIView(
+    CatalogueCacheMixin,
+    ListeRapideMixin,
+    SerialisationMesureeMixin,
+    generics.RetrieveUpdateDestroyAPIView,
+):
+    cache_modeles = [Produit]
     serializer_class = ProduitSerializer
     lookup_field = "pk"
 
@@ -194,6 +277,71 @@ class RetrieveUpdateDestroyProduitAPIView(generics.RetrieveUpdateDestroyAPIView)
         return Produit.objects.all()
 
 
+@extend_schema(
+    tags=["Produits"],
+    summary="Recherche de produits",
+    description="Recherche plein texte dans le nom et la description des produits, "
+    "triée par pertinence. Sans résultat, la recherche devient approchée "
+    "(fautes de frappe, débuts de mots).",
+    parameters=[
+        OpenApiParameter(
+            name="q",
+            description="Texte recherché (guillemets, -mot et or acceptés)",
+            required=True,
+            type=str,
+        ),
+        OpenApiParameter(
+            name="categorie",
+            description="Filtrer par ID de catégorie",
+            required=False,
+            type=int,
+        ),
+        PARAMETRE_CHAMPS,
+    ],
+)
+class ProduitRechercheAPIView(
+    CatalogueCacheMixin, SerialisationMesureeMixin, generics.ListAPIView
+):
+    cache_modeles = [Produit]
+    permission_classes = [AllowAny]
+    serializer_class = ProduitSerializer
+    filterset_fields = ["categorie"]
+    pagination_class = RecherchePagination
+
+    def get_queryset(self):
+        return Produit.objects.all()
+
+    def filter_queryset(self, queryset):
+        texte = self.request.query_params.get("q", "").strip()
+        if not texte:
+            raise ValidationError({"q": "Ce paramètre est obligatoire."})
+        # Filtres d'abord : le passage à la recherche approchée en dépend
+        queryset = rechercher_produits(super().filter_queryset(queryset), texte)
+        return queryset.order_by("-pertinence", "id")
+
+
+@extend_schema(
+    tags=["Produits"],
+    summary="Stock de clés par produit",
+    description="Retourne le nombre de clés disponibles pour chaque produit.",
+    parameters=[
+        OpenApiParameter(
+            name="produit",
+            description="Filtrer par ID de produit",
+            required=False,
+            type=int,
+        ),
+    ],
+)
+class StockProduitListAPIView(SerialisationMesureeMixin, generics.ListAPIView):
+    permission_classes = [AllowAny]
+    serializer_class = StockCleSerializer
+    filterset_fields = ["produit"]
+
+    def get_queryset(self):
+        return StockCle.objects.a_jour()
+
+
 # cle
 @extend_schema_view(
     list=extend_schema(
@@ -213,6 +361,7 @@ class RetrieveUpdateDestroyProduitAPIView(generics.RetrieveUpdateDestroyAPIView)
                 required=False,
                 type=bool,
             ),
+            PARAMETRE_CHAMPS,
         ],
     ),
     create=extend_schema(
@@ -221,7 +370,9 @@ class RetrieveUpdateDestroyProduitAPIView(generics.RetrieveUpdateDestroyAPIView)
         description="Crée une nouvelle clé (réservé aux administrateurs).",
     ),
 )
-class CleListCreateAPIView(generics.ListCreateAPIView):
+class CleListCreateAPIView(
+    ListeRapideMixin, SerialisationMesureeMixin, generics.ListCreateAPIView
+):
     serializer_class = CleSerializer
     filterset_fields = ["produit", "disponiblite"]
     ordering_fields = ["produit", "disponiblite"]
@@ -241,6 +392,7 @@ class CleListCreateAPIView(generics.ListCreateAPIView):
         tags=["Clés"],
         summary="Récupère une clé",
         description="Récupère les détails d'une clé spécifique.",
+        parameters=[PARAMETRE_CHAMPS],
     ),
     update=extend_schema(
         tags=["Clés"],
@@ -253,7 +405,9 @@ class CleListCreateAPIView(generics.ListCreateAPIView):
         description="Supprime une clé (réservé aux administrateurs).",
     ),
 )
-class RetrieveUpdateDestroyCleAPIView(generics.RetrieveUpdateDestroyAPIView):
+class RetrieveUpdateDestroyCleAPIView(
+    ListeRapideMixin, SerialisationMesureeMixin, generics.RetrieveUpdateDestroyAPIView
+):
     serializer_class = CleSerializer
     lookup_field = "pk"
 
@@ -266,6 +420,56 @@ class RetrieveUpdateDestroyCleAPIView(generics.RetrieveUpdateDestroyAPIView):
         return Cle.objects.all()
 
 
+@extend_schema(
+    tags=["Clés"],
+    summary="Importe des clés en masse",
+    description="Importe un fichier CSV ou JSONL de clés (réservé aux administrateurs). "
+    "Chaque ligne contient 'contenue' et, si besoin, 'produit' et 'validite'.",
+    request={
+        "multipart/form-data": {
+            "type": "object",
+            "properties": {
+                "fichier": {"type": "string", "format": "binary"},
+                "type_fichier": {"type": "string", "enum": ["csv", "jsonl"]},
+                "produit": {"type": "integer"},
+                "validite": {"type": "string"},
+            },
+            "required": ["fichier"],
+        }
+    },
+    responses={
+        200: {"description": "Rapport d'import (créées, doublons, erreurs par ligne)"},
+        400: {"description": "Fichier manquant ou non encodé en UTF-8"},
+    },
+)
+class CleImportAPIView(APIView):
+    permission_classes = [IsAdmin]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request: Request, *args, **kwargs) -> Response:
+        fichier = request.FILES.get("fichier")
+        if fichier is None:
+            return Response({"error": "Le fichier est requis."}, status=400)
+
+        ligne = premiere_ligne_illisible(fichier)
+        if ligne is not None:
+            return Response(
+                {"error": f"Ligne {ligne} : le fichier doit être encodé en UTF-8."},
+                status=400,
+            )
+
+        type_fichier = request.data.get("type_fichier") or detecter_type_fichier(
+            fichier.name
+        )
+        rapport = importer_cles(
+            codecs.iterdecode(fichier, "utf-8-sig"),
+            type_fichier=type_fichier,
+            produit=request.data.get("produit"),
+            validite=request.data.get("validite"),
+        )
+        return Response(rapport)
+
+
 # Catégories
 @extend_schema_view(
     list=extend_schema(
@@ -279,7 +483,10 @@ class RetrieveUpdateDestroyCleAPIView(generics.RetrieveUpdateDestroyAPIView):
         description="Crée une nouvelle catégorie (réservé aux administrateurs).",
     ),
 )
-class CategorieListCreateAPIView(generics.ListCreateAPIView):
+class CategorieListCreateAPIView(
+    CatalogueCacheMixin, SerialisationMesureeMixin, generics.ListCreateAPIView
+):
+    cache_modeles = [Categorie]
     serializer_class = CategorieSerializer
 
     def get_permissions(self):
@@ -308,7 +515,12 @@ class CategorieListCreateAPIView(generics.ListCreateAPIView):
         description="Supprime une catégorie (réservé aux administrateurs).",
     ),
 )
-class RetrieveUpdateDestroyCategoryAPIView(generics.RetrieveUpdateDestroyAPIView):
+class RetrieveUpdateDestroyCategoryAPIView(
+    CatalogueCacheMixin,
+    SerialisationMesureeMixin,
+    generics.RetrieveUpdateDestroyAPIView,
+):
+    cache_modeles = [Categorie]
     permission_classes = [IsAdmin]
     queryset = Categorie.objects.all()
     serializer_class = CategorieSerializer
@@ -328,7 +540,10 @@ class RetrieveUpdateDestroyCategoryAPIView(generics.RetrieveUpdateDestroyAPIView
         description="Crée une nouvelle méthode de paiement (réservé aux administrateurs).",
     ),
 )
-class MethodePaiementListCreateAPIView(generics.ListCreateAPIView):
+class MethodePaiementListCreateAPIView(
+    CatalogueCacheMixin, SerialisationMesureeMixin, generics.ListCreateAPIView
+):
+    cache_modeles = [MethodePaiement]
     serializer_class = MethodePaiementSerializer
 
     def get_permissions(self):
@@ -357,7 +572,12 @@ class MethodePaiementListCreateAPIView(generics.ListCreateAPIView):
         description="Supprime une méthode de paiement (réservé aux administrateurs).",
     ),
 )
-class MethodePaiementDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
+class MethodePaiementDetailAPIView(
+    CatalogueCacheMixin,
+    SerialisationMesureeMixin,
+    generics.RetrieveUpdateDestroyAPIView,
+):
+    cache_modeles = [MethodePaiement]
     permission_classes = [IsAdmin]
     queryset = MethodePaiement.objects.all()
     serializer_class = MethodePaiementSerializer
@@ -393,167 +613,159 @@ class MethodePaiementDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
         400: {"description": "Données invalides ou pas assez de clés disponibles"},
         401: {"description": "Non authentifié"},
         403: {"description": "Permission refusée"},
+        409: {"description": "Requête de même clé d'idempotence en cours"},
+        422: {"description": "Clé d'idempotence déjà utilisée pour une autre requête"},
     },
+    parameters=[PARAMETRE_IDEMPOTENCE],
 )
 class ActionCreateAPIView(APIView):
     permission_classes = [IsAdminOrVendeur]
 
-    @transaction.atomic
     def post(self, request: Request, *args, **kwargs) -> Response:
-        action_data = request.data.get("action")
-        type_action = action_data.get("type", "").upper()
-        print(type_action)
-        produits_data = request.data.get("produits")
-
-        if not action_data or not produits_data:
-            return Response(
-                {"error": "Données incomplètes. Action et produits requis."}, status=400
-            )
-
-        if type_action not in ["ACHAT", "DEVIS"]:
-            return Response(
-                {"error": "Type d'action invalide. Doit être 'ACHAT' ou 'DEVIS'."},
-                status=400,
-            )
+        cle = request.headers.get(ENTETE_IDEMPOTENCE)
+        if cle is None:
+            return self.creer(request)
+        return executer_une_fois(request, cle, self.creer)
+
+    def creer(self, request: Request) -> Response:
+        try:
+            commande = valider_commande(request.data)
+            if traitement_differe(request):
+                commande_en_attente = mettre_en_attente(request.data, request.user)
+            else:
+                with transaction.atomic():
+                    return Response(creer_action(commande, request.user))
+        except CommandeInvalide as e:
+            return Response(e.erreurs, status=400)
+
+        url = reverse("commande-detail", args=[commande_en_attente.pk])
+        response = Response(
+            {
+                "detail": "Commande enregistrée, en attente de traitement.",
+                "commande_id": commande_en_attente.pk,
+                "statut": commande_en_attente.statut,
+                "url": url,
+            },
+            status=202,
+        )
+        response["Location"] = url
+        return response
 
-        # Préchargement des produits en une seule requête
-        produit_ids = [item["produit"] for item in produits_data]
-        produits_map = {
-            str(p.id): p for p in Produit.objects.filter(id__in=produit_ids)
-        }
 
-        if len(produits_map) != len(produit_ids):
-            return Response({"error": "Certains produits n'existent pas."}, status=400)
-
-        action_serializer = ActionSerializer(data=action_data)
-        if not action_serializer.is_valid():
-            return Response(action_serializer.errors, status=400)
-
-        # Pour les achats, vérifier la disponibilité des clés
-        if type_action == "ACHAT":
-            for item in produits_data:
-                produit_id = item["produit"]
-                produit = produits_map[str(produit_id)]
-                quantite = item.get("quantite", 1)
-
-                # Compter les clés disponibles pour ce produit
-                count = Cle.objects.filter(produit=produit, disponiblite=True).count()
-                if count < quantite:
-                    return Response(
-                        {
-                            "error": f"Pas assez de clés disponibles pour {produit.nom}. "
-                            f"Seulement {count} disponible(s) pour {quantite} demandée(s)."
-                        },
-                        status=400,
-                    )
+def traitement_differe(request):
+    """Mode asynchrone : activé pour toutes les commandes, ou demandé par le client."""
+    return settings.COMMANDES_ASYNC or "respond-async" in request.headers.get(
+        "Prefer", ""
+    )
 
-        action = action_serializer.save(vendeur=request.user)
 
-        elements_data = []
-        for item in produits_data:
-            item["action"] = action.id
-            elements_data.append(item)
+@extend_schema(
+    tags=["Actions"],
+    summary="Statut d'une commande asynchrone",
+    description="Indique si une commande reçue en mode asynchrone est en attente, "
+    "traitée (avec la réponse de la création de l'action) ou refusée (avec les "
+    "erreurs).",
+    responses={200: CommandeEnAttenteSerializer},
+)
+class CommandeDetailAPIView(SerialisationMesureeMixin, generics.RetrieveAPIView):
+    permission_classes = [IsAdminOrVendeur]
+    serializer_class = CommandeEnAttenteSerializer
 
-        elements_serializer = ElementAchatDevisSerializer(data=elements_data, many=True)
-        if not elements_serializer.is_valid():
-            return Response(elements_serializer.errors, status=400)
+    def get_queryset(self):
+        queryset = CommandeEnAttente.objects.all()
+        if self.request.user.role != "admin":
+            queryset = queryset.filter(vendeur=self.request.user)
+        return queryset
 
-        elements_serializer.save()
 
-        # Préparer les données pour l'email
-        cles_selectionnees = {}
+def actions_historique(request):
+    """Actions visibles par l'utilisateur, avec leurs objets liés préchargés."""
+    queryset = Action.objects.select_related("client", "vendeur", "methode_paiement")
+    champs = champs_demandes(request)
+    if champs is None or "elements" in champs:
+        queryset = queryset.prefetch_related("elements__produit")
+    if request.user.role not in ("admin", "vendeur"):
+        queryset = queryset.filter(client=request.user)
+    return queryset
 
-        if type_action == "ACHAT":
-            for item in produits_data:
-                produit_id = item["produit"]
-                produit = produits_map[str(produit_id)]
-                quantite = item.get("quantite", 1)
 
-                cles = Cle.objects.select_for_update().filter(
-                    produit=produit, disponiblite=True
-                )[:quantite]
+@extend_schema(
+    tags=["Actions"],
+    summary="Historique des actions",
+    description="Liste les achats et devis avec leurs lignes, du plus récent au plus "
+    "ancien. Un client ne voit que ses propres actions.",
+    parameters=[
+        OpenApiParameter(
+            name="date_debut",
+            description="Premier jour de la période (AAAA-MM-JJ)",
+            required=False,
+            type=OpenApiTypes.DATE,
+        ),
+        OpenApiParameter(
+            name="date_fin",
+            description="Dernier jour de la période, inclus (AAAA-MM-JJ)",
+            required=False,
+            type=OpenApiTypes.DATE,
+        ),
+        PARAMETRE_CHAMPS,
+    ],
+)
+class ActionListAPIView(SerialisationMesureeMixin, generics.ListAPIView):
+    serializer_class = ActionHistoriqueSerializer
+    filterset_class = ActionFilter
+    ordering = ["-date_action"]
 
-                cles_list = list(cles)
+    def get_queryset(self):
+        return actions_historique(self.request)
 
-                if len(cles_list) < quantite:
-                    logger.error(
-                        f"Race condition détectée: clés pour {produit.nom} non disponibles"
-                    )
-                    return Response(
-                        {
-                            "error": f"Pas assez de clés disponibles pour {produit.nom}. "
-                            f"Seulement {len(cles_list)} disponible(s) pour {quantite} demandée(s)."
-                        },
-                        status=400,
-                    )
-
-                if produit.nom not in cles_selectionnees:
-                    cles_selectionnees[produit.nom] = []
-
-                cle_ids = [cle.id for cle in cles_list]
-                Cle.objects.filter(id__in=cle_ids).update(disponiblite=False)
-
-                for cle in cles_list:
-                    cles_selectionnees[produit.nom].append(
-                        {
-                            "id": cle.id,
-                            "contenue": cle.contenue,
-                            "code_cle": cle.code_cle,
-                            "validite": cle.validite,
-                        }
-                    )
-
-        else:
-            for item in produits_data:
-                produit_id = item["produit"]
-                produit = produits_map[str(produit_id)]
-                quantite = item.get("quantite", 1)
-
-                cles_selectionnees[produit.nom] = []
-
-                for _ in range(quantite):
-                    cles_selectionnees[produit.nom].append(
-                        {
-                            "id": None,
-                            "contenue": "À attribuer lors de l'achat",
-                            "code_cle": "N/A",
-                            "validite": produit.validite,
-                        }
-                    )
-
-        client = Utilisateur.objects.get(id=action_data["client"])
-
-        # Envoyer l'email de manière asynchrone
-        envoyer_cles_email_async.delay(
-            client_id=client.id, action_id=action.id, cles_data=cles_selectionnees
-        )
 
-        message = "Action créée avec succès. "
-        if type_action == "ACHAT":
-            message += "Les clés ont été envoyées par email."
-        else:
-            message += "Le devis a été envoyé par email."
+@extend_schema(
+    tags=["Actions"],
+    summary="Récupère une action",
+    description="Récupère une action avec ses lignes. Un client ne peut lire que "
+    "ses propres actions.",
+    parameters=[PARAMETRE_CHAMPS],
+)
+class ActionDetailAPIView(SerialisationMesureeMixin, generics.RetrieveAPIView):
+    serializer_class = ActionHistoriqueSerializer
+    lookup_field = "pk"
 
-        return Response(
-            {
-                "detail": message,
-                "action_id": action.id,
-                "cles": cles_selectionnees,
-            }
-        )
+    def get_queryset(self):
+        return actions_historique(self.request)
 
 
 @extend_schema(
     tags=["Statistiques"],
     summary="Statistiques du tableau de bord",
-    description="Fournit des statistiques globales pour le tableau de bord administrateur.",
+    description="Fournit des statistiques globales pour le tableau de bord administrateur. "
+    "total_actions, les ventes et les classements sont lus dans les tables "
+    "journalières, actualisées toutes les 5 minutes : ils peuvent avoir jusqu'à "
+    "5 minutes de retard sur les actions. total_users et total_products sont exacts.",
+    parameters=[
+        OpenApiParameter(
+            name="from",
+            description="Premier jour de la période (AAAA-MM-JJ). "
+            "Par défaut : 30 jours pour les ventes, tout l'historique pour les classements.",
+            required=False,
+            type=OpenApiTypes.DATE,
+        ),
+        OpenApiParameter(
+            name="to",
+            description="Dernier jour de la période (AAAA-MM-JJ), par défaut aujourd'hui.",
+            required=False,
+            type=OpenApiTypes.DATE,
+        ),
+    ],
     responses={
         200: {
             "type": "object",
             "properties": {
                 "total_users": {"type": "integer"},
                 "total_products": {"type": "integer"},
-                "total_actions": {"type": "integer"},
+                "total_actions": {
+                    "type": "integer",
+                    "description": "Nombre d'actions, jusqu'à 5 minutes de retard",
+                },
                 "recent_sales": {
                     "type": "object",
                     "properties": {
@@ -561,6 +773,17 @@ class ActionCreateAPIView(APIView):
                         "count": {"type": "integer"},
                     },
                 },
+                "sales_per_day": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "jour": {"type": "string", "format": "date"},
+                            "total": {"type": "number"},
+                            "count": {"type": "integer"},
+                        },
+                    },
+                },
                 "top_products": {
                     "type": "array",
                     "items": {
@@ -583,40 +806,80 @@ class ActionCreateAPIView(APIView):
                     },
                 },
             },
-        }
+        },
+        400: {"description": "Dates invalides"},
     },
 )
 class DashboardStatsAPIView(APIView):
     """Fournit des statistiques pour le tableau de bord administrateur."""
 
     permission_classes = [IsAdmin]
+    lecture_replique = True
 
     def get(self, request):
-        today = datetime.today().date()
-        # Date d'il y a 30 jours
-        thirty_days_ago = today - timedelta(days=30)
+        bornes = []
+        for nom in ("from", "to"):
+            valeur = request.query_params.get(nom)
+            try:
+                borne = parse_date(valeur) if valeur else None
+            except ValueError:
+                borne = None
+            if valeur and borne is None:
+                bornes = None
+                break
+            bornes.append(borne)
+
+        if bornes is None or (None not in bornes and bornes[0] > bornes[1]):
+            return Response(
+                {"error": "Période invalide. Format attendu : AAAA-MM-JJ."},
+                status=400,
+            )
+
+        debut, fin = bornes
+        today = timezone.localdate()
+        fin = fin or today
+
+        periode = {"jour__lte": fin}
+        if debut:
+            periode["jour__gte"] = debut
 
         # Statistiques globales
         total_users = Utilisateur.objects.count()
         total_products = Produit.objects.count()
-        total_actions = Action.objects.count()
+        total_actions = (
+            VenteJournaliere.objects.aggregate(total=Sum("nombre_actions"))["total"]
+            or 0
+        )
 
-        # Ventes des 30 derniers jours
-        recent_sales = Action.objects.filter(
-            type="ACHAT", date_action__gte=thirty_days_ago
-        ).aggregate(total=Sum("prix"), count=Count("id"))
+        # Ventes de la période, ou des 30 derniers jours
+        ventes = VenteJournaliere.objects.filter(
+            type="achat",
+            jour__gte=debut or today - timedelta(days=30),
+            jour__lte=fin,
+        )
+        recent_sales = ventes.aggregate(
+            total=Sum("montant_total"), count=Sum("nombre_actions")
+        )
+        sales_per_day = ventes.order_by("jour").values(
+            "jour", total=F("montant_total"), count=F("nombre_actions")
+        )
 
         # Produits les plus vendus
         top_products = (
-            ElementAchatDevis.objects.values("produit__nom")
-            .annotate(total_sales=Count("id"))
+            VenteProduitJournaliere.objects.filter(**periode)
+            .values("produit__nom")
+            .annotate(total_sales=Sum("nombre_lignes"))
             .order_by("-total_sales")[:5]
         )
 
         # Clients les plus actifs
         top_clients = (
-            Action.objects.values("client__nom_complet")
-            .annotate(total_purchases=Count("id"), total_spent=Sum("prix"))
+            VenteClientJournaliere.objects.filter(**periode)
+            .values("client__nom_complet")
+            .annotate(
+                total_purchases=Sum("nombre_actions"),
+                total_spent=Sum("montant_total"),
+            )
             .order_by("-total_purchases")[:5]
         )
 
@@ -626,7 +889,74 @@ class DashboardStatsAPIView(APIView):
                 "total_products": total_products,
                 "total_actions": total_actions,
                 "recent_sales": recent_sales,
+                "sales_per_day": sales_per_day,
                 "top_products": top_products,
                 "top_clients": top_clients,
             }
         )
+
+
+@extend_schema(
+    tags=["Statistiques"],
+    summary="File des emails en échec",
+    description="Taille de la file des emails en échec et débit de leur reprise "
+    "automatique sur une période récente.",
+    parameters=[
+        OpenApiParameter(
+            name="minutes",
+            description="Période de calcul du débit, en minutes (60 par défaut).",
+            required=False,
+            type=int,
+        ),
+    ],
+    responses={
+        200: {
+            "type": "object",
+            "properties": {
+                "en_attente": {"type": "integer"},
+                "a_rejouer": {"type": "integer"},
+                "plus_ancien": {"type": "string", "format": "date-time"},
+                "nouveaux": {"type": "integer"},
+                "resolus": {"type": "integer"},
+                "periode_minutes": {"type": "integer"},
+                "debit_par_minute": {"type": "number"},
+            },
+        },
+        400: {"description": "Période invalide"},
+    },
+)
+class EmailEchecStatsAPIView(APIView):
+    permission_classes = [IsAdmin]
+    lecture_replique = True
+
+    def get(self, request):
+        try:
+            minutes = int(request.query_params.get("minutes", 60))
+        except ValueError:
+            minutes = 0
+        if not 0 < minutes <= 7 * 24 * 60:
+            return Response(
+                {"error": "Le paramètre 'minutes' doit être compris entre 1 et 10080."},
+                status=400,
+            )
+        return Response(statistiques_echecs(minutes))
+
+
+@extend_schema(
+    tags=["Statistiques"],
+    summary="Métriques Prometheus",
+    description="Compteurs et histogrammes de l'application (actions créées, "
+    "réservation des clés, envoi des emails) et jauges lues en base (clés "
+    "disponibles par produit, file des emails en échec), au format texte "
+    "Prometheus. Accessible aux administrateurs ou avec l'en-tête "
+    "« Authorization: Jeton <METRIQUES_JETON> ».",
+    responses={200: OpenApiTypes.STR},
+)
+class MetriquesAPIView(APIView):
+    permission_classes = [IsAdminOrJetonMetriques]
+    lecture_replique = True
+
+    def get(self, request):
+        return HttpResponse(
+            exporter(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
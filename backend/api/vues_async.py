@@ -0,0 +1,287 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import mixins, serializers
+from rest_framework.exceptions import APIException, AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import PasswordField, TokenObtainSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .authentification import CachedJWTAuthentication
+from .cache import alire_catalogue, entetes_catalogue
+from .champs import LecteurValeurs, ListeRapideMixin
+from .views import (
+    CustomTokenObtainPairView,
+    CustomTokenRefreshView,
+    LogoutView,
+    reponse_deconnexion,
+    reponse_jetons,
+)
+
+
+def _json(donnees, status=200):
+    return HttpResponse(
+        JSONRenderer().render(donnees), status=status, content_type="application/json"
+    )
+
+
+def _reponse_http(response):
+    """Réponse DRF (erreur) rendue en JSON, avec ses en-têtes."""
+    http = _json(response.data, response.status_code)
+    for nom, valeur in response.headers.items():
+        if nom != "Content-Type":
+            http[nom] = valeur
+    return http
+
+
+async def authentifier(request):
+    """
+    ``CachedJWTAuthentication.authenticate`` en asynchrone. Retourne
+    ``(utilisateur, jeton)`` ; sans en-tête ``Authorization``, l'utilisateur
+    est anonyme.
+    """
+    # APIClient.force_authenticate (tests), comme le fait rest_framework.Request
+    force = getattr(request, "_force_auth_user", None)
+    if force is not None:
+        return force, getattr(request, "_force_auth_token", None)
+
+    authentification = CachedJWTAuthentication()
+    entete = authentification.get_header(request)
+    brut = authentification.get_raw_token(entete) if entete is not None else None
+    if brut is None:
+        return AnonymousUser(), None
+
+    jeton = authentification.get_validated_token(brut)
+    return await authentification.aget_user(jeton), jeton
+
+
+class VueAsync(View):
+    """
+    Vue asynchrone adossée à une vue DRF synchrone (``vue_drf``).
+
+    La vue DRF fournit la configuration (queryset, serializer, permissions,
+    pagination) et la documentation OpenAPI ; les méthodes qui ne sont pas
+    réécrites en asynchrone lui sont déléguées dans un thread.
+    """
+
+    vue_drf = None
+    vue_sync = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        vue_drf = initkwargs.get("vue_drf", cls.vue_drf)
+        initkwargs["vue_sync"] = sync_to_async(vue_drf.as_view())
+        vue = csrf_exempt(super().as_view(**initkwargs))
+        # drf-spectacular documente les vues qui exposent leur classe DRF
+        vue.cls = vue_drf
+        vue.initkwargs = {}
+        return vue
+
+    async def deleguer(self, request, *args, **kwargs):
+        return await self.vue_sync(request, *args, **kwargs)
+
+    def preparer_vue_drf(self, request):
+        """Instance de ``vue_drf`` initialisée comme dans ``APIView.dispatch``."""
+        vue = self.vue_drf()
+        vue.args, vue.kwargs = self.args, self.kwargs
+        vue.format_kwarg = None
+        vue.request = vue.initialize_request(request)
+        vue.headers = vue.default_response_headers
+        return vue
+
+    async def authentifier(self, vue):
+        requete = vue.request
+        requete.user, requete.auth = await authentifier(requete._request)
+        # Lu par permission_denied pour choisir entre 401 et 403
+        requete._authenticator = (
+            requete.authenticators[0] if requete.user.is_authenticated else None
+        )
+        vue.check_permissions(requete)
+        await self.limiter(vue)
+
+    async def limiter(self, vue):
+        """``APIView.check_throttles``, les limites s'exécutant dans un thread."""
+        attentes = []
+        for limite in vue.get_throttles():
+            if not await sync_to_async(limite.allow_request)(vue.request, vue):
+                attentes.append(limite.wait())
+        if attentes:
+            attentes = [attente for attente in attentes if attente is not None]
+            vue.throttled(vue.request, max(attentes, default=None))
+
+    async def executer(self, vue, traitement):
+        try:
+            return await traitement()
+        except (APIException, Http404) as exc:
+            return _reponse_http(vue.handle_exception(exc))
+
+
+class CatalogueAsyncView(VueAsync):
+    """
+    Lecture asynchrone d'une vue du catalogue (``CatalogueCacheMixin``).
+
+    Le cache est lu sous les mêmes clés et ETag que la vue synchrone (voir
+    ``alire_catalogue``) ; en cas d'absence, la liste ou l'objet est lu avec
+    l'ORM asynchrone. Les écritures et l'API navigable (``Accept:
+    text/html``) passent par la vue DRF.
+    """
+
+    lecture_replique = True
+
+    async def get(self, request, *args, **kwargs):
+        if "text/html" in request.headers.get("Accept", ""):
+            return await self.deleguer(request, *args, **kwargs)
+        vue = self.preparer_vue_drf(request)
+
+        async def lire():
+            await self.authentifier(vue)
+            return await self.lire(vue)
+
+        return await self.executer(vue, lire)
+
+    async def lire(self, vue):
+        async def calculer():
+            if isinstance(vue, mixins.ListModelMixin):
+                return await self.lister(vue)
+            return await self.detailler(vue)
+
+        donnees, etag = await alire_catalogue(vue.request, vue.cache_modeles, calculer)
+        response = HttpResponse(status=304) if donnees is None else _json(donnees)
+        entetes_catalogue(response, etag)
+        patch_vary_headers(response, ["Accept"])
+        return response
+
+    async def filtrer(self, vue, queryset):
+        # django-filter valide en base les filtres de relation (categorie) :
+        # seule lecture qui repasse par un thread
+        filtres = set(getattr(vue, "filterset_fields", None) or ())
+        if filtres & set(vue.request.query_params):
+            return await sync_to_async(vue.filter_queryset)(queryset)
+        return vue.filter_queryset(queryset)
+
+    async def lister(self, vue):
+        queryset = await self.filtrer(vue, vue.get_queryset())
+        lecteur = None
+        if isinstance(vue, ListeRapideMixin):
+            lecteur = LecteurValeurs(vue.get_serializer())
+            if lecteur.disponible:
+                queryset = vue.valeurs(queryset, lecteur)
+            else:
+                lecteur = None
+
+        page = None
+        if vue.paginator is not None:
+            page = await vue.paginator.apaginate_queryset(
+                queryset, vue.request, view=vue
+            )
+        lignes = page if page is not None else [ligne async for ligne in queryset]
+        if lecteur is not None:
+            donnees = lecteur.convertir(lignes)
+        else:
+            donnees = vue.get_serializer(lignes, many=True).data
+        if page is not None:
+            return vue.get_paginated_response(donnees).data
+        return donnees
+
+    async def detailler(self, vue):
+        queryset = await self.filtrer(vue, vue.get_queryset())
+        valeur = vue.kwargs[vue.lookup_url_kwarg or vue.lookup_field]
+        instance = await queryset.filter(**{vue.lookup_field: valeur}).afirst()
+        if instance is None:
+            raise Http404
+        vue.check_object_permissions(vue.request, instance)
+        return vue.get_serializer(instance).data
+
+    async def post(self, request, *args, **kwargs):
+        return await self.deleguer(request, *args, **kwargs)
+
+    async def put(self, request, *args, **kwargs):
+        return await self.deleguer(request, *args, **kwargs)
+
+    async def patch(self, request, *args, **kwargs):
+        return await self.deleguer(request, *args, **kwargs)
+
+    async def delete(self, request, *args, **kwargs):
+        return await self.deleguer(request, *args, **kwargs)
+
+
+class IdentifiantsSerializer(serializers.Serializer):
+    username = serializers.CharField(write_only=True)
+    password = PasswordField()
+
+
+class ConnexionAsyncView(VueAsync):
+    """Version asynchrone de ``CustomTokenObtainPairView``."""
+
+    vue_drf = CustomTokenObtainPairView
+
+    async def post(self, request, *args, **kwargs):
+        vue = self.preparer_vue_drf(request)
+
+        async def connecter():
+            await self.limiter(vue)
+            identifiants = IdentifiantsSerializer(data=vue.request.data)
+            identifiants.is_valid(raise_exception=True)
+            # Backends d'AUTHENTICATION_BACKENDS et signal user_login_failed,
+            # comme TokenObtainSerializer ; le hachage s'exécute dans un thread
+            utilisateur = await aauthenticate(
+                request,
+                username=identifiants.validated_data["username"],
+                password=identifiants.validated_data["password"],
+            )
+            if not api_settings.USER_AUTHENTICATION_RULE(utilisateur):
+                raise AuthenticationFailed(
+                    TokenObtainSerializer.default_error_messages["no_active_account"],
+                    "no_active_account",
+                )
+            # Aucune écriture : la liste noire des refresh tokens est dans Redis
+            refresh = vue.get_serializer_class().get_token(utilisateur)
+            return reponse_jetons(
+                {"refresh": str(refresh), "access": str(refresh.access_token)},
+                _json,
+            )
+
+        return await self.executer(vue, connecter)
+
+
+class RafraichissementAsyncView(VueAsync):
+    """Version asynchrone de ``CustomTokenRefreshView``."""
+
+    vue_drf = CustomTokenRefreshView
+
+    async def post(self, request, *args, **kwargs):
+        vue = self.preparer_vue_drf(request)
+
+        async def rafraichir():
+            await self.limiter(vue)
+            serializer = vue.get_serializer(
+                data={"refresh": request.COOKIES.get("refresh_token")}
+            )
+            try:
+                # Liste noire (Redis) et lecture de l'utilisateur : synchrones
+                await sync_to_async(serializer.is_valid)(raise_exception=True)
+            except TokenError as e:
+                raise InvalidToken(e.args[0]) from e
+            return reponse_jetons(serializer.validated_data, _json)
+
+        return await self.executer(vue, rafraichir)
+
+
+class DeconnexionAsyncView(VueAsync):
+    """Version asynchrone de ``LogoutView``."""
+
+    vue_drf = LogoutView
+
+    async def post(self, request, *args, **kwargs):
+        vue = self.preparer_vue_drf(request)
+
+        async def deconnecter():
+            await self.authentifier(vue)
+            return await sync_to_async(reponse_deconnexion)(request, _json)
+
+        return await self.executer(vue, deconnecter)
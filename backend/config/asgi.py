@@ -3,6 +3,12 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Déploiement (les vues du catalogue et des tokens sont asynchrones ; un
+processus sert de nombreuses connexions simultanées) :
+
+    uvicorn config.asgi:application --workers 4
+    gunicorn config.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
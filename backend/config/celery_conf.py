@@ -1,8 +1,24 @@
 import os
 from celery import Celery
+from celery.signals import task_postrun, task_prerun
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 app = Celery("config")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
+
+
+@task_prerun.connect
+@task_postrun.connect
+def fermer_connexions_obsoletes(task=None, **kwargs):
+    """
+    ``close_old_connections`` autour de chaque tâche, comme Django autour de
+    chaque requête : une connexion expirée (CONN_MAX_AGE) ou inutilisable est
+    fermée, les autres sont réutilisées par la tâche suivante.
+    """
+    if task is None or getattr(task.request, "is_eager", False):
+        return
+    from django.db import close_old_connections
+
+    close_old_connections()
@@ -10,7 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
@@ -51,6 +55,54 @@ CELERY_TASK_REJECT_ON_WORKER_LOST = True
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
 CELERY_TASK_SOFT_TIME_LIMIT = 25 * 60  # 25 minutes
+# Rendu des factures (CPU) et envoi des emails (réseau) sur des files séparées,
+# servies par des workers dimensionnés différemment, par exemple :
+#   celery -A config worker -Q factures -c <nombre de cœurs>
+#   celery -A config worker -Q emails -c 4
+#   celery -A config worker -Q commandes -c 2
+#   celery -A config worker -Q images -c <nombre de cœurs>
+#   celery -A config worker -Q celery
+CELERY_TASK_ROUTES = {
+    "api.tasks.generer_facture": {"queue": "factures"},
+    "api.tasks.envoyer_cles_email_async": {"queue": "emails"},
+    "api.tasks.envoyer_factures_en_attente": {"queue": "emails"},
+    "api.tasks.rejouer_emails_echec": {"queue": "emails"},
+    "api.tasks.reprendre_factures_non_envoyees": {"queue": "emails"},
+    "api.tasks.traiter_commandes": {"queue": "commandes"},
+    "api.tasks.generer_variantes_image": {"queue": "images"},
+}
+# Celery ferme toutes les connexions autour de chaque tâche ; avec
+# CELERY_DB_REUSE_MAX, il ne le fait que toutes les N tâches. Entre-temps,
+# celery_conf applique CONN_MAX_AGE et les vérifications de santé, comme
+# Django entre deux requêtes
+CELERY_DB_REUSE_MAX = int(os.getenv("CELERY_DB_REUSE_MAX", 1000))
+CELERY_BEAT_SCHEDULE = {
+    # Agrégats journaliers lus par le tableau de bord (/api/stats/)
+    "actualiser-statistiques": {
+        "task": "api.tasks.actualiser_statistiques_journalieres",
+        "schedule": 5 * 60,
+    },
+    # Report sur StockCle des mouvements de clés écrits par les triggers
+    "appliquer-mouvements-stock": {
+        "task": "api.tasks.appliquer_mouvements_stock",
+        "schedule": 10,
+    },
+    # Filet de sécurité : vide la file des factures si aucun vidage n'est prévu
+    "envoyer-factures-en-attente": {
+        "task": "api.tasks.envoyer_factures_en_attente",
+        "schedule": 30,
+    },
+}
+
+# Cache Redis (réponses du catalogue), sur une base distincte du broker Celery
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("REDIS_CACHE_URL", "redis://localhost:6379/1"),
+        "KEY_PREFIX": "ejlogiciel",
+    }
+}
+CATALOGUE_CACHE_TIMEOUT = int(os.getenv("CATALOGUE_CACHE_TIMEOUT", 15 * 60))
 
 CSRF_COOKIE_SECURE = not DEBUG
 SESSION_COOKIE_SECURE = not DEBUG
@@ -62,6 +114,21 @@ SECURE_HSTS_INCLUDE_SUBDOMAINS = not DEBUG
 
 
 # Logging
+# Les tests (manage.py test) et les benchmarks (manage.py bench_*) écrivent
+# leurs journaux et leurs fichiers (factures PDF, qui contiennent des clés)
+# dans un répertoire temporaire supprimé à la sortie, pas dans logs/ et media/
+EXECUTION_TESTS = sys.argv[1:2] == ["test"]
+EXECUTION_JETABLE = EXECUTION_TESTS or (
+    len(sys.argv) > 1 and sys.argv[1].startswith("bench_")
+)
+if EXECUTION_JETABLE:
+    REPERTOIRE_TEMPORAIRE = tempfile.mkdtemp(prefix="ejlogiciel-")
+    atexit.register(shutil.rmtree, REPERTOIRE_TEMPORAIRE, ignore_errors=True)
+    LOG_DIR = os.path.join(REPERTOIRE_TEMPORAIRE, "logs")
+else:
+    LOG_DIR = os.getenv("DJANGO_LOG_DIR", os.path.join(BASE_DIR, "logs"))
+os.makedirs(LOG_DIR, exist_ok=True)
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -75,7 +142,7 @@ LOGGING = {
         "file": {
             "level": "INFO",
             "class": "logging.FileHandler",
-            "filename": os.path.join(BASE_DIR, "logs/django.log"),
+            "filename": os.path.join(LOG_DIR, "django.log"),
             "formatter": "verbose",
         },
         "console": {
@@ -90,9 +157,22 @@ LOGGING = {
             "level": "INFO",
             "propagate": True,
         },
+        "api": {
+            "handlers": ["file", "console"],
+            "level": "INFO",
+            "propagate": False,
+        },
     },
 }
 
+# Instrumentation des vues (en-tête Server-Timing et logs api.instrumentation) :
+# fraction des requêtes mesurées, et seuil en millisecondes au-delà duquel une
+# requête non mesurée est journalisée quand même
+INSTRUMENTATION_ECHANTILLON = float(
+    os.getenv("INSTRUMENTATION_ECHANTILLON", 1.0 if DEBUG else 0.05)
+)
+INSTRUMENTATION_SEUIL_LENT = int(os.getenv("INSTRUMENTATION_SEUIL_LENT", 1000))
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -102,6 +182,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "api",
     "rest_framework",
     "corsheaders",
@@ -115,10 +196,43 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.IsAuthenticated",
     ],
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.authentification.CachedJWTAuthentication",
     ],
     "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
+    "DEFAULT_PAGINATION_CLASS": "api.pagination.KeysetPagination",
+    "DEFAULT_THROTTLE_CLASSES": ["api.limitation.SeauJetonsThrottle"],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    # Nombre de proxys de confiance devant Django (nginx, répartiteur) : l'IP
+    # d'un visiteur est lue dans X-Forwarded-For à cette profondeur. À 0,
+    # REMOTE_ADDR seul fait foi ; l'en-tête, fourni par le client, ne doit
+    # jamais servir de clé de limitation sans proxy qui le réécrit
+    "NUM_PROXIES": int(os.getenv("NUM_PROXIES", 0)),
+}
+
+# Limitation de débit (api.limitation) : un seau de jetons par portée de vue
+# (throttle_scope, « api » par défaut) et par utilisateur, ou par adresse IP
+# pour les visiteurs (« anonyme »). Un rôle absent d'une portée a le débit
+# d'« anonyme » ; None : pas de limite. Les requêtes refusées reçoivent un 429
+# avec Retry-After, sans toucher à la base. L'adresse d'un visiteur dépend de
+# REST_FRAMEWORK["NUM_PROXIES"]. Les seaux sont tenus par un script Lua :
+# LIMITATION_DEBIT_URL doit désigner un serveur Redis.
+LIMITATION_DEBIT_URL = os.getenv("LIMITATION_DEBIT_URL", CACHES["default"]["LOCATION"])
+LIMITES_DEBIT = {
+    "api": {
+        "anonyme": "60/min",
+        "client": "120/min",
+        "vendeur": "600/min",
+        "admin": None,
+    },
+    "catalogue": {
+        "anonyme": "120/min",
+        "client": "300/min",
+        "vendeur": "1200/min",
+        "admin": None,
+    },
+    "inscription": {"anonyme": "5/h"},
+    "connexion": {"anonyme": "10/min"},
+    "rafraichissement": {"anonyme": "30/min"},
 }
 
 SIMPLE_JWT = {
@@ -127,9 +241,23 @@ SIMPLE_JWT = {
     "ROTATE_REFRESH_TOKENS": True,  # Génère un nouveau refresh token à chaque utilisation
     "BLACKLIST_AFTER_ROTATION": True,  # Blackliste l'ancien refresh token pour éviter de le générer à nouveau
     "AUTH_HEADER_TYPES": ("Bearer",),
+    "TOKEN_REFRESH_SERIALIZER": "api.jetons.RefreshRedisSerializer",
+}
+# Liste noire des refresh tokens (rotation, déconnexion) : une clé Redis par
+# token révoqué, qui expire avec lui. Base persistante, pas le cache : une
+# éviction rendrait valide un token révoqué
+JWT_LISTE_NOIRE_URL = os.getenv("JWT_LISTE_NOIRE_URL", CELERY_BROKER_URL)
+# Les tables de token_blacklist ne sont plus alimentées ; purger_jetons les vide
+CELERY_BEAT_SCHEDULE["purger-liste-noire-jwt"] = {
+    "task": "api.tasks.purger_liste_noire_jwt",
+    "schedule": 24 * 60 * 60,
 }
+# Durée de vie de l'utilisateur authentifié en cache (CachedJWTAuthentication)
+AUTH_CACHE_TIMEOUT = int(os.getenv("AUTH_CACHE_TIMEOUT", 5 * 60))
 
 MIDDLEWARE = [
+    # En premier : le temps total couvre tous les autres middlewares
+    "api.instrumentation.InstrumentationMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -158,6 +286,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "config.wsgi.application"
+ASGI_APPLICATION = "config.asgi.application"
 
 
 # Database
@@ -171,9 +300,40 @@ DATABASES = {
         "PASSWORD": os.getenv("DB_PASSWORD"),
         "HOST": os.getenv("DB_HOST"),
         "PORT": os.getenv("DB_PORT"),
+        # Connexions persistantes : une requête ou une tâche Celery réutilise
+        # la connexion de son thread, vérifiée avant réemploi
+        "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Pool de connexions de psycopg 3 (paquet « psycopg[pool] », à la place de
+# psycopg2), à préférer sous ASGI où les connexions persistantes sont liées
+# aux threads de sync_to_async. Incompatible avec CONN_MAX_AGE
+if os.getenv("DB_POOL") == "True":
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("DB_POOL_MIN", 2)),
+            "max_size": int(os.getenv("DB_POOL_MAX", 10)),
+            "timeout": int(os.getenv("DB_POOL_TIMEOUT", 10)),
+        }
+    }
+
+# Réplique en lecture : les requêtes GET et HEAD des vues qui l'acceptent
+# (lecture_replique : catalogue, statistiques) y lisent hors transaction, voir
+# api.replique. Les autres vues, dont l'état d'une commande ou d'une action
+# juste créée, lisent la base principale
+if os.getenv("DB_REPLICA_HOST"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": os.getenv("DB_REPLICA_HOST"),
+        "PORT": os.getenv("DB_REPLICA_PORT", DATABASES["default"]["PORT"]),
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_ROUTERS = ["api.replique.RouteurReplique"]
+    MIDDLEWARE.append("api.replique.RepliqueMiddleware")
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -210,8 +370,14 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Logo des factures PDF (remplacé par le nom de l'entreprise s'il est absent)
+FACTURE_LOGO = os.path.join(BASE_DIR, "static", "ej.jpg")
+
 MEDIA_URL = "/media/"
-MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+if EXECUTION_JETABLE:
+    MEDIA_ROOT = os.path.join(REPERTOIRE_TEMPORAIRE, "media")
+else:
+    MEDIA_ROOT = os.getenv("DJANGO_MEDIA_ROOT", os.path.join(BASE_DIR, "media"))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -229,6 +395,59 @@ EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL")
 
+# File Redis des factures à envoyer par lots sur une connexion SMTP partagée
+EMAIL_FILE_ATTENTE_URL = os.getenv("EMAIL_FILE_ATTENTE_URL", CELERY_BROKER_URL)
+EMAIL_TAILLE_LOT = int(os.getenv("EMAIL_TAILLE_LOT", 50))
+EMAIL_DELAI_LOT = int(os.getenv("EMAIL_DELAI_LOT", 2))  # secondes
+
+# Reprise des EmailEchec : au plus EMAIL_REPRISE_LOT emails toutes les
+# EMAIL_REPRISE_INTERVALLE secondes, pour les échecs de plus de
+# EMAIL_REPRISE_DELAI secondes (les tentatives de la tâche d'envoi d'abord)
+EMAIL_REPRISE_LOT = int(os.getenv("EMAIL_REPRISE_LOT", 20))
+EMAIL_REPRISE_INTERVALLE = int(os.getenv("EMAIL_REPRISE_INTERVALLE", 60))
+EMAIL_REPRISE_DELAI = int(os.getenv("EMAIL_REPRISE_DELAI", 60 * 60))
+EMAIL_REPRISE_ATTENTE_MAX = int(os.getenv("EMAIL_REPRISE_ATTENTE_MAX", 6 * 60 * 60))
+CELERY_BEAT_SCHEDULE["rejouer-emails-echec"] = {
+    "task": "api.tasks.rejouer_emails_echec",
+    "schedule": EMAIL_REPRISE_INTERVALLE,
+}
+# Factures rendues mais jamais envoyées (file Redis perdue, worker arrêté) :
+# remises en file après EMAIL_FACTURE_DELAI_REPRISE secondes
+EMAIL_FACTURE_DELAI_REPRISE = int(os.getenv("EMAIL_FACTURE_DELAI_REPRISE", 10 * 60))
+CELERY_BEAT_SCHEDULE["reprendre-factures-non-envoyees"] = {
+    "task": "api.tasks.reprendre_factures_non_envoyees",
+    "schedule": 5 * 60,
+}
+
+# En-tête Idempotency-Key de POST /api/actions/ : durée de conservation des
+# réponses, et délai après lequel une requête sans réponse (interrompue) peut
+# être reprise par un nouvel envoi de la même clé
+IDEMPOTENCE_DUREE = int(os.getenv("IDEMPOTENCE_DUREE", 24 * 60 * 60))
+IDEMPOTENCE_DELAI_TRAITEMENT = int(os.getenv("IDEMPOTENCE_DELAI_TRAITEMENT", 120))
+CELERY_BEAT_SCHEDULE["purger-cles-idempotence"] = {
+    "task": "api.tasks.purger_cles_idempotence",
+    "schedule": 60 * 60,
+}
+
+# Prise de commande asynchrone (pics de ventes) : POST /api/actions/ valide la
+# commande, la met en file et répond 202 ; la tâche traiter_commandes crée les
+# actions par lots de COMMANDES_TAILLE_LOT, COMMANDES_DELAI_LOT secondes après
+# la première commande en attente. Sans COMMANDES_ASYNC, le client peut
+# demander ce mode avec l'en-tête « Prefer: respond-async ».
+COMMANDES_ASYNC = os.getenv("COMMANDES_ASYNC") == "True"
+COMMANDES_FILE_URL = os.getenv("COMMANDES_FILE_URL", CELERY_BROKER_URL)
+COMMANDES_TAILLE_LOT = int(os.getenv("COMMANDES_TAILLE_LOT", 50))
+COMMANDES_DELAI_LOT = float(os.getenv("COMMANDES_DELAI_LOT", 0.5))
+CELERY_BEAT_SCHEDULE["traiter-commandes"] = {
+    "task": "api.tasks.traiter_commandes",
+    "schedule": 30,
+}
+
+# Métriques Prometheus (/api/metrics/), partagées par tous les processus dans
+# Redis. Le collecteur s'authentifie avec « Authorization: Jeton <METRIQUES_JETON> »
+METRIQUES_URL = os.getenv("METRIQUES_URL", CELERY_BROKER_URL)
+METRIQUES_JETON = os.getenv("METRIQUES_JETON")
+
 
 SPECTACULAR_SETTINGS = {
     "TITLE": "EJ Logiciel API",
@@ -261,3 +480,15 @@ SPECTACULAR_SETTINGS = {
         {"name": "Statistiques", "description": "Statistiques et tableaux de bord"},
     ],
 }
+
+# manage.py test : les données Redis (cache, broker, files, listes noires,
+# limitation de débit, métriques) vont dans une base réservée aux tests, que
+# les tests vident librement ; jamais dans celles d'un poste de développement.
+# Aucune requête n'est échantillonnée (InstrumentationTests règle la sienne)
+REDIS_TESTS_URL = os.getenv("REDIS_TESTS_URL", "redis://localhost:6379/15")
+if EXECUTION_TESTS:
+    CACHES["default"].update(LOCATION=REDIS_TESTS_URL, KEY_PREFIX="tests")
+    CELERY_BROKER_URL = CELERY_RESULT_BACKEND = REDIS_TESTS_URL
+    JWT_LISTE_NOIRE_URL = EMAIL_FILE_ATTENTE_URL = REDIS_TESTS_URL
+    COMMANDES_FILE_URL = METRIQUES_URL = LIMITATION_DEBIT_URL = REDIS_TESTS_URL
+    INSTRUMENTATION_ECHANTILLON = 0.0